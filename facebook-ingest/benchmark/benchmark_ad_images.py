@@ -0,0 +1,136 @@
+# Benchmark of adjust_ad_image_data of facebook_ingest.py against the row by row filter it replaced
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Any
+
+import pandas as pd
+
+from fake_graph_api import make_object
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Set benchmark constants
+ACCOUNT = 'act_100000'
+LATEST_EPOCH = 1650000000
+UPDATED_DAYS = 60
+REPEATS = 3
+
+
+def baseline_adjust_ad_image_data(df: pd.DataFrame, latest_epoch: str) -> pd.DataFrame:
+    """
+    Flatten and filter ad_image data as adjust_ad_image_data did before it was vectorized: the
+    creatives are exploded first, then the updated_time of every row is parsed in Python.
+    """
+    def _sanitize_timestamp(timestamp: str) -> int:
+        return int(datetime.datetime.strptime(timestamp[:-5], "%Y-%m-%dT%H:%M:%S").timestamp())
+
+    df = df.explode('creatives')
+    df['updated_time_timestamp'] = df['updated_time'].apply(_sanitize_timestamp)
+    df = df.loc[df['updated_time_timestamp'] >= int(latest_epoch)]
+    df = df.drop('updated_time_timestamp', axis=1)
+
+    return df
+
+
+def build_library(images: int) -> pd.DataFrame:
+    """
+    Parse a fake ad image library the way the job does, up to the DataFrame handed to
+    adjust_ad_image_data. The images were updated over UPDATED_DAYS days, the last half of them
+    after LATEST_EPOCH.
+
+    :param images: int - Number of ad images
+    :return: pd.DataFrame - Records of the ad images
+    """
+    import facebook_ingest
+
+    object_fields = facebook_ingest.fields['ad_image']
+    extractors = facebook_ingest.compile_extractors(object_fields)
+    accumulator = facebook_ingest.RecordAccumulator(columns=object_fields)
+    start = LATEST_EPOCH - UPDATED_DAYS * 24 * 60 * 60 // 2
+    for i in range(images):
+        object = make_object('ad_image', ACCOUNT, i, object_fields)
+        updated_time = start + i * UPDATED_DAYS * 24 * 60 * 60 // images
+        object['updated_time'] = datetime.datetime.utcfromtimestamp(updated_time) \
+            .strftime('%Y-%m-%dT%H:%M:%S+0000')
+        accumulator.append(facebook_ingest.parse_object(object, extractors))
+
+    return accumulator.to_dataframe()
+
+
+def measure(adjust, library: pd.DataFrame) -> Dict[str, Any]:
+    """
+    :param adjust: Callable - Function of the DataFrame and the latest epoch
+    :param library: pd.DataFrame - Records of the ad images
+    :return: Dict - Best time of REPEATS runs, in seconds, and the adjusted DataFrame
+    """
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        adjusted = adjust(library.copy(), str(LATEST_EPOCH))
+        best = min(best, time.perf_counter() - start)
+
+    return {'seconds': round(best, 4), 'dataframe': adjusted}
+
+
+def benchmark(images: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Run both filters on fake ad image libraries, and check that they keep the same rows.
+
+    :param images: List - Sizes of the libraries
+    :return: Dict - Rows kept and time of both filters, keyed by library size
+    """
+    import facebook_ingest
+
+    results = {}
+    for n_images in images:
+        library = build_library(n_images)
+        baseline = measure(baseline_adjust_ad_image_data, library)
+        vectorized = measure(facebook_ingest.adjust_ad_image_data, library)
+
+        results[n_images] = {
+            'rows': len(vectorized['dataframe']),
+            'same_rows': baseline['dataframe'].reset_index(drop=True).equals(
+                vectorized['dataframe'].reset_index(drop=True)),
+            'baseline_seconds': baseline['seconds'],
+            'vectorized_seconds': vectorized['seconds'],
+            'speedup': round(baseline['seconds'] / vectorized['seconds'], 1)
+        }
+
+    return results
+
+
+def main(argv: List[str]) -> Dict[int, Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Compare adjust_ad_image_data with the row by row filter it replaced, on "
+                    "fake ad image libraries")
+    parser.add_argument('--images', default='1000,10000,100000',
+                        help="comma separated sizes of the ad image libraries")
+    parser.add_argument('--output', default='', help="file the results are written to as JSON")
+    args = parser.parse_args(argv[1:])
+
+    # The Glue job runs in UTC, which the baseline relies on to read the updated_time
+    os.environ['TZ'] = 'UTC'
+    time.tzset()
+
+    results = benchmark(images=[int(images) for images in args.images.split(',')])
+
+    print(f"{'images':>8} {'rows':>8} {'same_rows':>10} {'baseline_s':>11} "
+          f"{'vectorized_s':>13} {'speedup':>8}")
+    for n_images, result in results.items():
+        print(f"{n_images:>8} {result['rows']:>8} {str(result['same_rows']):>10} "
+              f"{result['baseline_seconds']:>11} {result['vectorized_seconds']:>13} "
+              f"{result['speedup']:>8}")
+
+    if args.output != '':
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv)
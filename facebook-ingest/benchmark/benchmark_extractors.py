@@ -0,0 +1,169 @@
+# Benchmark of the compiled field extractors of facebook_ingest.py against the per-field branching
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Any
+
+from fake_graph_api import make_object
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Set benchmark constants
+ACCOUNT = 'act_100000'
+OBJECT_TYPES = ['ad', 'ad_set', 'campaign', 'ad_image', 'ad_insights']
+REPEATS = 3
+
+
+def baseline_parse(object: Dict[str, Any], object_fields: List[str]) -> Dict[str, Any]:
+    """
+    Parse an object as the if/elif chain of get_objects did before compile_extractor.
+    """
+    values_holder = {}
+    for field in object_fields:
+        key = field
+        if field == 'creative':
+            value = object[field]['id'] if field in object else ''
+        elif field == 'pacing_type':
+            value = object[field][0] if field in object else ''
+        elif field in ['cost_per_outbound_click', 'outbound_clicks']:
+            value = object[field][0]['value'] if field in object else ''
+        elif field == 'targeting':
+            value = object[field]
+            for internal_key in object[field].keys():
+                if 'publisher_platforms' in object[field].keys():
+                    internal_value = object[field][internal_key]
+                    values_holder[internal_key] = internal_value
+                else:
+                    values_holder['publisher_platforms'] = ''
+
+                if 'instagram_positions' in object[field].keys():
+                    internal_value = object[field][internal_key]
+                    values_holder[internal_key] = internal_value
+                else:
+                    values_holder['instagram_positions'] = ''
+
+                if 'facebook_positions' in object[field].keys():
+                    internal_value = object[field][internal_key]
+                    values_holder[internal_key] = internal_value
+                else:
+                    values_holder['facebook_positions'] = ''
+
+                if 'device_platforms' in object[field].keys():
+                    internal_value = object[field][internal_key]
+                    values_holder[internal_key] = internal_value
+                else:
+                    values_holder['device_platforms'] = ''
+        else:
+            value = object[field] if field in object else ''
+
+        values_holder[key] = value
+
+    return values_holder
+
+
+def build_objects(object_type: str, rows: int, limit: int) -> List[Any]:
+    """
+    Build the objects of fake raw JSON pages of the Graph API as get_edge_page does.
+
+    :param object_type: str - Object type to generate
+    :param rows: int - Number of objects
+    :param limit: int - Objects per page
+    :return: List - Objects of the SDK class of the object type
+    """
+    import facebook_ingest
+    from facebook_business.adobjects.adsinsights import AdsInsights
+    from facebook_business.adobjects.objectparser import ObjectParser
+
+    object_fields = facebook_ingest.fields[object_type]
+    target_class = AdsInsights if object_type == 'ad_insights' \
+        else facebook_ingest.get_object_class(object_type)
+    objects = []
+    for start in range(0, rows, limit):
+        page = {'data': [make_object(object_type, ACCOUNT, i, object_fields)
+                         for i in range(start, min(start + limit, rows))]}
+        objects.extend(ObjectParser(target_class=target_class).parse_multiple(page))
+
+    return objects
+
+
+def measure(parse, objects: List[Any]) -> Dict[str, Any]:
+    """
+    :param parse: Callable - Function of an object, returning its record
+    :param objects: List - Objects of the SDK class of the object type
+    :return: Dict - Best time of REPEATS runs, in seconds, and the records
+    """
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        records = [parse(object) for object in objects]
+        best = min(best, time.perf_counter() - start)
+
+    return {'seconds': round(best, 4), 'records': records}
+
+
+def benchmark(object_types: List[str], rows: int, limit: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse the same objects with both parsings, and check that they return the same records. The
+    objects are built up front, so that only the parsing is measured.
+
+    :param object_types: List - Object types to benchmark
+    :param rows: int - Objects of every object type
+    :param limit: int - Objects per page
+    :return: Dict - Time and rows per second of both parsings, keyed by object type
+    """
+    import facebook_ingest
+
+    results = {}
+    for object_type in object_types:
+        object_fields = facebook_ingest.fields[object_type]
+        extractors = facebook_ingest.compile_extractors(object_fields)
+        objects = build_objects(object_type=object_type, rows=rows, limit=limit)
+        baseline = measure(lambda object: baseline_parse(object, object_fields), objects)
+        compiled = measure(lambda object: facebook_ingest.parse_object(object, extractors),
+                           objects)
+
+        results[object_type] = {
+            'same_records': baseline['records'] == compiled['records'],
+            'baseline_seconds': baseline['seconds'],
+            'compiled_seconds': compiled['seconds'],
+            'baseline_rows_per_second': round(rows / baseline['seconds']),
+            'compiled_rows_per_second': round(rows / compiled['seconds']),
+            'speedup': round(baseline['seconds'] / compiled['seconds'], 1)
+        }
+
+    return results
+
+
+def main(argv: List[str]) -> Dict[str, Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Compare the parsing throughput of the compiled field extractors with the "
+                    "per-field branching they replaced, on fake Graph API pages")
+    parser.add_argument('--object_types', default=','.join(OBJECT_TYPES),
+                        help="comma separated object types to benchmark")
+    parser.add_argument('--rows', type=int, default=20000, help="objects of every object type")
+    parser.add_argument('--limit', type=int, default=500, help="objects per page")
+    parser.add_argument('--output', default='', help="file the results are written to as JSON")
+    args = parser.parse_args(argv[1:])
+
+    results = benchmark(object_types=args.object_types.split(','), rows=args.rows,
+                        limit=args.limit)
+
+    print(f"{'object_type':<12} {'same':>6} {'baseline_s':>11} {'compiled_s':>11} "
+          f"{'baseline_rows/s':>16} {'compiled_rows/s':>16} {'speedup':>8}")
+    for object_type, result in results.items():
+        print(f"{object_type:<12} {str(result['same_records']):>6} "
+              f"{result['baseline_seconds']:>11} {result['compiled_seconds']:>11} "
+              f"{result['baseline_rows_per_second']:>16} {result['compiled_rows_per_second']:>16} "
+              f"{result['speedup']:>8}")
+
+    if args.output != '':
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,158 @@
+# Benchmark of facebook_ingest.py against a fake Graph API and a local S3 stand-in
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+from typing import List, Dict, Any
+
+import boto3
+
+from fake_graph_api import FakeGraphApi, DEFAULT_ROWS
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Set logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Set benchmark constants
+OBJECT_TYPES = ['ad', 'ad_set', 'campaign', 'ad_insights', 'ad_image']
+CREDENTIALS = {'FB_APP_ID': 'benchmark', 'FB_APP_SECRET': 'benchmark',
+               'FB_ACCESS_TOKEN': 'benchmark'}
+AWS_ENVIRONMENT = {'AWS_ACCESS_KEY_ID': 'benchmark', 'AWS_SECRET_ACCESS_KEY': 'benchmark',
+                   'AWS_DEFAULT_REGION': 'eu-west-1'}
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_local_s3() -> Any:
+    """
+    Start moto in server mode as the local S3 stand-in.
+
+    :return: ThreadedMotoServer - Running server, listening on its _port
+    """
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=get_free_port())
+    server.start()
+    return server
+
+
+def run_job(argv: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Run the job in the current process, returning its performance report.
+
+    :param argv: List - Job arguments
+    :return: Dict - Performance report of every object type queried, keyed by object type
+    """
+    import facebook_ingest
+
+    logging.getLogger().setLevel(logging.WARNING)
+    return facebook_ingest.main(argv, credentials=CREDENTIALS)
+
+
+def benchmark(object_types: List[str], graph_url: str, s3_endpoint_url: str, bucket_name: str,
+              job_arguments: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Run the job once per object type, each one in a new process, so that the peak memory is the
+    one of the object type alone.
+
+    :param object_types: List - Object types to benchmark
+    :param graph_url: str - URL of the Graph API
+    :param s3_endpoint_url: str - URL of the S3 endpoint
+    :param bucket_name: str - Bucket of the data
+    :param job_arguments: List - Additional job arguments, e.g. ['--streaming', 'true']
+    :return: Dict - Performance report of every object type, keyed by object type
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for object_type in object_types:
+        argv = ['facebook_ingest.py', '--secret_name', 'benchmark', '--data_bucket', bucket_name,
+                '--graph_url', graph_url, '--s3_endpoint_url', s3_endpoint_url,
+                '--update_catalog', 'false', '--object_types', object_type] + job_arguments
+        with context.Pool(processes=1) as pool:
+            results.update(pool.apply(run_job, (argv,)))
+        logger.info(f"{object_type}: {results.get(object_type, {}).get('rows_per_second')} "
+                    f"rows/s")
+
+    return results
+
+
+def main(argv: List[str]) -> Dict[str, Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingestion against a fake Graph API and a local S3 stand-in, "
+                    "reporting rows per second, wall time and peak memory per object type. "
+                    "Arguments after -- are passed to the job, e.g. -- --streaming true")
+    parser.add_argument('--object_types', default=','.join(OBJECT_TYPES),
+                        help="comma separated object types to benchmark")
+    parser.add_argument('--accounts', type=int, default=3, help="number of ad accounts")
+    for object_type, rows in DEFAULT_ROWS.items():
+        parser.add_argument(f"--{object_type}_rows", type=int, default=rows,
+                            help=f"{object_type} rows of every ad account")
+    parser.add_argument('--max_limit', type=int, default=5000,
+                        help="maximum page size served by the Graph API")
+    parser.add_argument('--report_seconds', type=float, default=5,
+                        help="seconds an ad_insights report job takes to complete")
+    parser.add_argument('--calls_per_minute', type=int, default=0,
+                        help="Graph API requests allowed per minute before throttling errors, "
+                             "0 for no throttling")
+    parser.add_argument('--s3_endpoint_url', default='',
+                        help="URL of an S3 stand-in to use instead of starting moto")
+    parser.add_argument('--bucket', default='benchmark', help="bucket of the data")
+    parser.add_argument('--output', default='', help="file the results are written to as JSON")
+    parser.add_argument('job_arguments', nargs='*', help="arguments passed to the job")
+    args = parser.parse_args(argv[1:])
+
+    logging.basicConfig(format='%(asctime)s %(message)s')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    for name, value in AWS_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+
+    graph_api = FakeGraphApi(accounts=args.accounts,
+                             rows={object_type: getattr(args, f"{object_type}_rows")
+                                   for object_type in DEFAULT_ROWS},
+                             max_limit=args.max_limit, report_seconds=args.report_seconds,
+                             calls_per_minute=args.calls_per_minute).start()
+
+    local_s3 = None
+    s3_endpoint_url = args.s3_endpoint_url
+    if s3_endpoint_url == '':
+        local_s3 = start_local_s3()
+        s3_endpoint_url = f"http://127.0.0.1:{local_s3._port}"
+    boto3.client('s3', endpoint_url=s3_endpoint_url).create_bucket(
+        Bucket=args.bucket,
+        CreateBucketConfiguration={'LocationConstraint': os.environ['AWS_DEFAULT_REGION']})
+
+    try:
+        results = benchmark(object_types=args.object_types.split(','), graph_url=graph_api.url,
+                            s3_endpoint_url=s3_endpoint_url, bucket_name=args.bucket,
+                            job_arguments=args.job_arguments)
+    finally:
+        graph_api.stop()
+        if local_s3 is not None:
+            local_s3.stop()
+
+    print(f"{'object_type':<12} {'rows':>9} {'rows/s':>10} {'wall_s':>9} {'peak_mb':>9}")
+    for object_type, performance in results.items():
+        rows = performance['sections'].get('finalize_records', {}).get('rows', 0)
+        print(f"{object_type:<12} {rows:>9} {performance['rows_per_second']:>10} "
+              f"{performance['wall_seconds']:>9} {performance['peak_memory_mb']:>9}")
+    print(f"Graph API: {graph_api.stats()}")
+
+    if args.output != '':
+        with open(args.output, 'w') as f:
+            json.dump({'graph_api': graph_api.stats(), 'results': results}, f, indent=2,
+                      default=str)
+
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,144 @@
+# Benchmark of the RawRecordAccumulator of facebook_ingest.py against the parsing of cursor objects
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Any
+
+import pandas as pd
+
+from fake_graph_api import make_object
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Set benchmark constants
+ACCOUNT = 'act_100000'
+REPEATS = 3
+
+
+def build_pages(rows: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    :param rows: int - Number of ad_insights records
+    :param limit: int - Records per page
+    :return: List - Pages of ad_insights results, as returned by the Graph API
+    """
+    import facebook_ingest
+
+    object_fields = facebook_ingest.fields['ad_insights']
+    return [{'data': [make_object('ad_insights', ACCOUNT, i, object_fields)
+                      for i in range(start, min(start + limit, rows))]}
+            for start in range(0, rows, limit)]
+
+
+def cursor_records(pages: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Build the DataFrame of ad_insights results as iter_objects does without bulk_limit: every page
+    is turned into AdsInsights objects, as a Cursor of the SDK does, which are parsed into a
+    RecordAccumulator.
+
+    :param pages: List - Pages of ad_insights results
+    :return: pd.DataFrame - One row per record
+    """
+    import facebook_ingest
+    from facebook_business.adobjects.adsinsights import AdsInsights
+    from facebook_business.adobjects.objectparser import ObjectParser
+
+    object_fields = facebook_ingest.fields['ad_insights']
+    extractors = facebook_ingest.compile_extractors(object_fields)
+    accumulator = facebook_ingest.RecordAccumulator(columns=object_fields)
+    for page in pages:
+        for object in ObjectParser(target_class=AdsInsights).parse_multiple(page):
+            accumulator.append(facebook_ingest.parse_object(object, extractors))
+
+    return accumulator.to_dataframe()
+
+
+def raw_records(pages: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Build the DataFrame of ad_insights results as iter_objects does with bulk_limit, with a
+    RawRecordAccumulator.
+
+    :param pages: List - Pages of ad_insights results
+    :return: pd.DataFrame - One row per record
+    """
+    import facebook_ingest
+
+    accumulator = facebook_ingest.RawRecordAccumulator(
+        columns=facebook_ingest.fields['ad_insights'])
+    for page in pages:
+        accumulator.extend(page['data'])
+
+    return accumulator.to_dataframe()
+
+
+def measure(build, pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    :param build: Callable - Function of the pages, returning a DataFrame
+    :param pages: List - Pages of ad_insights results
+    :return: Dict - Best time of REPEATS runs, in seconds, and the DataFrame
+    """
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        dataframe = build(pages)
+        best = min(best, time.perf_counter() - start)
+
+    return {'seconds': round(best, 4), 'dataframe': dataframe}
+
+
+def benchmark(rows: List[int], limit: int) -> Dict[int, Dict[str, Any]]:
+    """
+    Build the DataFrame of the same pages both ways, and check that they are equal. The pages are
+    built up front, so that only the parsing and the accumulation are measured.
+
+    :param rows: List - Numbers of ad_insights records
+    :param limit: int - Records per page
+    :return: Dict - Time and rows per second of both ways, keyed by number of records
+    """
+    results = {}
+    for n_rows in rows:
+        pages = build_pages(rows=n_rows, limit=limit)
+        cursor = measure(cursor_records, pages)
+        raw = measure(raw_records, pages)
+
+        results[n_rows] = {
+            'same_records': raw['dataframe'].equals(cursor['dataframe']),
+            'cursor_seconds': cursor['seconds'],
+            'raw_seconds': raw['seconds'],
+            'cursor_rows_per_second': round(n_rows / cursor['seconds']),
+            'raw_rows_per_second': round(n_rows / raw['seconds']),
+            'speedup': round(cursor['seconds'] / raw['seconds'], 1)
+        }
+
+    return results
+
+
+def main(argv: List[str]) -> Dict[int, Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Compare the RawRecordAccumulator with the parsing of the AdsInsights objects "
+                    "of a cursor, on the same fake ad_insights pages")
+    parser.add_argument('--rows', default='10000,100000',
+                        help="comma separated numbers of ad_insights records")
+    parser.add_argument('--limit', type=int, default=500, help="records per page")
+    parser.add_argument('--output', default='', help="file the results are written to as JSON")
+    args = parser.parse_args(argv[1:])
+
+    results = benchmark(rows=[int(rows) for rows in args.rows.split(',')], limit=args.limit)
+
+    print(f"{'rows':>8} {'same':>6} {'cursor_s':>9} {'raw_s':>7} {'cursor_rows/s':>14} "
+          f"{'raw_rows/s':>11} {'speedup':>8}")
+    for n_rows, result in results.items():
+        print(f"{n_rows:>8} {str(result['same_records']):>6} {result['cursor_seconds']:>9} "
+              f"{result['raw_seconds']:>7} {result['cursor_rows_per_second']:>14} "
+              f"{result['raw_rows_per_second']:>11} {result['speedup']:>8}")
+
+    if args.output != '':
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,162 @@
+# Benchmark of the RecordAccumulator of facebook_ingest.py against the per-row DataFrame append
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Any, Iterator
+
+import pandas as pd
+
+from fake_graph_api import make_object, DEFAULT_LIMIT
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Set benchmark constants
+ACCOUNT = 'act_100000'
+OBJECT_TYPES = ['ad_set', 'ad_insights']
+REPEATS = 3
+
+
+def iter_cursor(object_type: str, rows: int) -> Iterator[Any]:
+    """
+    Yield fake Graph API objects of an ad account as a Cursor of the SDK does, page by page of
+    DEFAULT_LIMIT objects.
+
+    :param object_type: str - Object type to generate
+    :param rows: int - Number of objects
+    :return: Iterator - Objects of the SDK class of the object type
+    """
+    import facebook_ingest
+    from facebook_business.adobjects.adsinsights import AdsInsights
+    from facebook_business.adobjects.objectparser import ObjectParser
+
+    object_fields = facebook_ingest.fields[object_type]
+    target_class = AdsInsights if object_type == 'ad_insights' \
+        else facebook_ingest.get_object_class(object_type)
+    parser = ObjectParser(target_class=target_class)
+    for start in range(0, rows, DEFAULT_LIMIT):
+        page = {'data': [make_object(object_type, ACCOUNT, i, object_fields)
+                         for i in range(start, min(start + DEFAULT_LIMIT, rows))]}
+        for object in parser.parse_multiple(page):
+            yield object
+
+
+def baseline_records(object_type: str, objects: Iterator[Any]) -> pd.DataFrame:
+    """
+    Build the DataFrame of an object type as get_objects did before RecordAccumulator: every
+    record becomes a one-row DataFrame, appended to the DataFrame of the previous ones.
+
+    :param object_type: str - Object type of the objects
+    :param objects: Iterator - Objects returned by a cursor
+    :return: pd.DataFrame - One row per object
+    """
+    import facebook_ingest
+
+    extractors = facebook_ingest.compile_extractors(facebook_ingest.fields[object_type])
+    storing_dataframe = pd.DataFrame(columns=facebook_ingest.fields[object_type])
+    for object in objects:
+        df_ = pd.DataFrame([facebook_ingest.parse_object(object, extractors)], index=[0])
+        # DataFrame.append, removed from recent pandas, was a concat of the two DataFrames
+        storing_dataframe = pd.concat([storing_dataframe, df_])
+
+    return storing_dataframe
+
+
+def accumulated_records(object_type: str, objects: Iterator[Any]) -> pd.DataFrame:
+    """
+    Build the DataFrame of an object type as iter_objects does, with a RecordAccumulator.
+
+    :param object_type: str - Object type of the objects
+    :param objects: Iterator - Objects returned by a cursor
+    :return: pd.DataFrame - One row per object
+    """
+    import facebook_ingest
+
+    extractors = facebook_ingest.compile_extractors(facebook_ingest.fields[object_type])
+    accumulator = facebook_ingest.RecordAccumulator(columns=facebook_ingest.fields[object_type])
+    for object in objects:
+        accumulator.append(facebook_ingest.parse_object(object, extractors))
+
+    return accumulator.to_dataframe()
+
+
+def measure(build, object_type: str, objects: List[Any]) -> Dict[str, Any]:
+    """
+    :param build: Callable - Function of the object type and the objects, returning a DataFrame
+    :param object_type: str - Object type of the objects
+    :param objects: List - Objects returned by a cursor
+    :return: Dict - Best time of REPEATS runs, in seconds, and the DataFrame
+    """
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        dataframe = build(object_type, iter(objects))
+        best = min(best, time.perf_counter() - start)
+
+    return {'seconds': round(best, 4), 'dataframe': dataframe}
+
+
+def benchmark(object_types: List[str], rows: List[int]) -> Dict[str, Dict[int, Dict[str, Any]]]:
+    """
+    Build the DataFrame of fake cursors of growing sizes both ways, and check that they hold the
+    same records. The objects are built up front, so that only the parsing and the accumulation
+    are measured.
+
+    :param object_types: List - Object types to benchmark
+    :param rows: List - Sizes of the cursors
+    :return: Dict - Time per row of both ways, keyed by object type and cursor size
+    """
+    results = {}
+    for object_type in object_types:
+        results[object_type] = {}
+        for n_rows in rows:
+            objects = list(iter_cursor(object_type, n_rows))
+            baseline = measure(baseline_records, object_type, objects)
+            accumulated = measure(accumulated_records, object_type, objects)
+
+            results[object_type][n_rows] = {
+                'same_records': baseline['dataframe'].reset_index(drop=True).astype(str).equals(
+                    accumulated['dataframe'].astype(str)),
+                'baseline_seconds': baseline['seconds'],
+                'accumulator_seconds': accumulated['seconds'],
+                'baseline_us_per_row': round(baseline['seconds'] / n_rows * 1e6, 1),
+                'accumulator_us_per_row': round(accumulated['seconds'] / n_rows * 1e6, 1),
+                'speedup': round(baseline['seconds'] / accumulated['seconds'], 1)
+            }
+
+    return results
+
+
+def main(argv: List[str]) -> Dict[str, Dict[int, Dict[str, Any]]]:
+    parser = argparse.ArgumentParser(
+        description="Compare the RecordAccumulator with the per-row DataFrame append it replaced, "
+                    "on fake cursors of growing sizes")
+    parser.add_argument('--object_types', default=','.join(OBJECT_TYPES),
+                        help="comma separated object types to benchmark")
+    parser.add_argument('--rows', default='500,1000,2000,4000',
+                        help="comma separated sizes of the cursors")
+    parser.add_argument('--output', default='', help="file the results are written to as JSON")
+    args = parser.parse_args(argv[1:])
+
+    results = benchmark(object_types=args.object_types.split(','),
+                        rows=[int(rows) for rows in args.rows.split(',')])
+
+    print(f"{'object_type':<12} {'rows':>7} {'same':>6} {'baseline_s':>11} {'accumulator_s':>14} "
+          f"{'baseline_us/row':>16} {'accumulator_us/row':>19} {'speedup':>8}")
+    for object_type, object_results in results.items():
+        for n_rows, result in object_results.items():
+            print(f"{object_type:<12} {n_rows:>7} {str(result['same_records']):>6} "
+                  f"{result['baseline_seconds']:>11} {result['accumulator_seconds']:>14} "
+                  f"{result['baseline_us_per_row']:>16} {result['accumulator_us_per_row']:>19} "
+                  f"{result['speedup']:>8}")
+
+    if args.output != '':
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv)
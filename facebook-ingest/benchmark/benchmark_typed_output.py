@@ -0,0 +1,134 @@
+# Benchmark of the typed_output storage of facebook_ingest.py against the string one
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from fake_graph_api import make_object
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Set benchmark constants
+OBJECT_TYPES = ['ad_insights', 'ad_set', 'campaign']
+NUMERIC_TYPES = ['bigint', 'double']
+SCAN_REPEATS = 5
+
+
+def build_dataframe(object_type: str, rows: int, accounts: int) -> pd.DataFrame:
+    """
+    Parse fake Graph API objects the way the job does, up to the DataFrame handed to
+    prepare_dataframe.
+
+    :param object_type: str - Object type to generate
+    :param rows: int - Rows of every ad account
+    :param accounts: int - Number of ad accounts
+    :return: pd.DataFrame - Records of the object type
+    """
+    import facebook_ingest
+
+    object_fields = facebook_ingest.fields[object_type]
+    extractors = facebook_ingest.compile_extractors(object_fields)
+    accumulator = facebook_ingest.RecordAccumulator(columns=object_fields)
+    for account in range(accounts):
+        for i in range(rows):
+            object = make_object(object_type, f"act_{1000 + account}", i, object_fields)
+            accumulator.append(facebook_ingest.parse_object(object, extractors))
+
+    return facebook_ingest.finalize_records(object_type=object_type, accumulator=accumulator)
+
+
+def scan(path: str, columns: List[str], cast: bool) -> float:
+    """
+    Read the numeric columns of a Parquet file and sum them, as an Athena aggregation would.
+
+    :param path: str - Parquet file
+    :param columns: List - Numeric columns of the schema
+    :param cast: bool - Whether the columns are stored as strings and have to be cast first
+    :return: float - Best time of SCAN_REPEATS scans, in seconds
+    """
+    best = float('inf')
+    for _ in range(SCAN_REPEATS):
+        start = time.perf_counter()
+        table = pq.read_table(path, columns=columns).to_pandas()
+        for column in columns:
+            values = pd.to_numeric(table[column], errors='coerce') if cast else table[column]
+            values.sum()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def benchmark(object_types: List[str], rows: int, accounts: int,
+              directory: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Write every object type as strings and as typed Parquet, snappy compressed as awswrangler does,
+    and measure the size of the files and the time to scan their numeric columns.
+
+    :param object_types: List - Object types to benchmark
+    :param rows: int - Rows of every ad account
+    :param accounts: int - Number of ad accounts
+    :param directory: str - Directory the Parquet files are written to
+    :return: Dict - Size and scan time of both outputs, keyed by object type
+    """
+    import facebook_ingest
+
+    results = {}
+    for object_type in object_types:
+        dataframe = build_dataframe(object_type=object_type, rows=rows, accounts=accounts)
+        schema = facebook_ingest.schemas[object_type]
+        columns = [column for column, column_type in schema.items()
+                   if column_type in NUMERIC_TYPES and column in dataframe.columns]
+
+        results[object_type] = {'rows': len(dataframe), 'numeric_columns': len(columns)}
+        for output, output_schema in [('string', None), ('typed', schema)]:
+            path = os.path.join(directory, f"{object_type}_{output}.parquet")
+            facebook_ingest.prepare_dataframe(dataframe.copy(), execution_time=0,
+                                              schema=output_schema) \
+                .to_parquet(path, index=False, compression='snappy')
+            results[object_type][output] = {
+                'bytes': os.path.getsize(path),
+                'scan_seconds': round(scan(path=path, columns=columns,
+                                           cast=output_schema is None), 4)
+            }
+
+    return results
+
+
+def main(argv: List[str]) -> Dict[str, Dict[str, Any]]:
+    parser = argparse.ArgumentParser(
+        description="Compare the size and the scan time of the typed_output Parquet files with "
+                    "the string ones, on the records of a fake Graph API")
+    parser.add_argument('--object_types', default=','.join(OBJECT_TYPES),
+                        help="comma separated object types to benchmark")
+    parser.add_argument('--accounts', type=int, default=3, help="number of ad accounts")
+    parser.add_argument('--rows', type=int, default=50000, help="rows of every ad account")
+    parser.add_argument('--output', default='', help="file the results are written to as JSON")
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = benchmark(object_types=args.object_types.split(','), rows=args.rows,
+                            accounts=args.accounts, directory=directory)
+
+    print(f"{'object_type':<12} {'rows':>9} {'string_kb':>10} {'typed_kb':>9} "
+          f"{'string_scan_s':>14} {'typed_scan_s':>13}")
+    for object_type, result in results.items():
+        print(f"{object_type:<12} {result['rows']:>9} "
+              f"{result['string']['bytes'] / 1024:>10.1f} "
+              f"{result['typed']['bytes'] / 1024:>9.1f} "
+              f"{result['string']['scan_seconds']:>14} {result['typed']['scan_seconds']:>13}")
+
+    if args.output != '':
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv)
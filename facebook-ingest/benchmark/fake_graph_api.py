@@ -0,0 +1,328 @@
+# Local stand-in of the Graph API endpoints queried by facebook_ingest.py, used by the benchmarks
+import base64
+import collections
+import datetime
+import http.server
+import json
+import socketserver
+import threading
+import time
+import urllib.parse
+from typing import List, Dict, Any, Tuple
+
+# Set Graph API edges of the ad accounts, mapped to their object type
+EDGES = {
+    'ads': 'ad',
+    'adsets': 'ad_set',
+    'campaigns': 'campaign',
+    'adimages': 'ad_image',
+}
+
+# Set defaults of the fake server
+DEFAULT_ROWS = {'ad': 1000, 'ad_set': 200, 'campaign': 50, 'ad_image': 100, 'ad_insights': 5000}
+DEFAULT_LIMIT = 25
+MAX_LIMIT = 5000
+THROTTLING_ERROR = {'message': '(#17) User request limit reached', 'type': 'OAuthException',
+                    'code': 17, 'is_transient': True}
+
+
+def get_fields(params: Dict[str, str], default: str) -> List[str]:
+    """
+    Read the fields of a request, passed comma separated, or as a JSON list by the SDK when they
+    are in the body of a POST request.
+    """
+    fields = params.get('fields', default)
+    return json.loads(fields) if fields.startswith('[') else fields.split(',')
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def make_object(object_type: str, account: str, i: int, fields: List[str],
+                time_range: Dict[str, str] = None) -> Dict[str, Any]:
+    """
+    Generate the i-th object of an ad account, with values of the usual Graph API shape for
+    the requested fields.
+
+    :param object_type: str - Object type, one of EDGES
+    :param account: str - Ad account id, with the act_ prefix
+    :param i: int - Index of the object in the ad account
+    :param fields: List - Fields of the object
+    :param time_range: Dict - Time range of the insights, since and until days
+    :return: Dict - Object as returned by the Graph API
+    """
+    account_id = account[len('act_'):]
+    now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S+0000')
+    day = (time_range or {}).get('since') or datetime.date.today().strftime('%Y-%m-%d')
+    ad_id = f"{account_id}{i:07d}"
+
+    values = {
+        'id': f"{account_id}{i:07d}",
+        'account_id': account_id,
+        'account_name': f"Account {account_id}",
+        'ad_id': ad_id,
+        'ad_name': f"Ad {ad_id}",
+        'adset_id': f"{account_id}{i // 5:07d}",
+        'adset_name': f"Ad set {i // 5}",
+        'campaign_id': f"{account_id}{i // 20:07d}",
+        'campaign_name': f"Campaign {i // 20}",
+        'creative': {'id': f"{account_id}{i:07d}"},
+        'creatives': [f"{account_id}{i:07d}", f"{account_id}{i + 1:07d}"],
+        'targeting': {'age_min': 18, 'age_max': 65, 'geo_locations': {'countries': ['IT']},
+                      'publisher_platforms': ['facebook', 'instagram'],
+                      'facebook_positions': ['feed'], 'instagram_positions': ['stream'],
+                      'device_platforms': ['mobile', 'desktop']},
+        'execution_options': [],
+        'adset_schedule': [],
+        'date_start': day,
+        'date_stop': day,
+        'reach': str(100 + i % 1000),
+        'impressions': str(200 + i % 2000),
+        'clicks': str(i % 50),
+        'frequency': '1.5',
+        'spend': f"{i % 100}.25",
+        'outbound_clicks': [{'action_type': 'outbound_click', 'value': str(i % 20)}],
+        'cost_per_outbound_click': [{'action_type': 'outbound_click', 'value': '0.42'}],
+        'budget_remaining': '1000',
+        'daily_budget': '5000',
+        'lifetime_budget': '0',
+        'can_use_spend_cap': True,
+        'priority': 0,
+        'hash': f"{i:032x}",
+        'permalink_url': f"https://fake.facebook.test/images/{i}",
+        'updated_time': now,
+        'created_time': now,
+        'start_time': now,
+    }
+    return {field: values.get(field, f"{field}-{i % 10}") for field in fields
+            if field not in ['end_time', 'stop_time']}
+
+
+class FakeGraphApi:
+    """
+    Graph API served from memory: the ad accounts of the system user, their ads, ad sets,
+    campaigns and ad images, asynchronous ad_insights report jobs and ad previews, with cursor
+    pagination and batch requests. Objects are generated on the fly from their index, so any
+    number of rows can be served without holding them. Report jobs complete report_seconds after
+    they are submitted, and requests beyond calls_per_minute get throttling errors, with the
+    usage reported in the x-app-usage header as Facebook does.
+    """
+
+    def __init__(self, accounts: int = 3, rows: Dict[str, int] = None, max_limit: int = MAX_LIMIT,
+                 report_seconds: float = 5, calls_per_minute: int = 0, host: str = '127.0.0.1',
+                 port: int = 0):
+        """
+        :param accounts: int - Number of ad accounts of the system user
+        :param rows: Dict - Rows of every ad account by object type, see DEFAULT_ROWS
+        :param max_limit: int - Maximum page size served, whatever the requested limit
+        :param report_seconds: float - Seconds a report job takes to complete
+        :param calls_per_minute: int - Requests allowed in any 60 seconds, 0 for no throttling
+        :param host: str - Address the server listens on
+        :param port: int - Port the server listens on, 0 for any free port
+        """
+        self.accounts = [f"act_{100000 + i}" for i in range(accounts)]
+        self.rows = dict(DEFAULT_ROWS, **(rows or {}))
+        self.max_limit = max_limit
+        self.report_seconds = report_seconds
+        self.calls_per_minute = calls_per_minute
+
+        self.n_requests = 0
+        self.n_throttled = 0
+        self.n_rows = collections.Counter()
+
+        self._reports = {}
+        self._calls = collections.deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeGraphApi':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'n_requests': self.n_requests, 'n_throttled': self.n_throttled,
+                    'n_rows': dict(self.n_rows)}
+
+    def _handler(self) -> type:
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                self._reply(*api.handle('GET', url.path, dict(urllib.parse.parse_qsl(url.query))))
+
+            def do_POST(self):
+                url = urllib.parse.urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+                params = dict(urllib.parse.parse_qsl(url.query))
+                params.update(urllib.parse.parse_qsl(body))
+                self._reply(*api.handle('POST', url.path, params))
+
+            def _reply(self, status: int, body: Any, headers: Dict[str, str]):
+                content = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
+
+    def _usage(self) -> Tuple[bool, Dict[str, str]]:
+        """
+        Count a request in the last minute, and tell if it is over calls_per_minute.
+
+        :return: Tuple - Whether the request is throttled, and the usage headers of the response
+        """
+        if self.calls_per_minute <= 0:
+            return False, {}
+
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and self._calls[0] < now - 60:
+                self._calls.popleft()
+            throttled = len(self._calls) >= self.calls_per_minute
+            if throttled:
+                self.n_throttled += 1
+            else:
+                self._calls.append(now)
+            usage = min(100, int(100 * len(self._calls) / self.calls_per_minute))
+
+        return throttled, {'x-app-usage': json.dumps({'call_count': usage, 'total_cputime': 0,
+                                                      'total_time': 0})}
+
+    def handle(self, method: str, path: str,
+               params: Dict[str, str]) -> Tuple[int, Any, Dict[str, str]]:
+        """
+        Answer a request as the Graph API would.
+
+        :param method: str - HTTP method
+        :param path: str - URL path, starting with the API version
+        :param params: Dict - Query string and form parameters
+        :return: Tuple - HTTP status, JSON body and headers of the response
+        """
+        with self._lock:
+            self.n_requests += 1
+
+        throttled, headers = self._usage()
+        if throttled:
+            return 400, {'error': THROTTLING_ERROR}, headers
+
+        parts = [part for part in path.split('/') if part != ''][1:]
+        if method == 'POST' and len(parts) == 0 and 'batch' in params:
+            return 200, self._batch(json.loads(params['batch'])), headers
+
+        try:
+            return 200, self._route(method, parts, params), headers
+        except KeyError as e:
+            return 400, {'error': {'message': f"Unsupported request {method} {path}: {e}",
+                                   'type': 'GraphMethodException', 'code': 100}}, headers
+
+    def _batch(self, calls: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        responses = []
+        for call in calls:
+            url = urllib.parse.urlsplit(call['relative_url'])
+            params = dict(urllib.parse.parse_qsl(url.query))
+            params.update(urllib.parse.parse_qsl(call.get('body', '')))
+            parts = [part for part in url.path.split('/') if part != '']
+            try:
+                body, code = self._route(call['method'], parts, params), 200
+            except KeyError as e:
+                body, code = {'error': {'message': f"Unsupported request {e}", 'code': 100}}, 400
+            responses.append({'code': code, 'headers': [], 'body': json.dumps(body)})
+        return responses
+
+    def _route(self, method: str, parts: List[str], params: Dict[str, str]) -> Any:
+        if parts == ['me', 'adaccounts']:
+            return self._page(params, len(self.accounts),
+                              lambda i: {'id': self.accounts[i],
+                                         'account_id': self.accounts[i][len('act_'):],
+                                         'name': f"Account {i}"},
+                              '/'.join(parts))
+
+        if len(parts) == 2 and parts[0] in self.accounts and parts[1] in EDGES:
+            object_type = EDGES[parts[1]]
+            fields = get_fields(params, 'id')
+            return self._page(params, self.rows[object_type],
+                              lambda i: make_object(object_type, parts[0], i, fields),
+                              '/'.join(parts), object_type)
+
+        if len(parts) == 2 and parts[0] in self.accounts and parts[1] == 'insights' \
+                and method == 'POST':
+            return self._submit_report(parts[0], params)
+
+        if len(parts) >= 1 and parts[0] in self._reports:
+            report = self._reports[parts[0]]
+            if len(parts) == 1 or parts[1] == '':
+                return self._report_status(parts[0], report)
+            if parts[1] == 'insights':
+                fields = report['fields']
+                return self._page(params, self.rows['ad_insights'],
+                                  lambda i: make_object('ad_insights', report['account'], i,
+                                                         fields, report['time_range']),
+                                  '/'.join(parts), 'ad_insights')
+
+        if len(parts) == 2 and parts[1] == 'previews':
+            return {'data': [{'body': f'<iframe src="https://fake.facebook.test/preview?'
+                                      f'ad_id={parts[0]}&amp;t=1" width="540" height="690">'
+                                      f'</iframe>'}]}
+
+        raise KeyError('/'.join(parts))
+
+    def _page(self, params: Dict[str, str], n_rows: int, make_row, path: str,
+              object_type: str = None) -> Dict[str, Any]:
+        limit = min(int(params.get('limit', DEFAULT_LIMIT)), self.max_limit)
+        start = int(base64.b64decode(params['after']).decode('utf-8')) \
+            if params.get('after') else 0
+        end = min(n_rows, start + limit)
+
+        response = {'data': [make_row(i) for i in range(start, end)]}
+        if object_type is not None:
+            with self._lock:
+                self.n_rows[object_type] += end - start
+
+        if end > start:
+            response['paging'] = {'cursors': {
+                'before': base64.b64encode(str(start).encode('utf-8')).decode('utf-8'),
+                'after': base64.b64encode(str(end).encode('utf-8')).decode('utf-8')}}
+            if end < n_rows:
+                query = dict(params, after=response['paging']['cursors']['after'])
+                response['paging']['next'] = f"{self.url}/v12.0/{path}?" \
+                                             f"{urllib.parse.urlencode(query)}"
+        return response
+
+    def _submit_report(self, account: str, params: Dict[str, str]) -> Dict[str, str]:
+        with self._lock:
+            report_run_id = f"{900000 + len(self._reports)}"
+            self._reports[report_run_id] = {
+                'account': account, 'submitted': time.monotonic(),
+                'fields': get_fields(params, 'ad_id'),
+                'time_range': json.loads(params['time_range'])
+                if 'time_range' in params else None}
+        return {'report_run_id': report_run_id}
+
+    def _report_status(self, report_run_id: str, report: Dict[str, Any]) -> Dict[str, Any]:
+        elapsed = time.monotonic() - report['submitted']
+        percent = 100 if self.report_seconds <= 0 else \
+            min(100, int(100 * elapsed / self.report_seconds))
+        return {'id': report_run_id,
+                'async_status': 'Job Completed' if percent >= 100 else 'Job Running',
+                'async_percent_completion': percent}
@@ -0,0 +1,243 @@
+# Imports
+import argparse
+import datetime
+import logging
+import sys
+import pandas as pd
+import pytz
+from typing import List, Dict, Tuple
+
+# Set logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def get_job_arguments(argv: List[str]) -> Dict[str, str]:
+    """
+    Resolve the job arguments. Glue passes them in the '--name value' form, together with its own
+    arguments, so they are parsed with argparse, ignoring the unknown ones, and the job doesn't
+    depend on awsglue.
+
+    :param argv: List - Command line arguments, usually sys.argv
+    :return: Dict - Resolved job arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_bucket', required=True)
+    for name, default in OPTIONAL_ARGUMENTS.items():
+        parser.add_argument(f"--{name}", default=default)
+    return vars(parser.parse_known_args(argv[1:])[0])
+
+
+# Optional job arguments, with their default value
+OPTIONAL_ARGUMENTS = {'extractions': 'ad,ad_set,campaign,ad_insights,ad_image',
+                      'since': '',
+                      'until': '',
+                      'deduplicate': 'false',
+                      'target_file_mb': '128',
+                      'update_catalog': 'true',
+                      's3_endpoint_url': ''}
+
+# Set execution details constants, as in facebook_ingest
+SOURCE = 'facebook'
+ZONE = 'intake'
+TIER = 'raw'
+DUMPDATE = 'dumpdate'
+TZ = pytz.timezone('Europe/Rome')
+TYPED_SUFFIX = '_typed'
+
+# Set the columns identifying a version of an object, on which rows are deduplicated. The row of
+# the latest dumpdate is kept, which for ad_insights has the most up to date attribution
+deduplication_keys = {
+    'ad_insights': ['date_start', 'ad_id'],
+    'ad': ['id', 'updated_time'],
+    'ad_set': ['id', 'updated_time'],
+    'campaign': ['id', 'updated_time'],
+    'ad_image': ['id', 'updated_time', 'creatives']
+}
+
+
+def get_deduplication_keys(extraction: str) -> List[str]:
+    """
+    Get the deduplication keys of an extraction, typed extractions (stored by facebook_ingest with
+    the TYPED_SUFFIX) sharing the keys of their string counterpart.
+
+    :param extraction: str - Extraction of the dataset
+    :return: List - Deduplication keys, None for unknown extractions
+    """
+    if extraction.endswith(TYPED_SUFFIX):
+        extraction = extraction[:-len(TYPED_SUFFIX)]
+    return deduplication_keys.get(extraction)
+
+
+def get_dumpdate_range(since: str, until: str, today: datetime.date = None) -> Tuple[int, int]:
+    """
+    Get the dumpdates of a range of days. The range defaults to yesterday, and it can't include
+    today, whose dumpdate partitions are still being written by the ingestion.
+
+    :param since: str - First day of the range, as %Y-%m-%d, empty for yesterday
+    :param until: str - Last day of the range, as %Y-%m-%d, empty for the first day
+    :param today: datetime.date - Current day, defaults to today
+    :return: Tuple - First dumpdate of the range, and first dumpdate after the range
+    """
+    today = today or datetime.datetime.now(tz=TZ).date()
+
+    first_day = datetime.datetime.strptime(since, '%Y-%m-%d').date() if since != '' else \
+        today - datetime.timedelta(days=1)
+    last_day = datetime.datetime.strptime(until, '%Y-%m-%d').date() if until != '' else \
+        first_day
+
+    if last_day >= today:
+        raise ValueError(f"The range of days to compact must end before today, got {last_day}")
+
+    def day_start(day: datetime.date) -> int:
+        return int(TZ.localize(datetime.datetime.combine(day, datetime.time())).timestamp())
+
+    return day_start(first_day), day_start(last_day + datetime.timedelta(days=1))
+
+
+def list_partitions(path: str, start: int, end: int) -> Dict[str, List[str]]:
+    """
+    List the Parquet files of the dumpdate partitions of a dataset within a range of dumpdates.
+
+    :param path: str - S3 path of the dataset
+    :param start: int - First dumpdate of the range
+    :param end: int - First dumpdate after the range
+    :return: Dict - Files of every partition in the range, keyed by dumpdate
+    """
+    import awswrangler as wr
+
+    partitions = {}
+    for file in wr.s3.list_objects(path, suffix='.parquet'):
+        partition = file[len(path):].split('/')[0]
+        if not partition.startswith(f"{DUMPDATE}="):
+            continue
+
+        dumpdate = partition[len(DUMPDATE) + 1:]
+        if start <= int(dumpdate) < end:
+            partitions.setdefault(dumpdate, []).append(file)
+
+    return partitions
+
+
+def compact_extraction(bucket_name: str, zone: str, tier: str, source: str, extraction: str,
+                       start: int, end: int, deduplicate: bool, target_file_bytes: int,
+                       update_catalog: bool) -> Dict[str, int]:
+    """
+    Rewrite the dumpdate partitions of an extraction within a range of dumpdates into files of
+    about target_file_bytes bytes, optionally deduplicating its rows across the partitions. The
+    new files are written before the old ones are deleted, so that no data is lost if the
+    compaction fails midway: rows would be duplicated instead, until the partitions are compacted
+    again with deduplication. Partitions left without rows by the deduplication are emptied.
+
+    :param bucket_name: str - Bucket name for the data
+    :param zone: str - Zone of the dataset
+    :param tier: str - Tier of the dataset, which is also its Glue database
+    :param source: str - Source of the dataset
+    :param extraction: str - Extraction of the dataset
+    :param start: int - First dumpdate of the range
+    :param end: int - First dumpdate after the range
+    :param deduplicate: bool - Whether rows are deduplicated on the deduplication keys
+    :param target_file_bytes: int - Approximate size of the compacted files
+    :param update_catalog: bool - Whether the Glue table of the dataset is updated
+    :return: Dict - Number of partitions, files and rows before and after the compaction
+    """
+    import awswrangler as wr
+
+    path = f"s3://{bucket_name}/{zone}/{tier}/{source}/{extraction}/"
+    partitions = list_partitions(path=path, start=start, end=end)
+    files = [file for partition_files in partitions.values() for file in partition_files]
+    stats = {'partitions': len(partitions), 'files_before': len(files), 'files_after': len(files)}
+
+    if len(files) == 0 or (not deduplicate and all(len(partition_files) <= 1
+                                                   for partition_files in partitions.values())):
+        logger.info(f"Nothing to compact for {source}/{extraction}")
+        return stats
+
+    logger.info(f"Reading {len(files)} files of {len(partitions)} partitions of {path}")
+    dataframes = []
+    for dumpdate, partition_files in partitions.items():
+        dataframe = wr.s3.read_parquet(path=partition_files)
+        dataframe[DUMPDATE] = dumpdate
+        dataframes.append(dataframe)
+    dataframe = pd.concat(dataframes, ignore_index=True, sort=False)
+    stats['rows_before'] = len(dataframe)
+
+    if deduplicate:
+        dataframe = dataframe.iloc[dataframe[DUMPDATE].astype(int).argsort(kind='mergesort')] \
+            .drop_duplicates(subset=get_deduplication_keys(extraction), keep='last')
+    stats['rows_after'] = len(dataframe)
+
+    # Size the files from the average size of a row in the current files
+    n_bytes = sum(size or 0 for size in wr.s3.size_objects(path=files).values())
+    max_rows_by_file = max(1, int(target_file_bytes * stats['rows_before'] / max(1, n_bytes)))
+
+    dtype = None
+    if update_catalog:
+        table_types = wr.catalog.get_table_types(database=tier, table=f"t_{source}_{extraction}")
+        dtype = {column: column_type for column, column_type in (table_types or {}).items()
+                 if column in dataframe.columns}
+
+    logger.info(f"Writing {len(dataframe)} rows to {path}, {max_rows_by_file} rows by file")
+    response = wr.s3.to_parquet(
+        df=dataframe,
+        path=path,
+        dataset=True,
+        partition_cols=[DUMPDATE],
+        mode='append',
+        filename_prefix='compacted_',
+        max_rows_by_file=max_rows_by_file,
+        schema_evolution=True,
+        database=tier if update_catalog else None,
+        table=f"t_{source}_{extraction}" if update_catalog else None,
+        dtype=dtype
+    )
+    stats['files_after'] = len(response['paths'])
+
+    logger.info(f"Deleting {len(files)} compacted files of {path}")
+    wr.s3.delete_objects(path=files)
+
+    return stats
+
+
+def main(argv: List[str]) -> Dict[str, Dict[str, int]]:
+    """
+    Compact the extractions of the job arguments.
+
+    :param argv: List - Command line arguments, usually sys.argv
+    :return: Dict - Compaction stats of every extraction, see compact_extraction
+    """
+    args = get_job_arguments(argv)
+    if args['s3_endpoint_url'] != '':
+        import awswrangler as wr
+        wr.config.s3_endpoint_url = args['s3_endpoint_url']
+
+    extractions = [extraction.strip() for extraction in args['extractions'].split(',')
+                   if extraction.strip() != '']
+    deduplicate = args['deduplicate'].lower() == 'true'
+
+    # Check the extractions and the range of days before touching any data
+    unknown_extractions = [extraction for extraction in extractions
+                           if get_deduplication_keys(extraction) is None]
+    if len(unknown_extractions) > 0:
+        raise ValueError(f"Unknown extractions {unknown_extractions}, expected some of "
+                         f"{list(deduplication_keys)}, optionally with the {TYPED_SUFFIX} suffix")
+
+    start, end = get_dumpdate_range(since=args['since'], until=args['until'])
+    logger.info(f"Compacting dumpdates from {start} to {end}, deduplicate: {deduplicate}")
+
+    # Compact one extraction at a time
+    results = {}
+    for extraction in extractions:
+        results[extraction] = compact_extraction(
+            bucket_name=args['data_bucket'], zone=ZONE, tier=TIER, source=SOURCE,
+            extraction=extraction, start=start, end=end, deduplicate=deduplicate,
+            target_file_bytes=int(args['target_file_mb']) * 1024 * 1024,
+            update_catalog=args['update_catalog'].lower() == 'true')
+        logger.info(f"Compaction stats for {SOURCE}/{extraction}: {results[extraction]}")
+
+    logger.info("I'm done")
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv)
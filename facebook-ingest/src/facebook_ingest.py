@@ -1,44 +1,242 @@
 # facebook_business imports
-from facebook_business.api import FacebookAdsApi
+from facebook_business.api import FacebookAdsApi, FacebookResponse
+from facebook_business.session import FacebookSession
+from facebook_business.exceptions import FacebookRequestError
 from facebook_business.adobjects.adaccount import AdAccount
 from facebook_business.adobjects.adreportrun import AdReportRun
 from facebook_business.adobjects.adsinsights import AdsInsights
 from facebook_business.adobjects.ad import Ad
 from facebook_business.adobjects.adset import AdSet
 from facebook_business.adobjects.campaign import Campaign
-from facebook_business.adobjects.adimage import AdImage
 from facebook_business.adobjects.user import User
-from facebook_business.adobjects.adpreview import AdPreview
+from facebook_business.adobjects.abstractobject import AbstractObject
+from facebook_business.adobjects.objectparser import ObjectParser
 
 # Other imports
+import argparse
 import datetime
 import pandas as pd
 import json
 import time
 import boto3
 import base64
-from botocore.client import SecretsManager, S3
-import awswrangler as wr
+import functools
+import gzip
+from botocore.client import BaseClient
 import logging
 import pytz
+import requests
+import resource
 import sys
-from awsglue.utils import getResolvedOptions
-from typing import List, Dict, Any, Union
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Union, Mapping, Tuple, Iterator, Callable
 
 # Set logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Get Job arguments
-args = getResolvedOptions(sys.argv, ['secret_name',
-                                     'data_bucket'])
+# Set Boto3 client types, botocore only defines the clients at runtime
+SecretsManager = S3 = Glue = BaseClient
 
-# Set AWS constants and clients
-S3_CLIENT = boto3.client('s3')
-SECRET_MANAGER_CLIENT = boto3.client('secretsmanager')
 
-SECRET_NAME = args['secret_name']
-DATA_BUCKET = args['data_bucket']
+def get_job_arguments(argv: List[str], required: List[str],
+                      optional: Dict[str, str]) -> Dict[str, str]:
+    """
+    Resolve Glue job arguments. getResolvedOptions fails on arguments that are not passed, so the
+    optional ones are only resolved when present in argv and fall back to their default otherwise.
+    Outside Glue, where awsglue is not installed, the arguments are resolved with argparse in the
+    same '--name value' form.
+
+    :param argv: List - Command line arguments, usually sys.argv
+    :param required: List - Names of the arguments that must be passed to the job
+    :param optional: Dict - Names of the optional arguments mapped to their default value
+    :return: Dict - Resolved job arguments
+    """
+    passed = [name for name in optional if f"--{name}" in argv]
+
+    args = dict(optional)
+    try:
+        from awsglue.utils import getResolvedOptions
+    except ImportError:
+        parser = argparse.ArgumentParser()
+        for name in required + passed:
+            parser.add_argument(f"--{name}", required=True)
+        args.update(vars(parser.parse_known_args(argv[1:])[0]))
+    else:
+        args.update(getResolvedOptions(argv, required + passed))
+    return args
+
+
+# Job arguments, resolved by configure
+REQUIRED_ARGUMENTS = ['secret_name',
+                      'data_bucket']
+OPTIONAL_ARGUMENTS = {'max_workers': '4',
+                      'requests_per_second': '2',
+                      'graph_url': FacebookSession.GRAPH,
+                      'streaming': 'false',
+                      'chunk_rows': '50000',
+                      'chunk_mb': '64',
+                      'typed_output': 'false',
+                      'insights_lookback_days': '1',
+                      'insights_max_days': '30',
+                      'insights_since': '',
+                      'insights_until': '',
+                      'capture_pages': 'false',
+                      'replay_dumpdate': '',
+                      'log_metrics': 'false',
+                      'resumable': 'false',
+                      'job_name': '',
+                      'shard_count': '1',
+                      'shard_index': '',
+                      'shard_run': '',
+                      'accounts': '',
+                      'object_types': '',
+                      'field_profile': 'full',
+                      'account_registry': 'false',
+                      'account_registry_ttl_hours': '24',
+                      'account_inactive_days': '30',
+                      'account_sweep_days': '7',
+                      'current_state': 'false',
+                      's3_endpoint_url': '',
+                      'update_catalog': 'true',
+                      'insights_fetch': 'cursor',
+                      'insights_bulk_limit': '5000',
+                      'adaptive_requests': 'false',
+                      'request_timeout': ''}
+
+# Set Facebook API throttling constants
+USAGE_HEADERS = ['x-app-usage', 'x-business-use-case-usage', 'x-ad-account-usage']
+USAGE_METRICS = ['call_count', 'total_cputime', 'total_time', 'acc_id_util_pct']
+THROTTLING_ERROR_CODES = [4, 17, 32, 613, 80000, 80003, 80004]
+TRANSIENT_ERROR_CODES = [1, 2]
+MAX_THROTTLING_RETRIES = 5
+GRAPH_BATCH_SIZE = 50
+TARGETING_KEYS = ['publisher_platforms', 'instagram_positions', 'facebook_positions',
+                  'device_platforms']
+REPORT_MAX_RETRIES = 2
+REPORT_MAX_POLL_FAILURES = 5
+
+# Set adaptive requests constants: requests failed with these codes or subcodes asked for too
+# much data, and are retried with a smaller page size
+OVERSIZED_ERROR_CODES = [1, 2]
+OVERSIZED_ERROR_SUBCODES = [1487534]
+MIN_PAGE_LIMIT = 25
+MAX_PAGE_LIMIT = 5000
+FAST_PAGE_SECONDS = 5
+
+# Set ad account registry constants
+ACTIVE_ACCOUNT_STATUS = 1
+
+
+class JobConfig:
+    """
+    Configuration of a run: the AWS clients and the settings of the job, resolved from the job
+    arguments by configure. Nothing is set at import time, so that the job can be run by calling
+    main, e.g. against a local Graph API and S3 through the graph_url and s3_endpoint_url
+    arguments.
+    """
+
+    def __init__(self, args: Dict[str, str]):
+        """
+        :param args: Dict - Resolved job arguments
+        """
+        self.args = args
+
+        # Set AWS settings and clients, the S3 one on the S3 endpoint if passed
+        self.s3_endpoint_url = args['s3_endpoint_url'] or None
+        self.s3_client = boto3.client('s3', endpoint_url=self.s3_endpoint_url)
+        self.secret_manager_client = boto3.client('secretsmanager')
+        self.glue_client = boto3.client('glue')
+
+        self.secret_name = args['secret_name']
+        self.data_bucket = args['data_bucket']
+        self.update_catalog = args['update_catalog'].lower() == 'true'
+
+        # Set Facebook API concurrency and throttling settings
+        self.max_workers = int(args['max_workers'])
+        self.requests_per_second = float(args['requests_per_second'])
+        self.graph_url = args['graph_url']
+
+        # Set adaptive requests settings, request_timeout None for no timeout
+        self.adaptive_requests = args['adaptive_requests'].lower() == 'true'
+        self.request_timeout = float(args['request_timeout']) \
+            if args['request_timeout'] != '' else None
+
+        # Set streaming sink settings
+        self.streaming = args['streaming'].lower() == 'true'
+        self.chunk_rows = int(args['chunk_rows'])
+        self.chunk_mb = int(args['chunk_mb'])
+
+        # Set output types settings
+        self.typed_output = args['typed_output'].lower() == 'true'
+
+        # Set ad_insights time range settings
+        self.insights_lookback_days = int(args['insights_lookback_days'])
+        self.insights_max_days = int(args['insights_max_days'])
+        self.insights_since = args['insights_since']
+        self.insights_until = args['insights_until']
+
+        # Set ad_insights fetch settings: the results of the report jobs are fetched as AdsInsights
+        # objects, or in bulk as raw JSON pages of insights_bulk_limit records
+        if args['insights_fetch'] not in ['cursor', 'bulk']:
+            raise ValueError(f"Unknown insights_fetch {args['insights_fetch']}, expected 'cursor' "
+                             f"or 'bulk'")
+        self.insights_bulk_limit = int(args['insights_bulk_limit']) \
+            if args['insights_fetch'] == 'bulk' else None
+
+        # Set raw pages capture and replay settings
+        self.capture_pages = args['capture_pages'].lower() == 'true'
+        self.replay_dumpdate = args['replay_dumpdate']
+
+        # Set instrumentation settings
+        self.log_metrics = args['log_metrics'].lower() == 'true'
+
+        # Set checkpoint settings
+        self.resumable = args['resumable'].lower() == 'true'
+
+        # Set sharding settings. A run with shard_count > 1 and no shard_index is the coordinator,
+        # which plans the extractions and starts one run per shard
+        self.job_name = args['job_name']
+        self.shard_count = int(args['shard_count'])
+        self.shard_index = int(args['shard_index']) if args['shard_index'] != '' else None
+        self.shard_run = args['shard_run']
+        self.account_ids = [account_id.strip() for account_id in args['accounts'].split(',')
+                            if account_id.strip() != '']
+
+        # Set selective run settings, empty object_types for the scheduled object types
+        self.object_types = [object_type.strip() for object_type in args['object_types'].split(',')
+                             if object_type.strip() != '']
+        self.field_profile = args['field_profile']
+
+        # Set ad account registry settings
+        self.account_registry = args['account_registry'].lower() == 'true'
+        self.account_registry_ttl_hours = float(args['account_registry_ttl_hours'])
+        self.account_inactive_days = float(args['account_inactive_days'])
+        self.account_sweep_days = float(args['account_sweep_days'])
+
+        # Set current state output settings
+        self.current_state = args['current_state'].lower() == 'true'
+
+
+def configure(argv: List[str]) -> JobConfig:
+    """
+    Resolve the job arguments into the configuration of the run, and point awswrangler to the S3
+    endpoint if passed.
+
+    :param argv: List - Command line arguments, usually sys.argv
+    :return: JobConfig - Configuration of the run
+    """
+    args = get_job_arguments(argv, required=REQUIRED_ARGUMENTS, optional=OPTIONAL_ARGUMENTS)
+    config = JobConfig(args)
+
+    if config.s3_endpoint_url is not None:
+        import awswrangler as wr
+        wr.config.s3_endpoint_url = config.s3_endpoint_url
+
+    return config
+
 
 # Set execution details constants
 SOURCE = 'facebook'
@@ -48,6 +246,7 @@ PROCESS = 'ingestion'
 DUMPDATE = 'dumpdate'
 PARTITION = [DUMPDATE]
 TZ = pytz.timezone('Europe/Rome')
+TYPED_SUFFIX = '_typed'
 
 # Set Facebook fields
 fields = {
@@ -126,18 +325,547 @@ fields = {
         Campaign.Field.updated_time
     ],
 
+    # Fields of AdImage, named here so that its module is only imported when ad_image is queried
     'ad_image': [
-        AdImage.Field.id,
-        AdImage.Field.account_id,
-        AdImage.Field.creatives,
-        AdImage.Field.hash,
-        AdImage.Field.name,
-        AdImage.Field.permalink_url,
-        AdImage.Field.status,
-        AdImage.Field.updated_time,
+        'id',
+        'account_id',
+        'creatives',
+        'hash',
+        'name',
+        'permalink_url',
+        'status',
+        'updated_time',
     ]
 }
 
+# Set fields that every field profile must keep: the ones identifying an object and the ones its
+# adjustments work on
+required_fields = {
+    'ad_insights': [AdsInsights.Field.date_start, AdsInsights.Field.ad_id],
+    'ad': [Ad.Field.id, Ad.Field.creative],
+    'ad_set': [AdSet.Field.id],
+    'campaign': [Campaign.Field.id],
+    'ad_image': ['id', 'creatives', 'updated_time']
+}
+
+# Set field profiles, selected with the field_profile job argument. A profile maps object types to
+# a subset of their fields, object types missing from a profile are requested with all their fields
+field_profiles = {
+    'full': {},
+
+    'light': {
+        'ad_insights': [
+            AdsInsights.Field.date_start,
+            AdsInsights.Field.date_stop,
+            AdsInsights.Field.account_id,
+            AdsInsights.Field.ad_id,
+            AdsInsights.Field.adset_id,
+            AdsInsights.Field.campaign_id,
+            AdsInsights.Field.impressions,
+            AdsInsights.Field.clicks,
+            AdsInsights.Field.spend
+        ]
+    }
+}
+
+# Set types of the Facebook fields stored with typed output, fields not listed here are strings.
+# Types are Athena types, plus 'json' for nested values serialized as JSON strings
+schemas = {
+    'ad_insights': {
+        AdsInsights.Field.date_start: 'date',
+        AdsInsights.Field.date_stop: 'date',
+        AdsInsights.Field.reach: 'bigint',
+        AdsInsights.Field.impressions: 'bigint',
+        AdsInsights.Field.clicks: 'bigint',
+        AdsInsights.Field.frequency: 'double',
+        AdsInsights.Field.cost_per_outbound_click: 'double',
+        AdsInsights.Field.outbound_clicks: 'bigint',
+        AdsInsights.Field.spend: 'double'
+    },
+
+    'ad': {
+        Ad.Field.priority: 'bigint',
+        Ad.Field.execution_options: 'json',
+        Ad.Field.updated_time: 'timestamp',
+        Ad.Field.created_time: 'timestamp',
+        Ad.Field.targeting: 'json',
+        'publisher_platforms': 'json',
+        'instagram_positions': 'json',
+        'facebook_positions': 'json',
+        'device_platforms': 'json'
+    },
+
+    'ad_set': {
+        AdSet.Field.adset_schedule: 'json',
+        AdSet.Field.budget_remaining: 'bigint',
+        AdSet.Field.created_time: 'timestamp',
+        AdSet.Field.end_time: 'timestamp',
+        AdSet.Field.start_time: 'timestamp',
+        AdSet.Field.lifetime_budget: 'bigint',
+        AdSet.Field.updated_time: 'timestamp'
+    },
+
+    'campaign': {
+        Campaign.Field.budget_remaining: 'bigint',
+        Campaign.Field.can_use_spend_cap: 'boolean',
+        Campaign.Field.created_time: 'timestamp',
+        Campaign.Field.daily_budget: 'bigint',
+        Campaign.Field.start_time: 'timestamp',
+        Campaign.Field.stop_time: 'timestamp',
+        Campaign.Field.updated_time: 'timestamp'
+    },
+
+    'ad_image': {
+        'updated_time': 'timestamp'
+    }
+}
+
+# Set the keys of the objects in the current state datasets, and the column the datasets are
+# partitioned by, which is determined by the keys so that an object never changes partition
+current_state_keys = {
+    'ad_insights': ([AdsInsights.Field.ad_id, AdsInsights.Field.date_start],
+                    AdsInsights.Field.date_start),
+    'ad': ([Ad.Field.id], Ad.Field.account_id),
+    'ad_set': ([AdSet.Field.id], AdSet.Field.account_id),
+    'campaign': ([Campaign.Field.id], Campaign.Field.account_id)
+}
+
+
+class Instrumentation:
+    """
+    Thread-safe collector of performance counters, keyed by object type, ad account and section
+    of the job (HTTP requests, throttling, report waiting, parsing, S3 reads and writes, ...).
+    Every thread sets the object type and ad account it works on with set_context, so that the
+    counters it adds are attributed to them.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._context = threading.local()
+        self._lock = threading.Lock()
+
+    def set_context(self, object_type: str = None, account: str = None) -> None:
+        """
+        :param object_type: str - Object type the current thread works on
+        :param account: str - Id of the ad account the current thread works on, None for all
+        """
+        self._context.object_type = object_type
+        self._context.account = account
+
+    def reset(self) -> None:
+        """
+        Drop all the counters, so that a new run of the job is reported from scratch.
+        """
+        with self._lock:
+            self._counters = {}
+
+    def add(self, section: str, seconds: float = 0.0, **counters) -> None:
+        """
+        Add a measure to the counters of the current context. Counters whose name starts with
+        'max_' keep the highest value, the others are summed.
+
+        :param section: str - Section of the job the measure refers to
+        :param seconds: float - Time spent in the section
+        """
+        key = (getattr(self._context, 'object_type', None),
+               getattr(self._context, 'account', None),
+               section)
+
+        with self._lock:
+            totals = self._counters.setdefault(key, {'calls': 0, 'seconds': 0.0})
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            for name, value in counters.items():
+                if name.startswith('max_'):
+                    totals[name] = max(totals.get(name, value), value)
+                else:
+                    totals[name] = totals.get(name, 0) + value
+
+    def report(self, object_type: str) -> Dict[str, Dict[str, Dict[str, Union[int, float]]]]:
+        """
+        :param object_type: str - Object type to report on
+        :return: Dict - Counters of the object type by section, and by ad account and section
+        """
+        sections = {}
+        accounts = {}
+
+        with self._lock:
+            for (key_object_type, account, section), totals in self._counters.items():
+                if key_object_type != object_type:
+                    continue
+
+                for target in [sections.setdefault(section, {}),
+                               accounts.setdefault(account or '_all', {}).setdefault(section, {})]:
+                    for name, value in totals.items():
+                        if name.startswith('max_'):
+                            target[name] = max(target.get(name, value), value)
+                        else:
+                            target[name] = target.get(name, 0) + value
+
+        for target in [sections] + list(accounts.values()):
+            for totals in target.values():
+                totals['seconds'] = round(totals['seconds'], 3)
+
+        return {'sections': sections, 'accounts': accounts}
+
+
+def instrumented(section: str) -> Callable:
+    """
+    Decorator measuring the time spent in a function as a section of INSTRUMENTATION. The rows
+    of the DataFrame returned by the function, or else of the DataFrame passed as its first
+    argument (as with DataFrame.pipe), are counted as well.
+
+    :param section: str - Section of the job the function belongs to
+    :return: Callable - Decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            result = function(*args, **kwargs)
+
+            rows = 0
+            if isinstance(result, pd.DataFrame):
+                rows = len(result)
+            elif len(args) > 0 and isinstance(args[0], pd.DataFrame):
+                rows = len(args[0])
+
+            INSTRUMENTATION.add(section, time.monotonic() - start, rows=rows)
+            return result
+        return wrapper
+    return decorator
+
+
+INSTRUMENTATION = Instrumentation()
+
+
+def get_performance(object_type: str, start: float) -> Dict[str, Any]:
+    """
+    Get the performance report of an object type, with its wall time, the rows it extracted per
+    second of wall time, and the peak memory of the job so far.
+
+    :param object_type: str - Object type to report on
+    :param start: float - time.monotonic() when the object type started
+    :return: Dict - Performance report of the object type
+    """
+    performance = INSTRUMENTATION.report(object_type)
+    wall_seconds = time.monotonic() - start
+    rows = performance['sections'].get('finalize_records', {}).get('rows', 0)
+
+    performance['wall_seconds'] = round(wall_seconds, 3)
+    performance['rows_per_second'] = round(rows / wall_seconds, 1) if wall_seconds > 0 else 0.0
+    performance['peak_memory_mb'] = round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return performance
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all the threads issuing Graph API requests, and the only place where
+    the job waits on Facebook rate limits. Tokens are refilled at a rate that is lowered as the
+    usage reported by Facebook in the x-app-usage, x-business-use-case-usage and
+    x-ad-account-usage response headers approaches its limit, requests are held back entirely
+    while Facebook reports an estimated time to regain access, and throttling errors trigger an
+    exponential backoff. Time spent waiting and time spent in requests are counted.
+    """
+
+    def __init__(self, rate: float, capacity: int = 10, min_rate: float = 0.05,
+                 usage_threshold: float = 75.0, cooldown: int = 60, initial_backoff: int = 30,
+                 max_backoff: int = 600):
+        """
+        :param rate: float - Requests per second allowed while usage is below usage_threshold
+        :param capacity: int - Maximum number of requests that can be issued in a burst
+        :param min_rate: float - Requests per second allowed when usage is at 100%
+        :param usage_threshold: float - Usage percentage above which the rate is lowered
+        :param cooldown: int - Seconds to hold requests when usage is at 100% with no regain time
+        :param initial_backoff: int - Seconds to hold requests after a first throttling error
+        :param max_backoff: int - Upper bound of the backoff after repeated throttling errors
+        """
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.usage_threshold = usage_threshold
+        self.cooldown = cooldown
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.usage = 0.0
+
+        self.n_requests = 0
+        self.n_throttling_errors = 0
+        self.throttled_seconds = 0.0
+        self.working_seconds = 0.0
+
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._backoff = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, tokens: int = 1) -> float:
+        """
+        Block until a request is allowed to go out. A request taking more tokens than the
+        capacity, e.g. a batch request, goes out once the bucket is full, and the following
+        requests wait for the missing tokens.
+
+        :param tokens: int - Number of calls of the request, each one counted by Facebook
+        :return: float - Seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= min(tokens, self.capacity):
+                    self._tokens -= tokens
+                    return waited
+                else:
+                    wait = (min(tokens, self.capacity) - self._tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+            with self._lock:
+                self.throttled_seconds += wait
+
+    def record_request(self, seconds: float) -> None:
+        """
+        Count a request that went out, successful or not.
+
+        :param seconds: float - Duration of the request
+        """
+        with self._lock:
+            self.n_requests += 1
+            self.working_seconds += seconds
+
+    def record_success(self) -> None:
+        """
+        Reset the throttling backoff after a successful request.
+        """
+        with self._lock:
+            self._backoff = 0
+
+    def backoff(self) -> int:
+        """
+        Hold all requests after a throttling error, doubling the delay at every consecutive error.
+
+        :return: int - Seconds requests are held for
+        """
+        with self._lock:
+            self.n_throttling_errors += 1
+            self._backoff = min(self.max_backoff, self._backoff * 2 or self.initial_backoff)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + self._backoff)
+            return self._backoff
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        :return: Dict - Counters of requests, throttling errors, and seconds spent throttled
+        (waiting for the rate limiter) vs. working (waiting for Facebook responses)
+        """
+        with self._lock:
+            return {'n_requests': self.n_requests,
+                    'n_throttling_errors': self.n_throttling_errors,
+                    'throttled_seconds': round(self.throttled_seconds, 3),
+                    'working_seconds': round(self.working_seconds, 3)}
+
+    def reset_stats(self) -> None:
+        """
+        Reset the counters returned by stats().
+        """
+        with self._lock:
+            self.n_requests = 0
+            self.n_throttling_errors = 0
+            self.throttled_seconds = 0.0
+            self.working_seconds = 0.0
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Adapt the refill rate to the usage reported in the response headers of a Graph API call.
+
+        :param headers: Mapping - HTTP response headers
+        """
+        if not headers or not any(headers.get(header) for header in USAGE_HEADERS):
+            return
+
+        usage, regain_seconds = parse_usage_headers(headers)
+
+        with self._lock:
+            self.usage = usage
+            if usage <= self.usage_threshold:
+                self.rate = self.base_rate
+            else:
+                headroom = max(0.0, 100.0 - usage) / (100.0 - self.usage_threshold)
+                self.rate = max(self.min_rate, self.base_rate * headroom)
+
+            if regain_seconds == 0 and usage >= 100.0:
+                regain_seconds = self.cooldown
+
+            if regain_seconds > 0:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + regain_seconds)
+                logger.info(f"Facebook API usage at {usage}%, holding requests for "
+                            f"{regain_seconds} seconds")
+
+
+def parse_usage_headers(headers: Mapping[str, str]) -> Tuple[float, int]:
+    """
+    Read Facebook rate limiting headers and return the highest usage percentage among the reported
+    metrics, together with the longest estimated time to regain access.
+
+    :param headers: Mapping - HTTP response headers
+    :return: Tuple - Usage percentage and seconds to wait before access is regained
+    """
+    usage = 0.0
+    regain_seconds = 0
+
+    for header in USAGE_HEADERS:
+        if not headers or not headers.get(header):
+            continue
+        try:
+            content = json.loads(headers[header])
+        except ValueError:
+            logger.warning(f"Unable to parse {header} header: {headers[header]}")
+            continue
+
+        if header == 'x-business-use-case-usage':
+            metrics = [metric for business in content.values() for metric in business]
+        else:
+            metrics = [content]
+
+        for metric in metrics:
+            for key in USAGE_METRICS:
+                if key in metric:
+                    usage = max(usage, float(metric[key]))
+
+            if 'estimated_time_to_regain_access' in metric:
+                regain_seconds = max(regain_seconds,
+                                     int(metric['estimated_time_to_regain_access']) * 60)
+            if float(metric.get('acc_id_util_pct', 0)) >= 100:
+                regain_seconds = max(regain_seconds, int(metric.get('reset_time_duration', 0)))
+
+    return usage, regain_seconds
+
+
+class ThrottledFacebookAdsApi(FacebookAdsApi):
+    """
+    FacebookAdsApi that takes a token from a RateLimiter before every HTTP request, one per call
+    of batch requests, feeds the rate limiting headers of every response (successful or not) back
+    to it, and retries requests failed with a throttling error code after the RateLimiter backoff.
+    """
+
+    rate_limiter = None
+
+    def call(self, method, path, params=None, headers=None, files=None, url_override=None,
+             api_version=None) -> FacebookResponse:
+        if self.rate_limiter is None:
+            return super().call(method, path, params=params, headers=headers, files=files,
+                                url_override=url_override, api_version=api_version)
+
+        # Facebook counts every call of a batch request
+        tokens = len(params['batch']) if params and 'batch' in params else 1
+        attempt = 0
+        while True:
+            waited = self.rate_limiter.acquire(tokens)
+            INSTRUMENTATION.add('throttled', waited)
+
+            start = time.monotonic()
+            try:
+                response = super().call(method, path, params=params, headers=headers,
+                                        files=files, url_override=url_override,
+                                        api_version=api_version)
+            except FacebookRequestError as e:
+                self.rate_limiter.record_request(time.monotonic() - start)
+                self.rate_limiter.update_from_headers(e.http_headers())
+                INSTRUMENTATION.add('http', time.monotonic() - start, requests=1, errors=1)
+                if e.api_error_code() not in THROTTLING_ERROR_CODES or \
+                        attempt >= MAX_THROTTLING_RETRIES:
+                    raise
+
+                attempt += 1
+                delay = self.rate_limiter.backoff()
+                logger.warning(f"Throttled by Facebook (code {e.api_error_code()}, subcode "
+                               f"{e.api_error_subcode()}), retry {attempt} of "
+                               f"{MAX_THROTTLING_RETRIES} in {delay} seconds")
+                continue
+
+            seconds = time.monotonic() - start
+            self.rate_limiter.record_request(seconds)
+            self.rate_limiter.update_from_headers(response.headers())
+            self.rate_limiter.record_success()
+            INSTRUMENTATION.add('http', seconds, requests=1,
+                                bytes=len((response.body() or '').encode('utf-8')),
+                                max_usage=parse_usage_headers(response.headers())[0])
+            return response
+
+
+def is_throttling_error(response: FacebookResponse) -> bool:
+    """
+    :param response: FacebookResponse - Failed response of a batched request
+    :return: bool - Whether the request failed with a throttling error code
+    """
+    error = response.error()
+    return error is not None and error.api_error_code() in THROTTLING_ERROR_CODES
+
+
+def is_transient_error(response: FacebookResponse) -> bool:
+    """
+    :param response: FacebookResponse - Failed response of a batched request
+    :return: bool - Whether the request failed with an error that Facebook reports as temporary
+    """
+    error = response.error()
+    return error is not None and (bool(error.api_transient_error()) or
+                                  error.api_error_code() in TRANSIENT_ERROR_CODES or
+                                  (error.http_status() or 0) >= 500)
+
+
+def backoff_batch(n_failed: int) -> None:
+    """
+    Hold all requests after some requests of a batch failed with a throttling or a transient
+    error. Batched requests are not retried by ThrottledFacebookAdsApi, as the batch call itself
+    succeeded, so the caller requests them again once the RateLimiter lets requests go out.
+
+    :param n_failed: int - Number of batched requests to request again
+    """
+    rate_limiter = getattr(FacebookAdsApi.get_default_api(), 'rate_limiter', None)
+    delay = rate_limiter.backoff() if rate_limiter is not None else 0
+    logger.warning(f"{n_failed} batched requests throttled or temporarily failed, "
+                   f"retrying them in {delay} seconds")
+
+
+def get_run_fields(object_types: List[str], profile: str) -> Dict[str, List[str]]:
+    """
+    Select the fields requested for every object type of a run, from the fields registry and a
+    field profile. Raise a ValueError if an object type, the profile or any of its fields is not
+    in the registries, or if the profile misses a required field.
+
+    :param object_types: List - Object types of the run
+    :param profile: str - Name of the field profile in field_profiles
+    :return: Dict - Dict of the type {object_type: [List_of_fields]} for the run object types
+    """
+    if profile not in field_profiles:
+        raise ValueError(f"Unknown field profile {profile}, expected one of "
+                         f"{list(field_profiles)}")
+
+    run_fields = {}
+    for object_type in object_types:
+        if object_type not in fields:
+            raise ValueError(f"Unknown object type {object_type}, expected one of {list(fields)}")
+
+        object_fields = field_profiles[profile].get(object_type, fields[object_type])
+        unknown = [field for field in object_fields if field not in fields[object_type]]
+        missing = [field for field in required_fields[object_type] if field not in object_fields]
+        if len(unknown) > 0 or len(missing) > 0:
+            raise ValueError(f"Invalid fields of {object_type} in field profile {profile}: "
+                             f"unknown {unknown}, missing required {missing}")
+
+        run_fields[object_type] = object_fields
+
+    return run_fields
+
 
 def get_credentials(secret_manager_client: SecretsManager,
                     secret_name: str) -> Dict[str, Any]:
@@ -160,13 +888,123 @@ def get_credentials(secret_manager_client: SecretsManager,
         return json.loads(decoded_binary_secret)
 
 
+def read_json(s3_client: S3, bucket_name: str, key: str) -> Any:
+    """
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Name of the bucket containing the object
+    :param key: str - Key of the object
+    :return: Any - JSON content of the object, None if the object does not exist
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+    return json.loads(response['Body'].read().decode('utf-8'))
+
+
+def write_json(s3_client: S3, bucket_name: str, key: str, content: Any) -> None:
+    """
+    Store a JSON object in S3, replacing the existing one if any.
+
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Name of the bucket containing the object
+    :param key: str - Key of the object
+    :param content: Any - Content of the object, with values that are not JSON types stored as
+        strings
+    """
+    s3_client.put_object(Bucket=bucket_name, Key=key,
+                         Body=bytes(json.dumps(content, default=str).encode('UTF-8')))
+
+
+def get_state_key(zone: str, tier: str, source: str, extraction: str) -> str:
+    """
+    :param zone: str - Name of the zone of the data process
+    :param tier: str - Name of the tier of the data process
+    :param source: str - Name of the source involved in the data process
+    :param extraction: str - Name of the extraction involved in the data process
+    :return: str - Key of the state object of the extraction
+    """
+    return f"metadata/{zone}/{tier}/{source}/_state/{extraction}.json"
+
+
+def write_state(s3_client: S3, bucket_name: str, zone: str, tier: str, source: str,
+                extraction: str, execution_time: int, metadata_key: str) -> None:
+    """
+    Store the state object of an extraction, which holds the latest execution time (the
+    watermark) and the key of the validation metadata it comes from.
+
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Name of the bucket containing the metadata
+    :param zone: str - Name of the zone of the data process
+    :param tier: str - Name of the tier of the data process
+    :param source: str - Name of the source involved in the data process
+    :param extraction: str - Name of the extraction involved in the data process
+    :param execution_time: int - Latest execution time of the extraction
+    :param metadata_key: str - Key of the validation metadata of the latest execution
+    """
+    key = get_state_key(zone=zone, tier=tier, source=source, extraction=extraction)
+    state = {'execution_time': execution_time, 'metadata_key': metadata_key}
+
+    write_json(s3_client=s3_client, bucket_name=bucket_name, key=key, content=state)
+
+    logger.info(f"Updated state s3://{bucket_name}/{key}: {state}")
+
+
+def rebuild_state(s3_client: S3, bucket_name: str, zone: str, tier: str, source: str,
+                  extraction: str) -> Dict[str, Any]:
+    """
+    Rebuild the state object of an extraction from its validation metadata: list all metadata for
+    the extraction prefix, open them from the last modified one (that is, the last stored) until
+    one of a run that advances the state, get its execution time and store it in the state
+    object. Replays and runs limited to some ad accounts don't advance the state, and are skipped.
+    Raise a KeyError if there is no metadata of such a run for the extraction.
+
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Name of the bucket containing the metadata
+    :param zone: str - Name of the zone of the data process
+    :param tier: str - Name of the tier of the data process
+    :param source: str - Name of the source involved in the data process
+    :param extraction: str - Name of the extraction involved in the data process
+    :return: Dict - Rebuilt state
+    """
+    prefix = f"metadata/{zone}/{tier}/{source}/{extraction}/"
+    logger.info(f"Rebuilding state of {source}/{extraction} from s3://{bucket_name}/{prefix}")
+
+    objects = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        objects.extend(obj for obj in page.get('Contents', [])
+                       if obj['Key'].endswith('metadata.json'))
+
+    for obj in sorted(objects, key=lambda obj: (obj['LastModified'], obj['Key']), reverse=True):
+        overview = read_json(s3_client=s3_client, bucket_name=bucket_name,
+                             key=obj['Key'])['Execution Overview']
+        if overview.get('replayed') or overview.get('account_ids'):
+            logger.info(f"Skipping key of a replay or of a run limited to some ad accounts: "
+                        f"{obj['Key']}")
+            continue
+
+        logger.info(f"Last added key: {obj['Key']}")
+        execution_time = overview['execution_time']
+        write_state(s3_client=s3_client, bucket_name=bucket_name, zone=zone, tier=tier,
+                    source=source, extraction=extraction, execution_time=execution_time,
+                    metadata_key=obj['Key'])
+        return {'execution_time': execution_time, 'metadata_key': obj['Key']}
+
+    raise KeyError(f"No metadata of a run advancing the state found in s3://{bucket_name}/"
+                   f"{prefix}")
+
+
+@instrumented('get_latest_epoch')
 def get_latest_epoch(s3_client: S3, bucket_name: str, zone: str,
                      tier: str, source: str, extraction: str) -> str:
     """
     Given a specific data process (ingestion, pseud-ingestion, refinement, ecc.), based on
-    the combination of bucket name, zone, tier, source and extraction, list all metadata for
-    that specific prefix. Then, grab the last modified one (that is, the last stored), open it
-    and get the latest execution time. Then return this value.
+    the combination of bucket name, zone, tier, source and extraction, read the state object
+    of the extraction and return the latest execution time it holds. If the state object does
+    not exist yet, it is rebuilt from the validation metadata. Raise a KeyError if there is no
+    metadata for the extraction.
 
     :param s3_client: S3 - Boto3 S3 client instance
     :param bucket_name: str - Name of the bucket containing the metadata
@@ -176,31 +1014,98 @@ def get_latest_epoch(s3_client: S3, bucket_name: str, zone: str,
     :param extraction: str - Name of the extraction involved in the data process
     :return: str - Last execution epoch timestamp up to seconds
     """
+    key = get_state_key(zone=zone, tier=tier, source=source, extraction=extraction)
 
-    def get_last_modified(obj): return int(obj['LastModified'].strftime('%s'))
-    prefix = f"metadata/{zone}/{tier}/{source}/{extraction}/"
+    state = read_json(s3_client=s3_client, bucket_name=bucket_name, key=key)
+    if state is None:
+        state = rebuild_state(s3_client=s3_client, bucket_name=bucket_name, zone=zone,
+                              tier=tier, source=source, extraction=extraction)
 
-    objs = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)['Contents']
+    latest_epoch = state['execution_time']
 
-    last_added = [obj['Key'] for obj in sorted(objs, key=get_last_modified)][-1]
-    logger.info(f"Last added key: {last_added}")
+    logger.info(f"Latest epoch for {source}/{extraction} is: {latest_epoch}")
+    return latest_epoch
 
-    response = s3_client.get_object(Bucket=bucket_name, Key=last_added)
 
-    content = json.loads(response['Body'].read().decode('utf-8'))
-    latest_epoch = content['Execution Overview']['execution_time']
+def get_insights_time_range(latest_epoch: str, lookback_days: int, max_days: int,
+                            backfill_since: str = '', backfill_until: str = '',
+                            today: datetime.date = None) -> Dict[str, str]:
+    """
+    Plan the days of ad_insights that are stale and need to be requested. Normally this goes from
+    the day of the last executed ingestion, moved back by the attribution lookback, up to today:
+    after failed runs the range widens to cover the gap, but never beyond max_days. If a backfill
+    range is passed, it is used as is.
 
-    logger.info(f"Latest epoch for {source}/{extraction} is: {latest_epoch}")
-    return latest_epoch
+    :param latest_epoch: str - Epoch timestamp of last executed ingestion
+    :param lookback_days: int - Days before the last ingestion whose insights can still change
+    :param max_days: int - Maximum number of days in the range, excluding backfills
+    :param backfill_since: str - First day of a backfill range, as %Y-%m-%d, empty for none
+    :param backfill_until: str - Last day of a backfill range, as %Y-%m-%d, empty for today
+    :param today: datetime.date - Current day, defaults to today
+    :return: Dict - Time range with 'since' and 'until' days, as %Y-%m-%d
+    """
+    today = today or datetime.date.today()
+
+    if backfill_since != '':
+        return {'since': backfill_since, 'until': backfill_until or today.strftime("%Y-%m-%d")}
+
+    latest_date = min(datetime.date.fromtimestamp(int(latest_epoch)), today)
+    since = max(latest_date - datetime.timedelta(days=lookback_days),
+                today - datetime.timedelta(days=max_days - 1))
+
+    return {'since': since.strftime("%Y-%m-%d"), 'until': today.strftime("%Y-%m-%d")}
 
 
-def get_params(object_type: str, latest_epoch: str) -> Dict[str, Union[str, List, int]]:
+def plan_extraction(s3_client: S3, bucket_name: str, zone: str, tier: str, source: str,
+                    extraction: str, execution_time: int, lookback_days: int, max_days: int,
+                    backfill_since: str = '', backfill_until: str = '') -> Dict[str, Any]:
+    """
+    Plan an extraction: get the latest epoch of the extraction and, for ad_insights, the time
+    range of the days to be requested, according to the insights job arguments.
+
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Name of the bucket containing the metadata
+    :param zone: str - Name of the zone of the data process
+    :param tier: str - Name of the tier of the data process
+    :param source: str - Name of the source involved in the data process
+    :param extraction: str - Name of the extraction involved in the data process
+    :param execution_time: int - Execution time of the extraction
+    :param lookback_days: int - Days before the last ingestion whose insights can still change
+    :param max_days: int - Maximum number of days in the insights range, excluding backfills
+    :param backfill_since: str - First day of a backfill range, as %Y-%m-%d, empty for none
+    :param backfill_until: str - Last day of a backfill range, as %Y-%m-%d, empty for today
+    :return: Dict - Plan with 'execution_time', 'latest_epoch' and 'time_range' (None but for
+        ad_insights)
+    """
+    try:
+        latest_epoch = get_latest_epoch(s3_client=s3_client, bucket_name=bucket_name, zone=zone,
+                                        tier=tier, source=source, extraction=extraction)
+    except KeyError as e:
+        latest_epoc = "2022-04-14 00:00:00"
+        logger.info(f"#: Get latest_epoch: {latest_epoc}")
+        latest_epoch = str(int(datetime.datetime.strptime(latest_epoc, '%Y-%m-%d %H:%M:%S').timestamp()))
+
+    # Plan the stale days of insights to be requested
+    time_range = None
+    if extraction == 'ad_insights':
+        time_range = get_insights_time_range(latest_epoch=latest_epoch,
+                                             lookback_days=lookback_days, max_days=max_days,
+                                             backfill_since=backfill_since,
+                                             backfill_until=backfill_until)
+
+    return {'execution_time': execution_time, 'latest_epoch': latest_epoch,
+            'time_range': time_range}
+
+
+def get_params(object_type: str, latest_epoch: str,
+               time_range: Dict[str, str] = None) -> Dict[str, Union[str, List, int]]:
     """
     This function is used to create a params body dict to pass to a Facebook API call. Params are
     used to filter the API calls.
 
     :param object_type: str - Data object being queried
     :param latest_epoch: str - Epoch timestamp of last executed ingestion
+    :param time_range: Dict - Days of ad_insights to be requested, see get_insights_time_range
     :return: Dict - Dictionary containing parameters to be passed to a Facebook API call
     """
 
@@ -215,23 +1120,16 @@ def get_params(object_type: str, latest_epoch: str) -> Dict[str, Union[str, List
 
     elif object_type in ['ad_insights']:
         logger.info(f"Object type is {object_type}, creating parameters accordingly")
-        yesterday = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-
-        logger.info(f"Yesterday is {yesterday}, today is {today}")
-
-        params_yesterday = {
-            'time_range': {'since': yesterday, 'until': yesterday},
-            'level': 'ad',
-            'limit': 1000
-        }
+        logger.info(f"Requesting daily insights from {time_range['since']} "
+                    f"to {time_range['until']}")
 
-        params_today = {
-            'time_range': {'since': today, 'until': today},
+        params = {
+            'time_range': time_range,
+            'time_increment': 1,
             'level': 'ad',
             'limit': 1000
         }
-        return params_yesterday, params_today
+        return params
 
     else:
         params = {}
@@ -240,11 +1138,12 @@ def get_params(object_type: str, latest_epoch: str) -> Dict[str, Union[str, List
 
 def create_validation_metadata(s3_client: S3, execution_time: int,
                                bucket_name: str, zone: str, tier: str, source: str, extraction: str,
-                               **kwargs) -> None:
+                               update_state: bool = True, **kwargs) -> None:
     """
     Pass all required arguments, plus all keywords arguments to a dictionary, convert it to JSON
     and dump it to S3 based on the combination of 'metadata' and bucket_name, zone, tier, source,
-    extraction, and execution_time.
+    extraction, and execution_time. Then, unless update_state is False, advance the state object
+    of the extraction to the execution_time.
 
     :param s3_client: S3 - Boto3 S3 client instance
     :param execution_time: int - Execution time of present process
@@ -253,6 +1152,7 @@ def create_validation_metadata(s3_client: S3, execution_time: int,
     :param tier: str - Tier of the present process
     :param source: str - Source of the present process
     :param extraction: str -  Extraction of the present process
+    :param update_state: bool - Whether the state of the extraction is advanced to execution_time
     """
 
     kwargs['execution_time'] = execution_time
@@ -271,176 +1171,1333 @@ def create_validation_metadata(s3_client: S3, execution_time: int,
 
     logger.info(f"Succesfully uploaded metadata to s3://{bucket_name}/{key}")
 
+    if update_state:
+        write_state(s3_client=s3_client, bucket_name=bucket_name, zone=zone, tier=tier,
+                    source=source, extraction=extraction, execution_time=execution_time,
+                    metadata_key=key)
+
 
 def adjust_ad_image_data(df: pd.DataFrame, latest_epoch: str) -> pd.DataFrame:
     """
-    This function flattens ad_image data on 'creatives' column. It then proceeds to filter the data
-    so to keep only the entries with an 'updated_timestamp' greater then last ingestion execution
-    epoch - due to the fact that ad_image object cannot be filter at the moment of the API call.
-    Return the adjusted DataFrame.
+    This function filters ad_image data so to keep only the entries with an 'updated_time'
+    greater or equal than last ingestion execution epoch - due to the fact that ad_image object
+    cannot be filter at the moment of the API call. It then proceeds to flatten the data on
+    'creatives' column. Both steps work on the whole DataFrame at once. Return the adjusted
+    DataFrame.
 
     :param df: pd.DataFrame - Dataframe containing ad_image data
     :param latest_epoch: str - Last ingestion execution epoch timestamp up to seconds
     :return: pd.DataFrame - Adjusted pandas DataFrame
     """
-    def _sanitize_timestamp(timestamp: str) -> int:
-        return int(datetime.datetime.strptime(timestamp[:-5], "%Y-%m-%dT%H:%M:%S").timestamp())
+    updated_time = pd.to_datetime(df['updated_time'], format='%Y-%m-%dT%H:%M:%S%z',
+                                  errors='coerce', utc=True)
+    df = df.loc[updated_time >= pd.Timestamp(int(latest_epoch), unit='s', tz='UTC')]
+
+    return df.explode('creatives')
+
+
+def get_ad_format(row: pd.Series) -> str:
+    """
+    Choose the preview format of an ad from the first publisher platform and position of its
+    targeting. Return an empty string if the ad has no publisher platform.
+
+    :param row: pd.Series - Row of the ad DataFrame, with flattened targeting columns
+    :return: str - AdPreview.AdFormat value, or empty string
+    """
+    def first(column: str) -> str:
+        value = row.get(column, '')
+        return value[0] if isinstance(value, list) and len(value) > 0 else ''
+
+    from facebook_business.adobjects.adpreview import AdPreview
+
+    publisher = first('publisher_platforms')
+
+    if publisher == '':
+        return ''
+    elif publisher == 'instagram' and first('instagram_positions') != '':
+        if first('instagram_positions') == 'story':
+            return AdPreview.AdFormat.instagram_story
+        return AdPreview.AdFormat.instagram_standard
+    elif publisher == 'facebook' and first('facebook_positions') != '':
+        if first('facebook_positions') == 'story':
+            return AdPreview.AdFormat.facebook_story_mobile
+        return AdPreview.AdFormat.desktop_feed_standard
+    else:
+        return AdPreview.AdFormat.desktop_feed_standard
+
+
+def parse_preview_body(body: str) -> str:
+    """
+    Extract the preview URL from the iframe HTML returned by the previews edge of an ad.
+
+    :param body: str - HTML body of an AdPreview
+    :return: str - Preview URL
+    """
+    preview = str(body).replace("amp;", "")
+    preview = (preview.split('src="')[1].split('" width')[0])
+    return preview.replace(';t=', '&t=')
+
+
+class PreviewCache:
+    """
+    Ad preview URLs keyed by (ad_id, ad_format, creative id), persisted as a JSON object in S3 so
+    that ads that did not change are not previewed again by the following runs. Entries older
+    than ttl_days are dropped when the cache is saved, so that preview URLs are refreshed from
+    time to time. Hits and misses are counted for the validation metadata.
+    """
+
+    def __init__(self, s3_client: S3, bucket_name: str, key: str, ttl_days: int = 30):
+        """
+        :param s3_client: S3 - Boto3 S3 client instance
+        :param bucket_name: str - Name of the bucket containing the cache
+        :param key: str - Key of the cache object
+        :param ttl_days: int - Days after which a cached preview URL is fetched again
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.ttl_days = ttl_days
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(ad_id: str, ad_format: str, creative_id: str) -> str:
+        return f"{ad_id}|{ad_format}|{creative_id}"
+
+    def load(self) -> None:
+        """
+        Load the cache from S3, starting from an empty cache if it does not exist yet.
+        """
+        self._entries = read_json(s3_client=self.s3_client, bucket_name=self.bucket_name,
+                                  key=self.key)
+        if self._entries is None:
+            logger.info(f"No preview cache found in s3://{self.bucket_name}/{self.key}")
+            self._entries = {}
+        else:
+            logger.info(f"Loaded {len(self._entries)} cached previews from "
+                        f"s3://{self.bucket_name}/{self.key}")
+
+    def merge(self, key: str) -> None:
+        """
+        Add the entries of another cache object, e.g. of a shard of a sharded run, keeping the
+        most recent entry of every key.
+
+        :param key: str - Key of the other cache object
+        """
+        entries = read_json(s3_client=self.s3_client, bucket_name=self.bucket_name, key=key)
+        if entries is None:
+            return
+
+        with self._lock:
+            for cache_key, entry in entries.items():
+                if cache_key not in self._entries or \
+                        entry['cached_at'] > self._entries[cache_key]['cached_at']:
+                    self._entries[cache_key] = entry
+        logger.info(f"Merged {len(entries)} cached previews from s3://{self.bucket_name}/{key}")
+
+    def save(self) -> None:
+        """
+        Drop the expired entries and store the cache in S3.
+        """
+        min_cached_at = int(time.time()) - self.ttl_days * 24 * 60 * 60
+        with self._lock:
+            self._entries = {key: entry for key, entry in self._entries.items()
+                             if entry['cached_at'] >= min_cached_at}
+            write_json(s3_client=self.s3_client, bucket_name=self.bucket_name, key=self.key,
+                       content=self._entries)
+        logger.info(f"Stored {len(self._entries)} cached previews in "
+                    f"s3://{self.bucket_name}/{self.key}")
+
+    def get(self, key: str) -> Union[str, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry['url']
+
+    def put(self, key: str, url: str) -> None:
+        with self._lock:
+            self._entries[key] = {'url': url, 'cached_at': int(time.time())}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def get_previews(ad_formats: Dict[str, Tuple[str, str]]) -> Dict[str, str]:
+    """
+    Fetch ad previews with Graph API batch requests of up to GRAPH_BATCH_SIZE calls each.
+    Calls failed with a throttling or a transient error are requested again after a backoff, up
+    to MAX_THROTTLING_RETRIES times, then they fail the run. Calls failed with any other error,
+    i.e. ads that have no preview, are logged and left out of the result.
+
+    :param ad_formats: Dict - Caller defined key mapped to an (ad_id, ad_format) tuple
+    :return: Dict - Caller defined key mapped to the preview URL
+    """
+    previews = {}
+    failed = {}
+
+    def on_success(key: str):
+        def callback(response: FacebookResponse) -> None:
+            data = response.json().get('data', [])
+            if len(data) > 0:
+                previews[key] = parse_preview_body(data[-1]['body'])
+        return callback
+
+    def on_failure(key: str):
+        def callback(response: FacebookResponse) -> None:
+            if is_throttling_error(response) or is_transient_error(response):
+                failed[key] = response.body()
+            else:
+                logger.warning(f"Unable to get preview {key}: {response.body()}")
+        return callback
+
+    keys = list(ad_formats)
+    api = FacebookAdsApi.get_default_api()
+    attempt = 0
+    while True:
+        failed.clear()
+        for i in range(0, len(keys), GRAPH_BATCH_SIZE):
+            batch = api.new_batch()
+            for key in keys[i:i + GRAPH_BATCH_SIZE]:
+                ad_id, ad_format = ad_formats[key]
+                Ad(ad_id).get_previews(params={'ad_format': ad_format}, batch=batch,
+                                       success=on_success(key), failure=on_failure(key))
+
+            while batch is not None:
+                batch = batch.execute()
+
+        if len(failed) == 0:
+            return previews
+
+        keys = list(failed)
+        if attempt >= MAX_THROTTLING_RETRIES:
+            raise RuntimeError(f"Unable to get {len(keys)} previews after {attempt} retries: "
+                               f"{failed[keys[0]]}")
+
+        attempt += 1
+        backoff_batch(len(keys))
+
+
+@instrumented('get_preview_url')
+def get_preview_url(df: pd.DataFrame, preview_cache: PreviewCache = None,
+                    fetch: bool = True) -> pd.DataFrame:
+    """
+    Add a preview_url column to the ad DataFrame. Previews are looked up in the cache first, the
+    missing ones are fetched with batch requests and added to the cache. Ads without a publisher
+    platform, or that have no preview, get 'not_available'.
+
+    :param df: pd.DataFrame - Dataframe containing ad data
+    :param preview_cache: PreviewCache - Cache of the preview URLs, None to always fetch them
+    :param fetch: bool - Whether previews missing from the cache are fetched
+    :return: pd.DataFrame - Ad DataFrame with the preview_url column
+    """
+    ad_formats = df.apply(get_ad_format, axis=1)
+
+    urls = {}
+    to_fetch = {}
+    for ad_id, ad_format, creative_id in zip(df['id'].astype(str), ad_formats, df['creative']):
+        if ad_format == '':
+            continue
+
+        key = PreviewCache.cache_key(ad_id, ad_format, creative_id)
+        url = preview_cache.get(key) if preview_cache is not None else None
+        if url is None:
+            to_fetch[key] = (ad_id, ad_format)
+        else:
+            urls[key] = url
 
-    df = df.explode('creatives')
-    df['updated_time_timestamp'] = df['updated_time'].apply(_sanitize_timestamp)
-    df = df.loc[df['updated_time_timestamp'] >= int(latest_epoch)]
-    df = df.drop('updated_time_timestamp', 1)
+    if fetch and len(to_fetch) > 0:
+        logger.info(f"Fetching {len(to_fetch)} ad previews")
+        previews = get_previews(to_fetch)
+        urls.update(previews)
+        if preview_cache is not None:
+            for key, url in previews.items():
+                preview_cache.put(key, url)
+
+    df['preview_url'] = [urls.get(PreviewCache.cache_key(ad_id, ad_format, creative_id),
+                                  'not_available')
+                         for ad_id, ad_format, creative_id
+                         in zip(df['id'].astype(str), ad_formats, df['creative'])]
 
     return df
 
 
-def get_preview_url(df: pd.DataFrame) -> pd.DataFrame:
-    id_list = df['id'].unique().tolist()
+class RecordAccumulator:
+    """
+    Column-oriented buffer for Graph API records. Every appended record is split into one list
+    per column, new columns (e.g. the flattened targeting keys) are back-filled with NaN for the
+    rows already stored, and the whole buffer is turned into a single pandas DataFrame only once
+    by to_dataframe(), instead of building and appending a one-row DataFrame per record.
+    """
 
-    for ad_id in id_list:
+    def __init__(self, columns: List[str]):
+        """
+        :param columns: List - Columns the materialized DataFrame always contains, in order
+        """
+        self._columns = {column: [] for column in columns}
+        self._n_rows = 0
 
-        time.sleep(1.5)
+    def __len__(self) -> int:
+        return self._n_rows
 
-        ad_id = str(ad_id)
-        publisher = df.loc[df['id'] == ad_id]['publisher_platforms'].max(
-        )[0] if df.loc[df['id'] == ad_id]['publisher_platforms'].max() != '' else ''
+    def append(self, record: Dict[str, Any]) -> None:
+        """
+        Add a single record to the buffer.
 
-        if publisher != '':
-            if publisher == 'instagram' and df.loc[df['id'] == ad_id]['instagram_positions'].max() != '':
-                position = df.loc[df['id'] == ad_id]['instagram_positions'].max()[0]
-                if position == 'story':
-                    ad_format = AdPreview.AdFormat.instagram_story
-                else:
-                    ad_format = AdPreview.AdFormat.instagram_standard
-            elif publisher == 'facebook' and df.loc[df['id'] == ad_id]['facebook_positions'].max() != '':
-                position = df.loc[df['id'] == ad_id]['facebook_positions'].max()[0]
-                if position == 'story':
-                    ad_format = AdPreview.AdFormat.facebook_story_mobile
+        :param record: Dict - Mapping of column name to value for one object
+        """
+        for column, value in record.items():
+            if column not in self._columns:
+                self._columns[column] = [float('nan')] * self._n_rows
+            self._columns[column].append(value)
+
+        self._n_rows += 1
+
+        for values in self._columns.values():
+            if len(values) < self._n_rows:
+                values.append(float('nan'))
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Materialize the buffered records.
+
+        :return: pd.DataFrame - One row per appended record, one column per seen field
+        """
+        return pd.DataFrame(self._columns, columns=list(self._columns))
+
+
+class RawRecordAccumulator:
+    """
+    Buffer of raw ad_insights records, as found in the JSON pages of the Graph API. The records
+    are turned into a pandas DataFrame in a single vectorized pass by to_dataframe(), yielding the
+    same DataFrame as RecordAccumulator with compile_extractors, without building an AdsInsights
+    object nor a flattened record per row.
+    """
+
+    def __init__(self, columns: List[str]):
+        """
+        :param columns: List - Fields requested for ad_insights, the columns of the DataFrame
+        """
+        self._columns = columns
+        self._records = []
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def extend(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Add the records of a page to the buffer.
+
+        :param records: List - Raw records of a page of the Graph API
+        """
+        self._records.extend(records)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Materialize the buffered records, reducing the outbound clicks fields to their first value
+        and storing missing fields as empty strings, as compile_extractor does. Fields that are
+        present but null are kept as None, as compile_extractor does too.
+
+        :return: pd.DataFrame - One row per buffered record, one column per requested field
+        """
+        # Missing fields are NaN and null ones None in an object DataFrame
+        dataframe = pd.DataFrame(self._records, columns=self._columns, dtype=object)
+
+        for column in ['cost_per_outbound_click', 'outbound_clicks']:
+            if column in dataframe.columns:
+                dataframe[column] = dataframe[column].map(
+                    lambda value: value[0]['value'] if isinstance(value, list) else value)
+
+        return dataframe.mask(dataframe.isna() & ~dataframe.isin([None]), '')
+
+
+def compile_extractor(field: str) -> Callable[[Mapping[str, Any], Dict[str, Any]], None]:
+    """
+    Build the function that copies a field of a Graph API object to a record. Nested fields that
+    are of interest (creative, pacing_type, outbound clicks and targeting) are reduced to plain
+    values; missing fields are stored as empty strings.
+
+    :param field: str - Field requested for the object type
+    :return: Callable - Function of (object, record) that adds the field to the record
+    """
+    if field == 'creative':
+        def extract(object: Mapping[str, Any], record: Dict[str, Any]) -> None:
+            record[field] = object[field]['id'] if field in object else ''
+    elif field == 'pacing_type':
+        def extract(object: Mapping[str, Any], record: Dict[str, Any]) -> None:
+            record[field] = object[field][0] if field in object else ''
+    elif field in ['cost_per_outbound_click', 'outbound_clicks']:
+        def extract(object: Mapping[str, Any], record: Dict[str, Any]) -> None:
+            record[field] = object[field][0]['value'] if field in object else ''
+    elif field == 'targeting':
+        def extract(object: Mapping[str, Any], record: Dict[str, Any]) -> None:
+            # All the targeting keys are flattened, as long as one of TARGETING_KEYS is there
+            targeting = object[field]
+            if len(targeting) > 0:
+                if any(key in targeting for key in TARGETING_KEYS):
+                    record.update(targeting)
+                for key in TARGETING_KEYS:
+                    if key not in targeting:
+                        record[key] = ''
+            record[field] = targeting
+    else:
+        def extract(object: Mapping[str, Any], record: Dict[str, Any]) -> None:
+            record[field] = object[field] if field in object else ''
+
+    return extract
+
+
+def compile_extractors(object_fields: List[str]) -> List[Callable[[Mapping[str, Any],
+                                                                   Dict[str, Any]], None]]:
+    """
+    :param object_fields: List - Fields requested for the object type
+    :return: List - Functions extracting every field, see compile_extractor
+    """
+    return [compile_extractor(field) for field in object_fields]
+
+
+def parse_object(object: Mapping[str, Any],
+                 extractors: List[Callable[[Mapping[str, Any], Dict[str, Any]], None]]
+                 ) -> Dict[str, Any]:
+    """
+    Flatten a single Graph API object into a dict of column name to value.
+
+    :param object: Mapping - Facebook object (or dict) returned by a cursor
+    :param extractors: List - Functions extracting every field, see compile_extractors
+    :return: Dict - Flattened representation of the object
+    """
+    record = {}
+    for extract in extractors:
+        extract(object, record)
+    return record
+
+
+def is_oversized_error(error: Exception) -> bool:
+    """
+    :param error: Exception - Error raised by a Graph API request
+    :return: bool - Whether the request asked for too much data or timed out
+    """
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+
+    return isinstance(error, FacebookRequestError) and \
+        (error.api_error_code() in OVERSIZED_ERROR_CODES or
+         error.api_error_subcode() in OVERSIZED_ERROR_SUBCODES)
+
+
+def get_range_days(time_range: Dict[str, str]) -> int:
+    """
+    :param time_range: Dict - Time range with 'since' and 'until' days, as %Y-%m-%d
+    :return: int - Number of days of the time range
+    """
+    return (datetime.datetime.strptime(time_range['until'], '%Y-%m-%d') -
+            datetime.datetime.strptime(time_range['since'], '%Y-%m-%d')).days + 1
+
+
+def split_time_range(time_range: Dict[str, str]) -> List[Dict[str, str]]:
+    """
+    Split a time range of days in two halves, the first one being the longest. A time range of
+    one day is not split.
+
+    :param time_range: Dict - Time range with 'since' and 'until' days, as %Y-%m-%d
+    :return: List - Time ranges of the halves, or the time range itself if it is one day long
+    """
+    days = get_range_days(time_range)
+    if days < 2:
+        return [time_range]
+
+    since = datetime.datetime.strptime(time_range['since'], '%Y-%m-%d').date()
+    middle = since + datetime.timedelta(days=(days + 1) // 2)
+    return [{'since': time_range['since'],
+             'until': (middle - datetime.timedelta(days=1)).strftime('%Y-%m-%d')},
+            {'since': middle.strftime('%Y-%m-%d'), 'until': time_range['until']}]
+
+
+def split_report_range(time_range: Dict[str, str], max_days: int = None,
+                       is_split: Callable[[Dict[str, str]], bool] = None) -> List[Dict[str, str]]:
+    """
+    Split the time range of a report job in halves, recursively, as long as it is longer than
+    max_days days or is_split tells that it was split by a previous run.
+
+    :param time_range: Dict - Time range with 'since' and 'until' days, as %Y-%m-%d
+    :param max_days: int - Maximum days of the time ranges, None for no maximum
+    :param is_split: Callable - Function telling whether a time range was already split
+    :return: List - Consecutive time ranges covering time_range
+    """
+    halves = split_time_range(time_range)
+    if len(halves) < 2:
+        return [time_range]
+
+    if not ((max_days is not None and get_range_days(time_range) > max_days) or
+            (is_split is not None and is_split(time_range))):
+        return [time_range]
+
+    return [part for half in halves for part in split_report_range(half, max_days, is_split)]
+
+
+def get_chunk_name(key: str, chunk: int) -> str:
+    """
+    :param key: str - Key of the ad account, or of the report job, in the checkpoint
+    :param chunk: int - Number of the chunk of the key
+    :return: str - Name of the file of the chunk, see ParquetChunkWriter.write_file
+    """
+    return f"{key}-{chunk:05d}"
+
+
+def get_report_key(account_id: str, time_range: Dict[str, str],
+                   account_time_range: Dict[str, str]) -> str:
+    """
+    :param account_id: str - Id of the ad account of the report job
+    :param time_range: Dict - Time range of the report job
+    :param account_time_range: Dict - Time range requested for the ad account
+    :return: str - Key of the report job in the checkpoint, the ad account id unless it is split
+    """
+    if time_range == account_time_range:
+        return account_id
+
+    return f"{account_id}-{time_range['since']}-{time_range['until']}"
+
+
+class RequestTuner:
+    """
+    Page sizes of the Graph API requests and days of the ad_insights report jobs of every ad
+    account, tuned from the responses and persisted as a JSON object in S3, so that the following
+    runs start from the tuned values. A page size is halved when a request asks for too much data
+    or times out, and grows by half after pages fetched in less than fast_seconds, up to three
+    quarters of the last page size that failed. When a report job fails for good it is split into
+    date halves, and the report jobs of the ad account are split up front from then on.
+    """
+
+    def __init__(self, s3_client: S3, bucket_name: str, key: str,
+                 min_limit: int = MIN_PAGE_LIMIT, max_limit: int = MAX_PAGE_LIMIT,
+                 fast_seconds: float = FAST_PAGE_SECONDS):
+        """
+        :param s3_client: S3 - Boto3 S3 client instance
+        :param bucket_name: str - Name of the bucket containing the tuned values
+        :param key: str - Key of the tuned values object
+        :param min_limit: int - Smallest page size
+        :param max_limit: int - Largest page size
+        :param fast_seconds: float - Seconds under which a page grows the page size
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.fast_seconds = fast_seconds
+        self.accounts = {}
+
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Load the tuned values from S3, starting from none if they do not exist yet.
+        """
+        content = read_json(s3_client=self.s3_client, bucket_name=self.bucket_name, key=self.key)
+        if content is None:
+            logger.info(f"No tuned requests found in s3://{self.bucket_name}/{self.key}")
+            return
+
+        self.accounts = content['accounts']
+        logger.info(f"Loaded tuned requests of {len(self.accounts)} ad accounts from "
+                    f"s3://{self.bucket_name}/{self.key}")
+
+    def save(self) -> None:
+        """
+        Store the tuned values in S3.
+        """
+        with self._lock:
+            write_json(s3_client=self.s3_client, bucket_name=self.bucket_name, key=self.key,
+                       content={'accounts': self.accounts})
+        logger.info(f"Stored tuned requests of {len(self.accounts)} ad accounts in "
+                    f"s3://{self.bucket_name}/{self.key}")
+
+    def _settings(self, account_id: str, object_type: str) -> Dict[str, int]:
+        return self.accounts.setdefault(account_id, {}).setdefault(object_type, {})
+
+    def limit(self, account_id: str, object_type: str, default: int) -> int:
+        """
+        :param account_id: str - Id of the ad account
+        :param object_type: str - Object type of the requests
+        :param default: int - Page size of the requests, if not tuned yet
+        :return: int - Tuned page size of the requests
+        """
+        with self._lock:
+            return self.accounts.get(account_id, {}).get(object_type, {}).get('limit', default)
+
+    def shrink(self, account_id: str, object_type: str, limit: int) -> Union[int, None]:
+        """
+        Halve the page size after a request that asked for too much data or timed out.
+
+        :param account_id: str - Id of the ad account
+        :param object_type: str - Object type of the request
+        :param limit: int - Page size of the failed request
+        :return: int - Page size to retry the request with, None if it can't shrink any more
+        """
+        if limit <= self.min_limit:
+            return None
+
+        with self._lock:
+            settings = self._settings(account_id, object_type)
+            settings['limit'] = max(self.min_limit, limit // 2)
+            settings['max_limit'] = max(self.min_limit, limit * 3 // 4)
+            return settings['limit']
+
+    def record_page(self, account_id: str, object_type: str, limit: int, seconds: float) -> int:
+        """
+        Grow the page size after a page fetched in less than fast_seconds.
+
+        :param account_id: str - Id of the ad account
+        :param object_type: str - Object type of the request
+        :param limit: int - Page size of the request
+        :param seconds: float - Duration of the request
+        :return: int - Page size of the next request
+        """
+        if seconds >= self.fast_seconds:
+            return limit
+
+        with self._lock:
+            settings = self._settings(account_id, object_type)
+            grown = min(settings.get('max_limit', self.max_limit), self.max_limit,
+                        limit * 3 // 2)
+            if grown <= limit:
+                return limit
+
+            settings['limit'] = grown
+            return grown
+
+    def report_days(self, account_id: str) -> Union[int, None]:
+        """
+        :param account_id: str - Id of the ad account
+        :return: int - Maximum days of the report jobs of the ad account, None for no maximum
+        """
+        with self._lock:
+            return self.accounts.get(account_id, {}).get('ad_insights', {}).get('report_days')
+
+    def record_split(self, account_id: str, days: int) -> None:
+        """
+        Lower the maximum days of the report jobs of an ad account after a report job was split.
+
+        :param account_id: str - Id of the ad account
+        :param days: int - Days of the longest part of the split report job
+        """
+        with self._lock:
+            settings = self._settings(account_id, 'ad_insights')
+            settings['report_days'] = min(settings.get('report_days', days), days)
+
+
+class ReportJobManager:
+    """
+    Asynchronous ad_insights report jobs of many ad accounts. All the jobs are submitted up front,
+    then their status is polled together with batch requests, waiting longer and longer between
+    polls, and the completed jobs are returned as soon as they finish. Failed or skipped jobs are
+    submitted again up to max_retries times. Then, if on_split is passed, they are split into two
+    jobs of the halves of their time range, after on_split is called, else they fail the run.
+    Jobs that can't be polled max_poll_failures times in a row, e.g. expired jobs resumed from a
+    previous run, fail the run, unless they were resumed and on_restart is passed: then they are
+    submitted again, after on_restart is called.
+    Every job has a key, the ad account id unless it is a part of the time range of the ad account,
+    see get_report_key.
+    """
+
+    def __init__(self, fields: List[str], params: Dict[str, Union[str, List, int]],
+                 max_retries: int = REPORT_MAX_RETRIES, initial_delay: float = 2,
+                 max_delay: float = 30,
+                 account_params: Dict[str, Dict[str, Union[str, List, int]]] = None,
+                 on_split: Callable[[AdAccount, str, List[Dict[str, str]]], None] = None,
+                 max_poll_failures: int = REPORT_MAX_POLL_FAILURES,
+                 on_restart: Callable[[AdAccount, str], None] = None):
+        """
+        :param fields: List - Fields of the reports
+        :param params: Dict - Parameters of the reports
+        :param max_retries: int - Number of times a failed or skipped job is submitted again
+        :param initial_delay: float - Seconds before the first poll
+        :param max_delay: float - Maximum seconds between two polls
+        :param account_params: Dict - Parameters of the reports of some ad accounts, by id
+        :param on_split: Callable - Function of the ad account, key and time ranges of a split job
+        :param max_poll_failures: int - Number of polls in a row a job can fail before it is
+            submitted again or fails the run
+        :param on_restart: Callable - Function of the ad account and key of a resumed job that is
+            submitted again
+        """
+        self.fields = fields
+        self.params = params
+        self.account_params = account_params or {}
+        self.on_split = on_split
+        self.on_restart = on_restart
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_poll_failures = max_poll_failures
+
+        self._pending = []
+        self._poll_failures = {}
+        self._resumed = set()
+
+    def submit(self, account: AdAccount, attempt: int = 0,
+               params: Dict[str, Union[str, List, int]] = None, key: str = None) -> None:
+        """
+        Submit the report job of an ad account.
+
+        :param account: AdAccount - Ad account of the report
+        :param attempt: int - Number of previous failed jobs for the ad account
+        :param params: Dict - Parameters of the report, None for the ones of the ad account
+        :param key: str - Key of the report job, None for the ad account id
+        """
+        params = params or self.account_params.get(account[AdAccount.Field.id], self.params)
+        report_run = AdAccount(account[AdAccount.Field.id]).get_insights(
+            params=params, fields=self.fields, is_async=True)
+        logger.info(f"Submitted report job {report_run[AdReportRun.Field.id]} "
+                    f"for {key or account[AdAccount.Field.id]}")
+        self._pending.append((account, report_run, attempt, params,
+                              key or account[AdAccount.Field.id]))
+
+    def resume(self, account: AdAccount, report_run_id: str,
+               params: Dict[str, Union[str, List, int]] = None, key: str = None) -> None:
+        """
+        Wait for the report job of an ad account submitted by a previous run, instead of
+        submitting a new one.
+
+        :param account: AdAccount - Ad account of the report
+        :param report_run_id: str - Id of the report job
+        :param params: Dict - Parameters of the report, None for the ones of the ad account
+        :param key: str - Key of the report job, None for the ad account id
+        """
+        params = params or self.account_params.get(account[AdAccount.Field.id], self.params)
+        logger.info(f"Resuming report job {report_run_id} for {key or account[AdAccount.Field.id]}")
+        self._resumed.add(report_run_id)
+        self._pending.append((account, AdReportRun(report_run_id), 0, params,
+                              key or account[AdAccount.Field.id]))
+
+    def _poll(self) -> None:
+        def on_success(report_run: AdReportRun):
+            def callback(response: FacebookResponse) -> None:
+                self._poll_failures.pop(report_run[AdReportRun.Field.id], None)
+                for field, value in response.json().items():
+                    report_run[field] = value
+            return callback
+
+        def on_failure(report_run: AdReportRun):
+            def callback(response: FacebookResponse) -> None:
+                # Throttled polls are not failures of the job, it is polled again later
+                if is_throttling_error(response):
+                    throttled.append(report_run)
+                    return
+
+                report_run_id = report_run[AdReportRun.Field.id]
+                self._poll_failures[report_run_id] = self._poll_failures.get(report_run_id, 0) + 1
+                logger.warning(f"Unable to poll report job {report_run_id} "
+                               f"({self._poll_failures[report_run_id]} times in a row): "
+                               f"{response.body()}")
+            return callback
+
+        api = FacebookAdsApi.get_default_api()
+        for i in range(0, len(self._pending), GRAPH_BATCH_SIZE):
+            throttled = []
+            batch = api.new_batch()
+            for _, report_run, _, _, _ in self._pending[i:i + GRAPH_BATCH_SIZE]:
+                report_run.api_get(fields=[AdReportRun.Field.async_status,
+                                           AdReportRun.Field.async_percent_completion],
+                                   batch=batch, success=on_success(report_run),
+                                   failure=on_failure(report_run))
+
+            while batch is not None:
+                batch = batch.execute()
+
+            if len(throttled) > 0:
+                backoff_batch(len(throttled))
+
+    def completed(self) -> Iterator[Tuple[AdAccount, AdReportRun, str]]:
+        """
+        Wait for the submitted jobs, yielding each one as soon as it is completed.
+
+        :return: Iterator - Ad account, completed report job and its key
+        """
+        delay = self.initial_delay
+        while len(self._pending) > 0:
+            time.sleep(delay)
+            INSTRUMENTATION.add('report_wait', delay)
+            delay = min(self.max_delay, delay * 1.5)
+            self._poll()
+
+            pending = self._pending
+            self._pending = []
+            for account, report_run, attempt, params, key in pending:
+                status = report_run[AdReportRun.Field.async_status] \
+                    if AdReportRun.Field.async_status in report_run else ''
+
+                poll_failures = self._poll_failures.get(report_run[AdReportRun.Field.id], 0)
+                if status == 'Job Completed':
+                    yield account, report_run, key
+                elif poll_failures >= self.max_poll_failures:
+                    self._poll_failures.pop(report_run[AdReportRun.Field.id])
+                    if self.on_restart is None or \
+                            report_run[AdReportRun.Field.id] not in self._resumed:
+                        raise RuntimeError(f"Unable to poll report job "
+                                           f"{report_run[AdReportRun.Field.id]} of {key} "
+                                           f"{poll_failures} times in a row")
+
+                    logger.warning(f"Unable to poll report job {report_run[AdReportRun.Field.id]} "
+                                   f"of {key} {poll_failures} times in a row, submitting again")
+                    self.on_restart(account, key)
+                    self.submit(account, attempt=attempt, params=params, key=key)
+                    delay = self.initial_delay
+                elif status in ['Job Failed', 'Job Skipped'] and attempt < self.max_retries:
+                    logger.warning(f"Report job {report_run[AdReportRun.Field.id]} of "
+                                   f"{key}: {status}, submitting again")
+                    self.submit(account, attempt=attempt + 1, params=params, key=key)
+                    delay = self.initial_delay
+                elif status in ['Job Failed', 'Job Skipped']:
+                    halves = split_time_range(params['time_range']) \
+                        if self.on_split is not None and 'time_range' in params else []
+                    if len(halves) < 2:
+                        raise RuntimeError(f"Report job {report_run[AdReportRun.Field.id]} of "
+                                           f"{key}: {status}")
+
+                    logger.warning(f"Report job {report_run[AdReportRun.Field.id]} of {key}: "
+                                   f"{status}, splitting it into {halves}")
+                    self.on_split(account, key, halves)
+                    account_time_range = self.account_params.get(
+                        account[AdAccount.Field.id], self.params)['time_range']
+                    for time_range in halves:
+                        self.submit(account, params=dict(params, time_range=time_range),
+                                    key=get_report_key(account[AdAccount.Field.id], time_range,
+                                                       account_time_range))
+                    delay = self.initial_delay
                 else:
-                    ad_format = AdPreview.AdFormat.desktop_feed_standard
-            else:
-                ad_format = AdPreview.AdFormat.desktop_feed_standard
+                    self._pending.append((account, report_run, attempt, params, key))
+
 
-            ad = Ad(ad_id)
-            ad_preview = ad.get_previews(
-                params={
-                    'ad_format': ad_format
-                }
-            )
+@instrumented('finalize_records')
+def finalize_records(object_type: str,
+                     accumulator: Union[RecordAccumulator, RawRecordAccumulator],
+                     preview_cache: PreviewCache = None, latest_epoch: str = None,
+                     fetch_previews: bool = True) -> pd.DataFrame:
+    """
+    Materialize the records of an object type and adjust them: filter and flatten ad_image data,
+    add the preview URL to ad data.
 
-            for p in ad_preview:
-                preview = p["body"]
-                preview = str(preview)
+    :param object_type: str - Name of one of the data object
+    :param accumulator: RecordAccumulator - Records parsed from the Graph API objects, or raw
+        ad_insights records in a RawRecordAccumulator
+    :param preview_cache: PreviewCache - Cache of the ad preview URLs
+    :param latest_epoch: str - Last ingestion execution epoch, used to filter ad_image data
+    :param fetch_previews: bool - Whether ad previews missing from the cache are fetched
+    :return: pd.DataFrame - Pandas dataframe containing the data of the passed object_type
+    """
+    storing_dataframe = accumulator.to_dataframe()
 
-            preview = preview.replace("amp;", "")
-            preview = (preview.split('src="')[1].split('" width')[0])
-            preview = preview.replace(';t=', '&t=')
-            df.loc[df['id'] == ad_id, 'preview_url'] = preview
+    if object_type == 'ad_image' and len(storing_dataframe) > 0:
+        logger.info("Adjusting ad images data")
+        storing_dataframe = adjust_ad_image_data(df=storing_dataframe, latest_epoch=latest_epoch)
 
-        else:
-            df.loc[df['id'] == ad_id, 'preview_url'] = "not_available"
+    elif object_type == 'ad' and len(storing_dataframe) > 0:
+        storing_dataframe = get_preview_url(df=storing_dataframe, preview_cache=preview_cache,
+                                            fetch=fetch_previews)
 
-    return df
+    return storing_dataframe
 
 
-def get_objects(object_type: str, account_id: AdAccount, fields: Dict[str, List[str]],
-                params: Dict[str, Union[str, List, int]]) -> pd.DataFrame:
+def get_next_after(response: Dict[str, Any]) -> Union[str, None]:
+    """
+    :param response: Dict - Page of a Graph API edge
+    :return: str - 'after' cursor of the following page, None if the page is the last one
+    """
+    paging = response.get('paging', {})
+    if 'next' not in paging:
+        return None
+
+    after = paging.get('cursors', {}).get('after')
+    if after is None:
+        raise RuntimeError(f"Graph API page with a next page but no after cursor: {paging}")
+    return after
+
+
+def get_edge_page(node_id: str, target_class: type, params: Dict[str, Union[str, List, int]]
+                  ) -> Tuple[List[AbstractObject], Union[str, None]]:
+    """
+    Fetch a page of a Graph API edge with a direct call to the Graph API, and build its objects as
+    a Cursor of the SDK does, reading the cursor of the following page from the response instead
+    of the internals of the Cursor. The call goes through the default FacebookAdsApi, and so
+    through its RateLimiter.
+
+    :param node_id: str - Id of the node of the edge, e.g. an ad account
+    :param target_class: type - Class of the objects of the edge, which also names the edge
+    :param params: Dict - Parameters of the request, with the fields, page size and cursor
+    :return: Tuple - Objects of the page, and cursor of the following page (None after the last
+        one)
+    """
+    api = FacebookAdsApi.get_default_api()
+    response = api.call('GET', (node_id, target_class.get_endpoint()), params=params).json()
+
+    objects = ObjectParser(api=api, target_class=target_class).parse_multiple(response)
+    return objects, get_next_after(response)
+
+
+def get_object_class(object_type: str) -> type:
+    """
+    :param object_type: str - Name of one of the data objects listed by an ad account edge
+    :return: type - Class of the objects, which also names the edge
+    """
+    if object_type == 'ad':
+        return Ad
+    elif object_type == 'ad_set':
+        return AdSet
+    elif object_type == 'campaign':
+        return Campaign
+    elif object_type == 'ad_image':
+        from facebook_business.adobjects.adimage import AdImage
+        return AdImage
+
+    raise ValueError(f"Unknown object type {object_type}")
+
+
+def get_report_page(report_run: AdReportRun, page_params: Dict[str, Union[str, int]]
+                    ) -> Tuple[List[Dict[str, Any]], Union[str, None]]:
+    """
+    Fetch a page of the results of a completed ad_insights report job as raw JSON, with a direct
+    call to the Graph API as get_edge_page, but without building AdsInsights objects. The call
+    goes through the default FacebookAdsApi, and so through its RateLimiter.
+
+    :param report_run: AdReportRun - Completed ad_insights report job
+    :param page_params: Dict - Page size and cursor of the page
+    :return: Tuple - Raw records of the page, and cursor of the following page (None after the
+        last one)
+    """
+    api = FacebookAdsApi.get_default_api()
+    response = api.call('GET', (report_run[AdReportRun.Field.id], 'insights'),
+                        params=page_params).json()
+
+    return response.get('data', []), get_next_after(response)
+
+
+def iter_pages(fetch_page: Callable[[Dict[str, Union[str, int]]],
+                                    Tuple[List[Any], Union[str, None]]],
+               limit: int = None, after: str = None, tuner: RequestTuner = None,
+               account_id: str = None,
+               object_type: str = None) -> Iterator[Tuple[List[Any], Union[str, None]]]:
+    """
+    Fetch the pages of a Graph API edge one request at a time, each one from the cursor of the
+    previous one. With a RequestTuner, the page size adapts to the responses: a page that asked
+    for too much data or timed out is requested again with a smaller page size, and the page
+    size grows after fast pages.
+
+    :param fetch_page: Callable - Function of the page size and cursor, returning the objects of
+        the page and the cursor of the following page
+    :param limit: int - Page size, None for the default of the Graph API
+    :param after: str - Cursor of the page to start from, None for the first page
+    :param tuner: RequestTuner - Tuned page sizes, None to keep limit
+    :param account_id: str - Id of the ad account of the requests, for the tuner
+    :param object_type: str - Object type of the requests, for the tuner
+    :return: Iterator - Objects of every page, with the cursor of the following page (None after
+        the last one)
+    """
+    if tuner is not None and limit is not None:
+        limit = tuner.limit(account_id, object_type, default=limit)
+
+    while True:
+        page_params = {} if limit is None else {'limit': limit}
+        if after is not None:
+            page_params['after'] = after
+
+        start = time.monotonic()
+        try:
+            objects, next_after = fetch_page(page_params)
+        except (FacebookRequestError, requests.exceptions.Timeout) as e:
+            if tuner is None or limit is None or not is_oversized_error(e):
+                raise
+
+            smaller = tuner.shrink(account_id, object_type, limit)
+            if smaller is None:
+                raise
+
+            logger.warning(f"Page of {limit} {object_type} of {account_id} too large "
+                           f"({type(e).__name__}), requesting {smaller}")
+            INSTRUMENTATION.add('page_shrink', time.monotonic() - start)
+            limit = smaller
+            continue
+
+        if tuner is not None and limit is not None:
+            limit = tuner.record_page(account_id, object_type, limit, time.monotonic() - start)
+
+        yield objects, next_after
+
+        if next_after is None:
+            return
+        after = next_after
+
+
+def iter_objects(object_type: str, account_id: AdAccount, fields: Dict[str, List[str]],
+                 params: Dict[str, Union[str, List, int]], preview_cache: PreviewCache = None,
+                 chunk_rows: int = None, report_run: AdReportRun = None,
+                 latest_epoch: str = None, recorder: 'PageRecorder' = None,
+                 after: str = None, bulk_limit: int = None, tuner: RequestTuner = None,
+                 record_key: str = None) -> Iterator[Tuple[pd.DataFrame, Union[str, None]]]:
     """
     This function makes API calls to Facebook in order to retrieve data. Every Facebook's
     data object has it's own method. Due to the amount of data, the call to ad_insights
     is asynchronous. If the API call returns something, parse the response and add it to a
-    pandas DataFrame. In the case of ad_image data object, adjust the data as well. Return
-    the pandas DataFrame.
+    pandas DataFrame. In the case of ad_image data object, adjust the data as well. Pages are
+    requested one at a time, see iter_pages. Yield the pandas DataFrame at the end of the page
+    where it reaches chunk_rows rows, so that pages can be sunk while the following ones are
+    fetched, together with the cursor of the next page (None after the last one), from which the
+    extraction can be resumed. With bulk_limit, the results of the ad_insights report job are
+    fetched as raw JSON pages of bulk_limit records, see get_report_page, and parsed with a
+    RawRecordAccumulator.
+
+    :param object_type: str - Name of one of the data object
+    :param account_id: AdAccount - Object of Facebook AdAccount class
+    :param fields: Dict - Constant dict of the type {object_type: [List_of_fields]}
+    :param params: Dict - Parameters to be passed to the API call
+    :param preview_cache: PreviewCache - Cache of the ad preview URLs
+    :param chunk_rows: int - Maximum number of rows per yielded DataFrame, None for no limit
+    :param report_run: AdReportRun - Completed ad_insights report job, None to submit one
+    :param latest_epoch: str - Last ingestion execution epoch, used to filter ad_image data
+    :param recorder: PageRecorder - Landing stage of the raw objects, None to skip it
+    :param after: str - Cursor of the page to start from, None for the first page
+    :param bulk_limit: int - Page size of the raw ad_insights results, None to fetch them as
+        AdsInsights objects
+    :param tuner: RequestTuner - Tuned page sizes, None to keep the page size of params
+    :param record_key: str - Key the raw objects are recorded under, None for the ad account id
+    :return: Iterator - Pandas dataframes containing the data of the passed object_type, with
+        the cursor of the page following them
+    """
+    def finalize(accumulator: Union[RecordAccumulator, RawRecordAccumulator]) -> pd.DataFrame:
+        return finalize_records(object_type=object_type, accumulator=accumulator,
+                                preview_cache=preview_cache, latest_epoch=latest_epoch)
+
+    def fetch_page(page_params: Dict[str, Union[str, int]]) -> Tuple[List[Any], Union[str, None]]:
+        if object_type == 'ad_insights':
+            return get_edge_page(report_run[AdReportRun.Field.id], AdsInsights, page_params)
+
+        return get_edge_page(account_id[AdAccount.Field.id], get_object_class(object_type),
+                             dict(params, fields=','.join(fields[object_type]), **page_params))
+
+    def fetch_report_page(page_params: Dict[str, Union[str, int]]
+                          ) -> Tuple[List[Any], Union[str, None]]:
+        return get_report_page(report_run, page_params)
+
+    if object_type == 'ad_insights' and report_run is None:
+        manager = ReportJobManager(fields=fields[object_type], params=params)
+        manager.submit(account_id)
+        _, report_run, _ = next(manager.completed())
+
+    bulk = object_type == 'ad_insights' and bulk_limit is not None
+    limit = bulk_limit if bulk else params.get('limit')
+
+    def new_accumulator() -> Union[RecordAccumulator, RawRecordAccumulator]:
+        if bulk:
+            return RawRecordAccumulator(columns=fields[object_type])
+        return RecordAccumulator(columns=fields[object_type])
+
+    accumulator = new_accumulator()
+    extractors = compile_extractors(fields[object_type])
+    record_key = record_key or account_id[AdAccount.Field.id]
+
+    for objects, next_after in iter_pages(fetch_report_page if bulk else fetch_page,
+                                          limit=limit, after=after, tuner=tuner,
+                                          account_id=account_id[AdAccount.Field.id],
+                                          object_type=object_type):
+        if bulk:
+            accumulator.extend(objects)
+        else:
+            for object in objects:
+                accumulator.append(parse_object(object=object, extractors=extractors))
+
+        if recorder is not None:
+            for object in objects:
+                recorder.record(record_key, object if bulk else object.export_all_data())
+
+        # A chunk ends with the page it is in
+        if chunk_rows is not None and len(accumulator) >= chunk_rows and next_after is not None:
+            yield finalize(accumulator), next_after
+            accumulator = new_accumulator()
+
+    if recorder is not None:
+        recorder.flush(record_key)
+
+    if chunk_rows is None or len(accumulator) > 0:
+        yield finalize(accumulator), None
+
+
+@instrumented('get_objects')
+def get_objects(object_type: str, account_id: AdAccount, fields: Dict[str, List[str]],
+                params: Dict[str, Union[str, List, int]], preview_cache: PreviewCache = None,
+                report_run: AdReportRun = None, latest_epoch: str = None,
+                recorder: 'PageRecorder' = None, bulk_limit: int = None,
+                tuner: RequestTuner = None) -> pd.DataFrame:
+    """
+    Retrieve all the data of an object type for an ad account, see iter_objects.
 
     :param object_type: str - Name of one of the data object
     :param account_id: AdAccount - Object of Facebook AdAccount class
     :param fields: Dict - Constant dict of the type {object_type: [List_of_fields]}
     :param params: Dict - Parameters to be passed to the API call
+    :param preview_cache: PreviewCache - Cache of the ad preview URLs
+    :param report_run: AdReportRun - Completed ad_insights report job, None to submit one
+    :param latest_epoch: str - Last ingestion execution epoch, used to filter ad_image data
+    :param recorder: PageRecorder - Landing stage of the raw objects, None to skip it
+    :param bulk_limit: int - Page size of the raw ad_insights results, None to fetch them as
+        AdsInsights objects
+    :param tuner: RequestTuner - Tuned page sizes, None to keep the page size of params
     :return: pd.DataFrame - Pandas dataframe containing the data of the passed object_type
     """
-    if object_type == 'ad':
-        objects = account_id.get_ads(params=params, fields=fields[object_type])
-    elif object_type == 'ad_set':
-        objects = account_id.get_ad_sets(params=params, fields=fields[object_type])
-    elif object_type == 'campaign':
-        objects = account_id.get_campaigns(params=params, fields=fields[object_type])
-    elif object_type == 'ad_image':
-        objects = account_id.get_ad_images(params=params, fields=fields[object_type])
-    elif object_type == 'ad_insights':
-        async_job = account_id.get_insights(params=params, fields=fields[object_type],
-                                            is_async=True)
-        async_job.api_get()
-        while async_job[AdReportRun.Field.async_status] != 'Job Completed':
-            time.sleep(3)
-            async_job.api_get()
-        objects = async_job.get_result(params={"limit": 1000})
-
-    storing_dataframe = pd.DataFrame(columns=fields[object_type])
-
-    for object in objects:
-        time.sleep(0.5)
-        values_holder = {}
-        for field in fields[object_type]:
-            key = field
-            if field == 'creative':
-                value = object[field]['id'] if field in object else ''
-            elif field == 'pacing_type':
-                value = object[field][0] if field in object else ''
-            elif field in ['cost_per_outbound_click', 'outbound_clicks']:
-                value = object[field][0]['value'] if field in object else ''
-            elif field == 'targeting':
-                value = object[field]
-                for internal_key in object[field].keys():
-                    if 'publisher_platforms' in object[field].keys():
-                        internal_value = object[field][internal_key]
-                        values_holder[internal_key] = internal_value
-                    else:
-                        values_holder['publisher_platforms'] = ''
+    dataframe, _ = next(iter_objects(object_type=object_type, account_id=account_id,
+                                     fields=fields, params=params, preview_cache=preview_cache,
+                                     report_run=report_run, latest_epoch=latest_epoch,
+                                     recorder=recorder, bulk_limit=bulk_limit, tuner=tuner))
+    return dataframe
+
+
+def extract_accounts(object_type: str, accounts: List[AdAccount], fields: Dict[str, List[str]],
+                     params: Dict[str, Union[str, List, int]], max_workers: int,
+                     preview_cache: PreviewCache = None, writer: 'ParquetChunkWriter' = None,
+                     latest_epoch: str = None, recorder: 'PageRecorder' = None,
+                     checkpoint: 'Checkpoint' = None,
+                     account_params: Dict[str, Dict[str, Union[str, List, int]]] = None,
+                     bulk_limit: int = None, tuner: RequestTuner = None) -> List[pd.DataFrame]:
+    """
+    Run get_objects for every ad account in a pool of threads. For ad_insights, the report jobs
+    of all the ad accounts are submitted first, and the results of each job are fetched as soon
+    as it is completed. Pacing of the API calls is left to the RateLimiter of the default
+    FacebookAdsApi. Return one DataFrame per account. If a writer is passed, the data is handed
+    to it in chunks while it is fetched instead, and an empty list is returned. If a checkpoint
+    is passed as well, every chunk is written to its own file and checkpointed with the cursor
+    of the following page: the ad accounts done are skipped, the others are resumed from the
+    last checkpointed cursor, with the report job they started with. Ad accounts in
+    account_params are queried with their own parameters instead of the common ones. With a
+    RequestTuner, page sizes adapt to the responses, and the report jobs of an ad account are
+    split into date sub-ranges, up front from its tuned report days, or when they fail for good.
+    A split report job is checkpointed as split, and every part is checkpointed on its own key.
 
-                    if 'instagram_positions' in object[field].keys():
-                        internal_value = object[field][internal_key]
-                        values_holder[internal_key] = internal_value
-                    else:
-                        values_holder['instagram_positions'] = ''
+    :param object_type: str - Name of one of the data object
+    :param accounts: List - Ad accounts to be queried
+    :param fields: Dict - Constant dict of the type {object_type: [List_of_fields]}
+    :param params: Dict - Parameters to be passed to the API calls of every account
+    :param max_workers: int - Number of accounts queried concurrently
+    :param preview_cache: PreviewCache - Cache of the ad preview URLs
+    :param writer: ParquetChunkWriter - Streaming sink of the object type, None to return the data
+    :param latest_epoch: str - Last ingestion execution epoch, used to filter ad_image data
+    :param recorder: PageRecorder - Landing stage of the raw objects, None to skip it
+    :param checkpoint: Checkpoint - Progress of the extraction, None to not checkpoint it
+    :param account_params: Dict - Parameters of the API calls of some ad accounts, by id
+    :param bulk_limit: int - Page size of the raw ad_insights results, None to fetch them as
+        AdsInsights objects
+    :param tuner: RequestTuner - Tuned page sizes and report days, None to not tune requests
+    :return: List - Pandas dataframes containing the data of the passed object_type
+    """
+    account_params = account_params or {}
 
-                    if 'facebook_positions' in object[field].keys():
-                        internal_value = object[field][internal_key]
-                        values_holder[internal_key] = internal_value
+    def extract_account(account: AdAccount, report_run: AdReportRun = None,
+                        key: str = None) -> List[pd.DataFrame]:
+        key = key or account[AdAccount.Field.id]
+        tempaccount = AdAccount(account[AdAccount.Field.id])
+        INSTRUMENTATION.set_context(object_type=object_type, account=account[AdAccount.Field.id])
+        logger.info(f"Querying {object_type} objects of {account['name']}, id: {key}")
+        account_params_ = account_params.get(account[AdAccount.Field.id], params)
+
+        if writer is None:
+            return [get_objects(object_type=object_type, account_id=tempaccount, fields=fields,
+                                params=account_params_, preview_cache=preview_cache,
+                                report_run=report_run, latest_epoch=latest_epoch,
+                                recorder=recorder, bulk_limit=bulk_limit, tuner=tuner)]
+
+        position = {} if checkpoint is None else checkpoint.position(key)
+        n_chunks = position.get('chunks', 0)
+        n_rows = position.get('rows', 0)
+        report_run_id = None if report_run is None else report_run[AdReportRun.Field.id]
+
+        for chunk, after in iter_objects(object_type=object_type, account_id=tempaccount,
+                                         fields=fields, params=account_params_,
+                                         preview_cache=preview_cache,
+                                         chunk_rows=writer.chunk_rows, report_run=report_run,
+                                         latest_epoch=latest_epoch, recorder=recorder,
+                                         after=position.get('after'), bulk_limit=bulk_limit,
+                                         tuner=tuner, record_key=key):
+            if checkpoint is None:
+                writer.write(chunk)
+                continue
+
+            # The chunk is numbered after the chunks checkpointed before it, so that writing it
+            # again after a failure replaces its file instead of duplicating its rows
+            # The raw objects up to the position are stored too, so that the pages recorded after
+            # resuming follow the checkpointed ones instead of replacing them
+            writer.write_file(chunk, name=get_chunk_name(key, n_chunks))
+            n_chunks += 1
+            n_rows += len(chunk)
+            checkpoint.advance(key, writer=writer, after=after, chunks=n_chunks, rows=n_rows,
+                               report_run_id=report_run_id, done=after is None,
+                               pages=None if recorder is None else recorder.flush(key))
+
+        if checkpoint is not None:
+            checkpoint.advance(key, writer=writer, done=True,
+                               pages=None if recorder is None else recorder.flush(key))
+        return []
+
+    def get_report_ranges(account: AdAccount) -> List[Tuple[str, Dict[str, str]]]:
+        # Split the time range of the ad account as it was split by the run being resumed, and
+        # then by the tuned report days
+        account_time_range = account_params.get(account[AdAccount.Field.id], params)['time_range']
+
+        def is_split(time_range: Dict[str, str]) -> bool:
+            key = get_report_key(account[AdAccount.Field.id], time_range, account_time_range)
+            return checkpoint is not None and checkpoint.position(key).get('split', False)
+
+        max_days = None if tuner is None else tuner.report_days(account[AdAccount.Field.id])
+        return [(get_report_key(account[AdAccount.Field.id], time_range, account_time_range),
+                 time_range)
+                for time_range in split_report_range(account_time_range, max_days=max_days,
+                                                     is_split=is_split)]
+
+    def on_split(account: AdAccount, key: str, time_ranges: List[Dict[str, str]]) -> None:
+        if checkpoint is not None:
+            checkpoint.advance(key, writer=writer, split=True)
+        tuner.record_split(account[AdAccount.Field.id], days=get_range_days(time_ranges[0]))
+
+    def on_restart(account: AdAccount, key: str) -> None:
+        # The checkpointed cursor and chunks of the key belong to the report of the old job, so
+        # the key is extracted again from the report of the new one
+        position = checkpoint.position(key)
+        if position.get('chunks', 0) > 0:
+            if 'rows' not in position:
+                raise RuntimeError(f"Unable to restart {key}, the checkpoint has no row count")
+            writer.delete_files(names=[get_chunk_name(key, chunk)
+                                       for chunk in range(position['chunks'])],
+                                n_rows=position['rows'])
+        if recorder is not None:
+            recorder.delete_pages(key)
+        checkpoint.advance(key, writer=writer, after=None, chunks=0, rows=0, report_run_id=None,
+                           pages=None if recorder is None else 0)
+
+    if checkpoint is not None:
+        accounts = [account for account in accounts
+                    if not checkpoint.position(account[AdAccount.Field.id]).get('done', False)]
+        logger.info(f"{len(accounts)} ad accounts left to query for {object_type}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if object_type == 'ad_insights':
+            manager = ReportJobManager(fields=fields[object_type], params=params,
+                                       account_params=account_params,
+                                       on_split=on_split if tuner is not None else None,
+                                       on_restart=on_restart if checkpoint is not None else None)
+            for account in accounts:
+                for key, time_range in get_report_ranges(account):
+                    position = {} if checkpoint is None else checkpoint.position(key)
+                    if position.get('done', False):
+                        continue
+
+                    report_params = dict(account_params.get(account[AdAccount.Field.id], params),
+                                         time_range=time_range)
+                    if position.get('report_run_id') is None:
+                        manager.submit(account, params=report_params, key=key)
                     else:
-                        values_holder['facebook_positions'] = ''
+                        manager.resume(account, position['report_run_id'],
+                                       params=report_params, key=key)
+            futures = [executor.submit(extract_account, account, report_run, key)
+                       for account, report_run, key in manager.completed()]
+        else:
+            futures = [executor.submit(extract_account, account) for account in accounts]
 
-                    if 'device_platforms' in object[field].keys():
-                        internal_value = object[field][internal_key]
-                        values_holder[internal_key] = internal_value
-                    else:
-                        values_holder['device_platforms'] = ''
-            else:
-                value = object[field] if field in object else ''
+        results = [future.result() for future in futures]
+
+    return [dataframe for account_dataframes in results for dataframe in account_dataframes]
 
-            values_holder[key] = value
 
-        df_ = pd.DataFrame([values_holder], index=[0])
+def cast_column(column: pd.Series, column_type: str) -> pd.Series:
+    """
+    Convert a column, as parsed from the Graph API, to a type of the schemas registry. Empty or
+    malformed values become nulls.
 
-        if object_type == 'ad_image' and len(df_) > 0:
-            logger.info("Adjusting ad images data")
-            df_ = adjust_ad_image_data(df=df_, latest_epoch=latest_epoch)
+    :param column: pd.Series - Column to be converted
+    :param column_type: str - Type of the column in the schemas registry
+    :return: pd.Series - Converted column
+    """
+    if column_type == 'bigint':
+        return pd.to_numeric(column, errors='coerce').round().astype('Int64')
+    elif column_type == 'double':
+        return pd.to_numeric(column, errors='coerce')
+    elif column_type == 'timestamp':
+        return pd.to_datetime(column, errors='coerce', utc=True).dt.tz_localize(None)
+    elif column_type == 'date':
+        dates = pd.to_datetime(column, errors='coerce')
+        return dates.dt.date.where(dates.notnull(), None)
+    elif column_type == 'boolean':
+        booleans = {True: True, False: False, 'true': True, 'false': False}
+        return column.map(booleans).astype('boolean')
+    elif column_type == 'json':
+        return column.map(lambda value: json.dumps(value, default=str)
+                          if isinstance(value, (list, dict)) else None)
+    else:
+        return column.map(lambda value: json.dumps(value, default=str)
+                          if isinstance(value, (list, dict)) else
+                          None if pd.isnull(value) else str(value))
 
-        elif object_type == 'ad' and len(df_) > 0:
-            df_ = get_preview_url(df=df_)
 
-        storing_dataframe = storing_dataframe.append(df_)
+def get_dataset(extraction: str, schema: Dict[str, str] = None) -> str:
+    """
+    Get the name of the dataset an extraction is stored in, which also names its Glue table. Typed
+    output is stored apart from the string one, in the dataset of the extraction with the
+    TYPED_SUFFIX, since the columns of the existing string tables can't change type.
 
-    return storing_dataframe
+    :param extraction: str - Extraction of the present process
+    :param schema: Dict - Types of the extraction in the schemas registry, None for strings only
+    :return: str - Name of the dataset
+    """
+    return extraction if schema is None else f"{extraction}{TYPED_SUFFIX}"
 
 
-def sink(dataframe: pd.DataFrame, execution_time: int, bucket_name: str, zone: str, tier: str,
-         source: str, extraction: str, partition_columns: List[str], process: str,
-         fields: List[str]) -> None:
+def get_athena_types(columns: List[str], schema: Dict[str, str]) -> Dict[str, str]:
+    """
+    Map the columns of a DataFrame to the Athena types they are stored with.
+
+    :param columns: List - Columns of the DataFrame
+    :param schema: Dict - Types of the object type in the schemas registry
+    :return: Dict - Athena type of every column
+    """
+    return {column: 'string' if schema.get(column, 'string') == 'json' else
+            schema.get(column, 'string')
+            for column in columns}
+
+
+def prepare_dataframe(dataframe: pd.DataFrame, execution_time: int,
+                      schema: Dict[str, str] = None) -> pd.DataFrame:
+    """
+    Add the dumpdate partition column and convert the DataFrame to the types stored in S3: every
+    column as a string, or the types of the passed schema from the schemas registry.
+
+    :param dataframe: pd.DataFrame - Pandas dataframe to be sunk
+    :param execution_time: int - Execution time of present process
+    :param schema: Dict - Types of the object type in the schemas registry, None for strings only
+    :return: pd.DataFrame - Pandas dataframe ready to be written
+    """
+    dataframe[DUMPDATE] = execution_time
+
+    if schema is None:
+        return dataframe.astype(str)
+
+    return pd.DataFrame({column: cast_column(dataframe[column], schema.get(column, 'string'))
+                         for column in dataframe.columns})
+
+
+@instrumented('sink')
+def sink(dataframe: pd.DataFrame, s3_client: S3, execution_time: int, bucket_name: str,
+         zone: str, tier: str, source: str, extraction: str, partition_columns: List[str],
+         process: str, fields: List[str], schema: Dict[str, str] = None, mode: str = 'append',
+         update_state: bool = True, create_metadata: bool = True, update_catalog: bool = True,
+         **metadata) -> Dict[str, int]:
     """
     Check if the passed DataFrame has > 0 rows. If so, add partition columns, sink the data in S3
-    and generate a validation metadata.json.
+    and generate a validation metadata.json, including any additional metadata keyword argument.
+    Return the number of rows and fields sunk.
 
     :param dataframe: pd.DataFrame - Pandas dataframe containing GoogleAnalytics data
+    :param s3_client: S3 - Boto3 S3 client instance
     :param execution_time: int - Execution time of present process
     :param bucket_name: str - Bucket name for the data
     :param zone: str - Zone of the present process
@@ -449,127 +2506,1401 @@ def sink(dataframe: pd.DataFrame, execution_time: int, bucket_name: str, zone: s
     :param extraction: str -  Extraction of the present process
     :param partition_columns: List - List of the columns sinking data needs to be partitioned on
     :param process: str - Name of the data workflow process at hand
+    :param fields: List - Fields requested for the extraction
+    :param schema: Dict - Types of the extraction in the schemas registry, None for strings only,
+        see get_dataset for where typed data is stored
+    :param mode: str - Write mode of the dataset, 'overwrite_partitions' to replace the dumpdate
+    :param update_state: bool - Whether the state of the extraction is advanced to execution_time
+    :param create_metadata: bool - Whether the validation metadata is generated
+    :param update_catalog: bool - Whether the Glue table of the extraction is updated
+    :return: Dict - Number of rows and fields sunk, as 'n_rows' and 'n_fields'
     """
     def sink_(bucket_name: str, zone: str, tier: str, source: str, extraction: str,
               partition_columns: List, dataframe: pd.DataFrame):
+        import awswrangler as wr
 
-        logger.info(f"Sinking parquet to: s3://{bucket_name}/{zone}/{tier}/{source}/{extraction}/")
+        dataset = get_dataset(extraction, schema)
+        logger.info(f"Sinking parquet to: s3://{bucket_name}/{zone}/{tier}/{source}/{dataset}/")
 
         wr.s3.to_parquet(
             df=dataframe,
-            path=f"s3://{bucket_name}/{zone}/{tier}/{source}/{extraction}/",
+            path=f"s3://{bucket_name}/{zone}/{tier}/{source}/{dataset}/",
             dataset=True,
             partition_cols=partition_columns,
-            mode='append',
+            mode=mode,
             schema_evolution=True,
-            database=tier,
-            table=f"t_{source}_{extraction}"
+            database=tier if update_catalog else None,
+            table=f"t_{source}_{dataset}" if update_catalog else None,
+            dtype=get_athena_types(dataframe.columns, schema) if schema is not None else None
         )
 
     n_rows = len(dataframe)
     n_fields = len(dataframe.columns)
 
     if n_rows > 0:
-        dataframe[DUMPDATE] = execution_time
-        dataframe = dataframe.astype(str)
+        dataframe = prepare_dataframe(dataframe=dataframe, execution_time=execution_time,
+                                      schema=schema)
         logger.info(f"Sinking {source}/{extraction}, partition by: {partition_columns}")
         sink_(bucket_name, zone, tier, source, extraction, partition_columns, dataframe)
-        create_validation_metadata(s3_client=S3_CLIENT, execution_time=execution_time,
-                                   bucket_name=bucket_name, zone=zone, tier=tier,
-                                   source=source, extraction=extraction, n_rows=n_rows,
-                                   fields=fields, process=process, n_fields=n_fields)
+        if create_metadata:
+            create_validation_metadata(s3_client=s3_client, execution_time=execution_time,
+                                       bucket_name=bucket_name, zone=zone, tier=tier,
+                                       source=source, extraction=extraction, n_rows=n_rows,
+                                       fields=fields, process=process, n_fields=n_fields,
+                                       update_state=update_state, **metadata)
 
         logger.info(f"Sinking for {source}/{extraction} completed")
     else:
         logger.info(f"Got nothing to ingest for {source}/{extraction}")
 
+    return {'n_rows': n_rows, 'n_fields': n_fields}
 
-# Retrieve credentials
-logger.info(f"Retrieving credentials: {SECRET_NAME}")
-credentials = get_credentials(secret_manager_client=SECRET_MANAGER_CLIENT, secret_name=SECRET_NAME)
 
-APP_ID = credentials['FB_APP_ID']
-APP_SECRET = credentials['FB_APP_SECRET']
-ACCESS_TOKEN = credentials['FB_ACCESS_TOKEN']
-BUSINESS_ID = credentials['FB_BUSINESS_ID']
+class ParquetChunkWriter:
+    """
+    Streaming sink of one extraction. DataFrames written by any thread are buffered until they
+    reach chunk_rows rows or chunk_mb megabytes, then flushed to the S3 dataset as Parquet files
+    without touching the Glue catalog. The catalog table and its partitions are updated only once,
+    by close(), with the union of the columns of all the flushed chunks.
+    """
 
-# Start the connection to the facebook API
-FacebookAdsApi.init(APP_ID, APP_SECRET, ACCESS_TOKEN)
+    def __init__(self, execution_time: int, bucket_name: str, zone: str, tier: str, source: str,
+                 extraction: str, partition_columns: List[str], chunk_rows: int, chunk_mb: int,
+                 schema: Dict[str, str] = None, update_catalog: bool = True):
+        """
+        :param execution_time: int - Execution time of present process
+        :param bucket_name: str - Bucket name for the data
+        :param zone: str - Zone of the present process
+        :param tier: str - Tier of the present process
+        :param source: str - Source of the present process
+        :param extraction: str -  Extraction of the present process
+        :param partition_columns: List - List of the columns sinking data needs to be partitioned on
+        :param chunk_rows: int - Number of buffered rows that triggers a flush
+        :param chunk_mb: int - Buffered megabytes that trigger a flush
+        :param schema: Dict - Types of the extraction in the schemas registry, None for strings
+            only, see get_dataset for where typed data is stored
+        :param update_catalog: bool - Whether close() updates the Glue table of the extraction
+        """
+        self.execution_time = execution_time
+        self.bucket_name = bucket_name
+        self.dataset = get_dataset(extraction, schema)
+        self.path = f"s3://{bucket_name}/{zone}/{tier}/{source}/{self.dataset}/"
+        self.database = tier
+        self.table = f"t_{source}_{self.dataset}"
+        self.partition_columns = partition_columns
+        self.chunk_rows = chunk_rows
+        self.chunk_bytes = chunk_mb * 1024 * 1024
+        self.schema = schema
+        self.update_catalog = update_catalog
+        self.n_rows = 0
+        self.n_files = 0
+        self.columns_types = {}
+        self.partitions_types = {}
+        self.partitions_values = {}
+
+        self._buffer = []
+        self._buffer_rows = 0
+        self._buffer_bytes = 0
+        self._lock = threading.Lock()
+
+    def write(self, dataframe: pd.DataFrame) -> None:
+        """
+        Buffer a DataFrame, flushing the buffer if it is full.
+
+        :param dataframe: pd.DataFrame - Pandas dataframe to be sunk
+        """
+        if len(dataframe) == 0:
+            return
+
+        with self._lock:
+            self._buffer.append(dataframe)
+            self._buffer_rows += len(dataframe)
+            self._buffer_bytes += int(dataframe.memory_usage(deep=True).sum())
+            if self._buffer_rows < self.chunk_rows and self._buffer_bytes < self.chunk_bytes:
+                return
+            buffer = self._take_buffer()
+
+        self._flush(buffer)
+
+    def write_file(self, dataframe: pd.DataFrame, name: str) -> None:
+        """
+        Write a DataFrame straight to a Parquet file of its partition, without buffering it. The
+        file is named after the passed name, and a file with the same name is replaced.
+
+        :param dataframe: pd.DataFrame - Pandas dataframe to be sunk
+        :param name: str - Name of the file, without extension
+        """
+        import awswrangler as wr
+
+        if len(dataframe) == 0:
+            return
+
+        dataframe = prepare_dataframe(dataframe=dataframe, execution_time=self.execution_time,
+                                      schema=self.schema)
+        dtype = None
+        if self.schema is not None:
+            dtype = get_athena_types(dataframe.columns, self.schema)
+        partition = "/".join(f"{column}={dataframe[column].iloc[0]}"
+                             for column in self.partition_columns)
+        path = f"{self.path}{partition}/{name}.snappy.parquet"
+        logger.info(f"Writing {len(dataframe)} rows to: {path}")
+
+        start = time.monotonic()
+        file_dataframe = dataframe.drop(columns=self.partition_columns)
+        wr.s3.to_parquet(
+            df=file_dataframe,
+            path=path,
+            dtype=None if dtype is None else get_athena_types(file_dataframe.columns, self.schema)
+        )
+        INSTRUMENTATION.add('sink_chunk', time.monotonic() - start, rows=len(dataframe))
+        columns_types, partitions_types = wr.catalog.extract_athena_types(
+            df=dataframe, partition_cols=self.partition_columns, dtype=dtype)
+
+        with self._lock:
+            self.n_rows += len(dataframe)
+            self.n_files += 1
+            self.columns_types.update(columns_types)
+            self.partitions_types.update(partitions_types)
+            self.partitions_values[f"{self.path}{partition}/"] = \
+                [str(dataframe[column].iloc[0]) for column in self.partition_columns]
+
+    def delete_files(self, names: List[str], n_rows: int) -> None:
+        """
+        Delete files written by write_file, from the partitions written so far.
+
+        :param names: List - Names of the files, as passed to write_file
+        :param n_rows: int - Number of rows of the files
+        """
+        import awswrangler as wr
+
+        with self._lock:
+            partitions = list(self.partitions_values)
+
+        files = [f"{partition}{name}.snappy.parquet" for partition in partitions for name in names]
+        logger.info(f"Deleting files {names} of {partitions}")
+        wr.s3.delete_objects(path=files)
+
+        with self._lock:
+            self.n_rows -= n_rows
+            self.n_files -= len(names)
+
+    def state(self) -> Dict[str, Any]:
+        """
+        :return: Dict - Counters, types and partitions of the data written so far
+        """
+        with self._lock:
+            return {'n_rows': self.n_rows, 'n_files': self.n_files,
+                    'columns_types': dict(self.columns_types),
+                    'partitions_types': dict(self.partitions_types),
+                    'partitions_values': dict(self.partitions_values)}
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """
+        Go on from the data written by a previous writer of the same extraction and partitions.
+
+        :param state: Dict - State of the previous writer, see state()
+        """
+        with self._lock:
+            self.n_rows = state['n_rows']
+            self.n_files = state['n_files']
+            self.columns_types = dict(state['columns_types'])
+            self.partitions_types = dict(state['partitions_types'])
+            self.partitions_values = dict(state['partitions_values'])
+
+    def _take_buffer(self) -> List[pd.DataFrame]:
+        buffer = self._buffer
+        self._buffer = []
+        self._buffer_rows = 0
+        self._buffer_bytes = 0
+        return buffer
+
+    def _flush(self, buffer: List[pd.DataFrame]) -> None:
+        import awswrangler as wr
+
+        if len(buffer) == 0:
+            return
+
+        dataframe = prepare_dataframe(dataframe=pd.concat(buffer, ignore_index=True, sort=False),
+                                      execution_time=self.execution_time, schema=self.schema)
+        dtype = None
+        if self.schema is not None:
+            dtype = get_athena_types(dataframe.columns, self.schema)
+        logger.info(f"Flushing {len(dataframe)} rows to: {self.path}")
+
+        start = time.monotonic()
+        response = wr.s3.to_parquet(
+            df=dataframe,
+            path=self.path,
+            dataset=True,
+            partition_cols=self.partition_columns,
+            mode='append',
+            dtype=dtype
+        )
+        INSTRUMENTATION.add('sink_chunk', time.monotonic() - start, rows=len(dataframe))
+        columns_types, partitions_types = wr.catalog.extract_athena_types(
+            df=dataframe, partition_cols=self.partition_columns, dtype=dtype)
+
+        with self._lock:
+            self.n_rows += len(dataframe)
+            self.n_files += len(response['paths'])
+            self.columns_types.update(columns_types)
+            self.partitions_types.update(partitions_types)
+            self.partitions_values.update(response['partitions_values'])
+
+    def close(self) -> int:
+        """
+        Flush the remaining buffer and register the written data in the Glue catalog.
+
+        :return: int - Number of rows written
+        """
+        import awswrangler as wr
+
+        with self._lock:
+            buffer = self._take_buffer()
+        self._flush(buffer)
+
+        if self.n_rows > 0 and self.update_catalog:
+            logger.info(f"Updating catalog table {self.database}.{self.table} with "
+                        f"{self.n_files} files")
+            wr.catalog.create_parquet_table(database=self.database, table=self.table,
+                                            path=self.path, columns_types=self.columns_types,
+                                            partitions_types=self.partitions_types,
+                                            compression='snappy', mode='append')
+            wr.catalog.add_parquet_partitions(database=self.database, table=self.table,
+                                              partitions_values=self.partitions_values,
+                                              compression='snappy')
+
+        return self.n_rows
+
+
+@instrumented('sink')
+def sink_stream(writer: ParquetChunkWriter, s3_client: S3, zone: str, tier: str, source: str,
+                extraction: str, process: str, fields: List[str], update_state: bool = True,
+                create_metadata: bool = True, **metadata) -> Dict[str, int]:
+    """
+    Close a streaming sink and, if it wrote any row, generate the validation metadata.json. Since
+    the metadata is written last, it is only created when all the chunks have been sunk. Return
+    the number of rows, fields and files sunk.
 
-# All object type list
-object_type_list = ['ad', 'ad_set', 'campaign', 'ad_insights']
+    :param writer: ParquetChunkWriter - Streaming sink of the extraction
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param zone: str - Zone of the present process
+    :param tier: str - Tier of the present process
+    :param source: str - Source of the present process
+    :param extraction: str -  Extraction of the present process
+    :param process: str - Name of the data workflow process at hand
+    :param fields: List - Fields requested for the extraction
+    :param update_state: bool - Whether the state of the extraction is advanced to execution_time
+    :param create_metadata: bool - Whether the validation metadata is generated
+    :return: Dict - Number of rows, fields and files sunk, as 'n_rows', 'n_fields' and 'n_files'
+    """
+    n_rows = writer.close()
+
+    if n_rows > 0 and create_metadata:
+        create_validation_metadata(s3_client=s3_client, execution_time=writer.execution_time,
+                                   bucket_name=writer.bucket_name, zone=zone, tier=tier,
+                                   source=source, extraction=extraction, n_rows=n_rows,
+                                   fields=fields, process=process,
+                                   n_fields=len(writer.columns_types), n_files=writer.n_files,
+                                   update_state=update_state, **metadata)
 
-# If sunday, add ad_image to object_type list
-if datetime.date.today().weekday() == 6:
-    object_type_list.append('ad_image')
+    if n_rows > 0:
+        logger.info(f"Sinking for {source}/{extraction} completed")
+    else:
+        logger.info(f"Got nothing to ingest for {source}/{extraction}")
 
-# Get all ad_accounts system user has access to
-system_user = User(fbid='me')
-accounts = list(system_user.get_ad_accounts(fields=[AdAccount.Field.id, AdAccount.Field.name]))
+    return {'n_rows': n_rows, 'n_fields': len(writer.columns_types), 'n_files': writer.n_files}
 
-# Query one object_type at a time for all ad accounts.
-# If the query returns results, sink the data and sleep for 30 seconds
-# Else, move to the next object_type
-for i, object_type in enumerate(object_type_list):
 
-    # Go through this if statement only after first loop
-    if i > 0:
-        if len(df) > 0:
-            logger.info("Sleeping for 60 seconds")
-            time.sleep(60)
+@instrumented('current_state')
+def upsert_current_state(bucket_name: str, zone: str, tier: str, source: str, extraction: str,
+                         execution_time: int, schema: Dict[str, str] = None,
+                         update_catalog: bool = True) -> Dict[str, int]:
+    """
+    Merge the data of a dumpdate of an extraction into its current state dataset, which holds only
+    the latest version of every object, keyed as in current_state_keys, with the dumpdate it comes
+    from. Only the partitions of the current state touched by the dumpdate are read and
+    rewritten. The current state dataset is registered in the Glue catalog as the table of the
+    dataset of the extraction, see get_dataset, with a '_current' suffix.
 
-    # Set df to be sinked
-    df = pd.DataFrame(columns=fields[object_type])
+    :param bucket_name: str - Bucket name for the data
+    :param zone: str - Zone of the present process
+    :param tier: str - Tier of the present process
+    :param source: str - Source of the present process
+    :param extraction: str -  Extraction of the present process
+    :param execution_time: int - Execution time, that is the dumpdate, of the data to be merged
+    :param schema: Dict - Types of the extraction in the schemas registry, None for strings only
+    :param update_catalog: bool - Whether the Glue table of the current state is updated
+    :return: Dict - Number of rows of the dumpdate, and of the touched partitions after the merge
+    """
+    import awswrangler as wr
 
-    # Set execution time of the process
-    EXECUTION_TIME = int(datetime.datetime.now(tz=TZ).timestamp())
-    logger.info(f"Querying {object_type}, execution_time: {EXECUTION_TIME}")
+    keys, partition_column = current_state_keys[extraction]
+    dataset = get_dataset(extraction, schema)
+    current_path = f"s3://{bucket_name}/{zone}/{tier}/{source}/{dataset}_current/"
 
-    # Get last execution time for object type
     try:
-        latest_epoch = get_latest_epoch(s3_client=S3_CLIENT, bucket_name=DATA_BUCKET, zone=ZONE,
-                                        tier=TIER, source=SOURCE, extraction=object_type)
-    except KeyError as e:
-        latest_epoc = "2022-04-14 00:00:00"
-        logger.info(f"#: Get latest_epoch: {latest_epoc}")
-        latest_epoch = str(int(datetime.datetime.strptime(latest_epoc, '%Y-%m-%d %H:%M:%S').timestamp()))
+        delta = wr.s3.read_parquet(
+            path=f"s3://{bucket_name}/{zone}/{tier}/{source}/{dataset}/"
+                 f"{DUMPDATE}={execution_time}/")
+    except wr.exceptions.NoFilesFound:
+        logger.info(f"Got nothing to merge into the current state of {source}/{extraction}")
+        return {'n_rows': 0, 'n_current_rows': 0}
+    delta[DUMPDATE] = str(execution_time)
+    delta[partition_column] = delta[partition_column].astype(str)
+
+    partitions = set(delta[partition_column])
+    try:
+        current = wr.s3.read_parquet(path=current_path, dataset=True,
+                                     partition_filter=lambda partition:
+                                     partition[partition_column] in partitions)
+        current[partition_column] = current[partition_column].astype(str)
+    except wr.exceptions.NoFilesFound:
+        current = pd.DataFrame(columns=delta.columns)
+
+    merged = pd.concat([current, delta], ignore_index=True, sort=False) \
+        .drop_duplicates(subset=keys, keep='last')
+
+    logger.info(f"Merging {len(delta)} rows into {len(partitions)} partitions of: {current_path}")
+    dtype = {DUMPDATE: 'string', partition_column: 'string'}
+    if schema is not None:
+        dtype = dict(get_athena_types(merged.columns, schema), **dtype)
+
+    wr.s3.to_parquet(
+        df=merged,
+        path=current_path,
+        dataset=True,
+        partition_cols=[partition_column],
+        mode='overwrite_partitions',
+        schema_evolution=True,
+        database=tier if update_catalog else None,
+        table=f"t_{source}_{dataset}_current" if update_catalog else None,
+        dtype=dtype
+    )
+
+    return {'n_rows': len(delta), 'n_current_rows': len(merged)}
+
+
+def get_checkpoint_key(zone: str, tier: str, source: str, extraction: str) -> str:
+    """
+    :param zone: str - Name of the zone of the data process
+    :param tier: str - Name of the tier of the data process
+    :param source: str - Name of the source involved in the data process
+    :param extraction: str - Name of the extraction involved in the data process
+    :return: str - Key of the checkpoint object of the extraction
+    """
+    return f"metadata/{zone}/{tier}/{source}/_checkpoint/{extraction}.json"
+
+
+class Checkpoint:
+    """
+    Progress of one extraction, stored as JSON under the _checkpoint prefix of the source, so
+    that a run that stops midway is resumed by the following one. It holds the plan the
+    extraction started with (execution time, latest epoch and insights time range), the position
+    of every ad account (done or not, cursor of the next page, number of chunks and rows written
+    and report job) and the state of the writer of the extraction. It is cleared once the
+    extraction is sunk, which is also when the watermark of the extraction is advanced.
+    """
 
-    # Get parameters to be passed to the API
-    if object_type == 'ad_insights':
-        params_yesterday, params_today = get_params(object_type=object_type, latest_epoch=latest_epoch)
-        logger.info(f"These are the (yesterday) passed params: {params_yesterday}")
-        logger.info(f"These are the (today) passed params: {params_today}")
+    def __init__(self, s3_client: S3, bucket_name: str, key: str):
+        """
+        :param s3_client: S3 - Boto3 S3 client instance
+        :param bucket_name: str - Name of the bucket containing the checkpoint
+        :param key: str - Key of the checkpoint object
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.plan = {}
+        self.accounts = {}
+        self.writer = {}
+
+        self._lock = threading.Lock()
+
+    def load(self) -> bool:
+        """
+        Load the checkpoint left by an interrupted run, if any.
+
+        :return: bool - Whether there is a checkpoint to resume from
+        """
+        content = read_json(s3_client=self.s3_client, bucket_name=self.bucket_name, key=self.key)
+        if content is None:
+            return False
+
+        self.plan = content['plan']
+        self.accounts = content['accounts']
+        self.writer = content['writer']
+
+        n_done = sum(1 for position in self.accounts.values() if position.get('done', False))
+        logger.info(f"Resuming from checkpoint s3://{self.bucket_name}/{self.key}: "
+                    f"{self.plan}, {n_done} ad accounts done")
+        return True
+
+    def start(self, **plan) -> None:
+        """
+        Start a new checkpoint with the plan of the extraction.
+        """
+        with self._lock:
+            self.plan = plan
+            self.accounts = {}
+            self.writer = {}
+            self._save()
+
+    def position(self, account_id: str) -> Dict[str, Any]:
+        """
+        :param account_id: str - Id of the ad account
+        :return: Dict - Checkpointed position of the ad account, empty if it is not started
+        """
+        with self._lock:
+            return dict(self.accounts.get(account_id, {}))
+
+    def advance(self, account_id: str, writer: 'ParquetChunkWriter', **position) -> None:
+        """
+        Update the position of an ad account, together with the state of the writer of the
+        extraction, and store the checkpoint. The data up to the position must be written
+        already.
+
+        :param account_id: str - Id of the ad account
+        :param writer: ParquetChunkWriter - Writer of the extraction
+        """
+        with self._lock:
+            self.accounts.setdefault(account_id, {}).update(position)
+            self.writer = writer.state()
+            self._save()
+
+    def clear(self) -> None:
+        """
+        Delete the checkpoint, once the extraction is complete.
+        """
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=self.key)
+        logger.info(f"Cleared checkpoint s3://{self.bucket_name}/{self.key}")
+
+    def _save(self) -> None:
+        write_json(s3_client=self.s3_client, bucket_name=self.bucket_name, key=self.key,
+                   content={'plan': self.plan, 'accounts': self.accounts, 'writer': self.writer})
+
+
+class PageRecorder:
+    """
+    Landing stage of the raw Graph API objects of one extraction. Objects recorded by any thread
+    are grouped by key (the ad account id, or the key of the report job in the checkpoint) in
+    pages of page_size objects, and every page is stored as gzipped NDJSON under the _pages prefix
+    of the source, so that the extraction can be replayed later without calling Facebook. The
+    manifest, written last, marks the capture as complete. In resumable mode, the number of pages
+    of every key is checkpointed with its position, see restore.
+    """
+
+    def __init__(self, s3_client: S3, bucket_name: str, zone: str, tier: str, source: str,
+                 extraction: str, execution_time: int, page_size: int = 1000):
+        """
+        :param s3_client: S3 - Boto3 S3 client instance
+        :param bucket_name: str - Bucket name for the pages
+        :param zone: str - Zone of the present process
+        :param tier: str - Tier of the present process
+        :param source: str - Source of the present process
+        :param extraction: str -  Extraction of the present process
+        :param execution_time: int - Execution time of present process
+        :param page_size: int - Number of objects per stored page
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = get_pages_prefix(zone=zone, tier=tier, source=source,
+                                       extraction=extraction, dumpdate=execution_time)
+        self.page_size = page_size
+        self.n_pages = 0
+
+        self._buffers = {}
+        self._page_numbers = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, data: Dict[str, Any]) -> None:
+        """
+        Buffer the raw data of an object, storing the page of the key if it is full.
+
+        :param key: str - Key of the object, usually the id of its ad account
+        :param data: Dict - Raw data of the object
+        """
+        with self._lock:
+            buffer = self._buffers.setdefault(key, [])
+            buffer.append(data)
+            if len(buffer) < self.page_size:
+                return
+            page = self._take_page(key)
+
+        self._write(key, *page)
+
+    def flush(self, key: str) -> int:
+        """
+        Store the buffered objects of a key.
+
+        :param key: str - Key of the objects, usually the id of their ad account
+        :return: int - Number of pages of the key stored so far
+        """
+        with self._lock:
+            if len(self._buffers.get(key, [])) == 0:
+                return self._page_numbers.get(key, 0)
+            page = self._take_page(key)
+
+        self._write(key, *page)
+        return page[0] + 1
+
+    def restore(self, page_numbers: Dict[str, int]) -> None:
+        """
+        Go on from the pages stored by a previous recorder of the same extraction and dumpdate.
+
+        :param page_numbers: Dict - Number of pages of every key checkpointed by the previous
+            recorder, see flush
+        """
+        with self._lock:
+            self._page_numbers = dict(page_numbers)
+            self.n_pages = sum(page_numbers.values())
+
+    def delete_pages(self, key: str) -> None:
+        """
+        Delete the stored pages of a key, and drop its buffered objects.
+
+        :param key: str - Key of the objects, usually the id of their ad account
+        """
+        with self._lock:
+            n_pages = self._page_numbers.pop(key, 0)
+            self._buffers.pop(key, None)
+            self.n_pages -= n_pages
+
+        if n_pages > 0:
+            logger.info(f"Deleting {n_pages} pages of {key} from s3://{self.bucket_name}/"
+                        f"{self.prefix}")
+            self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': self._get_key(key, page_number)}
+                                    for page_number in range(n_pages)]})
+
+    def _get_key(self, key: str, page_number: int) -> str:
+        return f"{self.prefix}{key}-{page_number:05d}.ndjson.gz"
+
+    def _take_page(self, key: str) -> Tuple[int, List[Dict[str, Any]]]:
+        page_number = self._page_numbers.get(key, 0)
+        self._page_numbers[key] = page_number + 1
+        return page_number, self._buffers.pop(key)
+
+    def _write(self, key: str, page_number: int, rows: List[Dict[str, Any]]) -> None:
+        body = '\n'.join(json.dumps(row, default=str) for row in rows)
+
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=self._get_key(key, page_number),
+                                  Body=gzip.compress(body.encode('UTF-8')))
+        with self._lock:
+            self.n_pages += 1
+
+    def write_manifest(self, **manifest) -> None:
+        """
+        Store the manifest of the capture, with everything needed to replay it. In a sharded run,
+        the manifest is left to the merge of the shards, see complete_shard.
+        """
+        write_manifest(s3_client=self.s3_client, bucket_name=self.bucket_name,
+                       prefix=self.prefix, n_pages=self.n_pages, **manifest)
+
+
+def write_manifest(s3_client: S3, bucket_name: str, prefix: str, n_pages: int,
+                   **manifest) -> None:
+    """
+    Store the manifest of captured pages, which marks the capture as complete.
+
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Bucket name for the pages
+    :param prefix: str - Prefix of the pages, see get_pages_prefix
+    :param n_pages: int - Number of pages captured
+    """
+    manifest['n_pages'] = n_pages
+
+    write_json(s3_client=s3_client, bucket_name=bucket_name, key=f"{prefix}_manifest.json",
+               content=manifest)
+    logger.info(f"Captured {n_pages} pages in s3://{bucket_name}/{prefix}")
+
+
+def get_pages_prefix(zone: str, tier: str, source: str, extraction: str,
+                     dumpdate: Union[int, str]) -> str:
+    """
+    :param zone: str - Zone of the present process
+    :param tier: str - Tier of the present process
+    :param source: str - Source of the present process
+    :param extraction: str -  Extraction of the present process
+    :param dumpdate: int - Execution time of the captured process
+    :return: str - Prefix of the raw pages of the extraction
+    """
+    return f"{zone}/{tier}/{source}/_pages/{extraction}/{DUMPDATE}={dumpdate}/"
+
+
+def read_page(s3_client: S3, bucket_name: str, key: str) -> List[Dict[str, Any]]:
+    """
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Bucket name for the pages
+    :param key: str - Key of a page stored by PageRecorder
+    :return: List - Raw data of the objects of the page
+    """
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    body = gzip.decompress(response['Body'].read()).decode('utf-8')
+    return [json.loads(line) for line in body.split('\n') if line != '']
+
+
+def replay_extraction(s3_client: S3, bucket_name: str, zone: str, tier: str, source: str,
+                      extraction: str, dumpdate: str, partition_columns: List[str],
+                      process: str, max_workers: int, preview_cache: PreviewCache = None,
+                      schema: Dict[str, str] = None, update_catalog: bool = True) -> None:
+    """
+    Rebuild the data of an extraction for a dumpdate from the pages captured by PageRecorder,
+    without calling Facebook: ad previews are only taken from the cache. The dumpdate partition is
+    overwritten, and the validation metadata is written again without moving the state of the
+    extraction.
+
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Bucket name for the pages and the data
+    :param zone: str - Zone of the present process
+    :param tier: str - Tier of the present process
+    :param source: str - Source of the present process
+    :param extraction: str -  Extraction of the present process
+    :param dumpdate: str - Execution time of the captured process
+    :param partition_columns: List - List of the columns sinking data needs to be partitioned on
+    :param process: str - Name of the data workflow process at hand
+    :param max_workers: int - Number of pages read concurrently
+    :param preview_cache: PreviewCache - Cache of the ad preview URLs
+    :param schema: Dict - Types of the extraction in the schemas registry, None for strings only
+    :param update_catalog: bool - Whether the Glue table of the extraction is updated
+    """
+    prefix = get_pages_prefix(zone=zone, tier=tier, source=source, extraction=extraction,
+                              dumpdate=dumpdate)
+
+    manifest = read_json(s3_client=s3_client, bucket_name=bucket_name,
+                         key=f"{prefix}_manifest.json")
+    if manifest is None:
+        logger.info(f"No complete capture of {source}/{extraction} for {DUMPDATE}={dumpdate}")
+        return
+
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', [])
+                    if obj['Key'].endswith('.ndjson.gz'))
+    logger.info(f"Replaying {len(keys)} pages of {source}/{extraction} for {DUMPDATE}={dumpdate}")
+
+    accumulator = RecordAccumulator(columns=manifest['fields'])
+    extractors = compile_extractors(manifest['fields'])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for rows in executor.map(lambda key: read_page(s3_client, bucket_name, key),
+                                 sorted(keys)):
+            for row in rows:
+                accumulator.append(parse_object(object=row, extractors=extractors))
+
+    dataframe = finalize_records(object_type=extraction, accumulator=accumulator,
+                                 preview_cache=preview_cache,
+                                 latest_epoch=manifest['latest_epoch'], fetch_previews=False)
+
+    dataframe.pipe(sink, s3_client=s3_client, execution_time=int(dumpdate),
+                   bucket_name=bucket_name, zone=zone, tier=tier, source=source,
+                   extraction=extraction, partition_columns=partition_columns, process=process,
+                   fields=manifest['fields'], schema=schema, mode='overwrite_partitions',
+                   update_state=False, update_catalog=update_catalog,
+                   dataset=get_dataset(extraction, schema), replayed=True)
+
+
+class AccountRegistry:
+    """
+    Ad accounts the system user has access to, with their status, amount spent and activity,
+    persisted as a JSON object in S3, so that the ad accounts are listed again only every
+    ttl_hours hours. An ad account is active if its status is active and its amount spent changed,
+    or it returned data, in the last inactive_days days. Inactive ad accounts are skipped, but by a
+    full sweep every sweep_days days. The registry also holds the execution time every ad account
+    was last queried at for every object type, from which a skipped ad account catches up.
+    """
+
+    def __init__(self, s3_client: S3, bucket_name: str, key: str, ttl_hours: float = 24,
+                 inactive_days: float = 30, sweep_days: float = 7):
+        """
+        :param s3_client: S3 - Boto3 S3 client instance
+        :param bucket_name: str - Name of the bucket containing the registry
+        :param key: str - Key of the registry object
+        :param ttl_hours: float - Hours after which the ad accounts are listed again
+        :param inactive_days: float - Days without activity after which an ad account is skipped
+        :param sweep_days: float - Days between two full sweeps of all the ad accounts
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.ttl_hours = ttl_hours
+        self.inactive_days = inactive_days
+        self.sweep_days = sweep_days
+        self.listed_at = 0
+        self.swept_at = 0
+        self.accounts = {}
+
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Load the registry from S3, starting from an empty registry if it does not exist yet.
+        """
+        content = read_json(s3_client=self.s3_client, bucket_name=self.bucket_name, key=self.key)
+        if content is None:
+            logger.info(f"No ad account registry found in s3://{self.bucket_name}/{self.key}")
+            return
+
+        self.listed_at = content['listed_at']
+        self.swept_at = content['swept_at']
+        self.accounts = content['accounts']
+        logger.info(f"Loaded {len(self.accounts)} registered ad accounts from "
+                    f"s3://{self.bucket_name}/{self.key}")
+
+    def save(self) -> None:
+        """
+        Store the registry in S3.
+        """
+        with self._lock:
+            write_json(s3_client=self.s3_client, bucket_name=self.bucket_name, key=self.key,
+                       content={'listed_at': self.listed_at, 'swept_at': self.swept_at,
+                                'accounts': self.accounts})
+        logger.info(f"Stored {len(self.accounts)} registered ad accounts in "
+                    f"s3://{self.bucket_name}/{self.key}")
+
+    def refresh(self, user: User, now: int) -> None:
+        """
+        List the ad accounts of the user again if the listing is expired: new ad accounts are
+        added as active, ad accounts no longer listed are removed, and ad accounts whose amount
+        spent changed become active.
+
+        :param user: User - System user of the Facebook API
+        :param now: int - Current epoch timestamp
+        """
+        if now - self.listed_at < self.ttl_hours * 60 * 60:
+            logger.info(f"Using the ad accounts listed at {self.listed_at}")
+            return
+
+        listed = user.get_ad_accounts(fields=[AdAccount.Field.id, AdAccount.Field.name,
+                                              AdAccount.Field.account_status,
+                                              AdAccount.Field.amount_spent])
+        accounts = {}
+        for account in listed:
+            entry = self.accounts.get(account[AdAccount.Field.id], {'last_active': now,
+                                                                    'queried': {}})
+            if entry.get('amount_spent') != account.get(AdAccount.Field.amount_spent):
+                entry['last_active'] = now
+            entry.update({'name': account.get(AdAccount.Field.name),
+                          'account_status': account.get(AdAccount.Field.account_status),
+                          'amount_spent': account.get(AdAccount.Field.amount_spent)})
+            accounts[account[AdAccount.Field.id]] = entry
+
+        with self._lock:
+            self.accounts = accounts
+            self.listed_at = now
+        logger.info(f"Listed {len(accounts)} ad accounts")
+
+    def select(self, now: int) -> Tuple[List[AdAccount], List[AdAccount], bool]:
+        """
+        Select the ad accounts to query: all of them on a full sweep, else the active ones.
+
+        :param now: int - Current epoch timestamp
+        :return: Tuple - Ad accounts to query, ad accounts skipped and whether it is a full sweep
+        """
+        full_sweep = now - self.swept_at >= self.sweep_days * 24 * 60 * 60
+        min_last_active = now - self.inactive_days * 24 * 60 * 60
+
+        selected = []
+        skipped = []
+        with self._lock:
+            for account_id, entry in self.accounts.items():
+                account = AdAccount(account_id)
+                account[AdAccount.Field.name] = entry['name']
+                if full_sweep or (entry['account_status'] == ACTIVE_ACCOUNT_STATUS and
+                                  entry['last_active'] >= min_last_active):
+                    selected.append(account)
+                else:
+                    skipped.append(account)
+
+        logger.info(f"Selected {len(selected)} ad accounts, skipped {len(skipped)} inactive ones, "
+                    f"full sweep: {full_sweep}")
+        return selected, skipped, full_sweep
+
+    def last_queried(self, account_id: str, object_type: str) -> Union[int, None]:
+        """
+        :param account_id: str - Id of the ad account
+        :param object_type: str - Object type queried
+        :return: int - Execution time the ad account was last queried at, None if never
+        """
+        with self._lock:
+            return self.accounts.get(account_id, {}).get('queried', {}).get(object_type)
+
+    def record_queried(self, account_ids: List[str], object_type: str, execution_time: int,
+                       active_account_ids: List[str], now: int) -> None:
+        """
+        Record the ad accounts queried for an object type, and the activity of the ones that
+        returned data.
+
+        :param account_ids: List - Ids of the ad accounts queried
+        :param object_type: str - Object type queried
+        :param execution_time: int - Execution time of the query
+        :param active_account_ids: List - Ids of the ad accounts that returned data
+        :param now: int - Current epoch timestamp
+        """
+        with self._lock:
+            for account_id in account_ids:
+                entry = self.accounts.get(account_id)
+                if entry is None:
+                    continue
+                entry['queried'][object_type] = execution_time
+                if account_id in active_account_ids:
+                    entry['last_active'] = now
+
+    def record_sweep(self, now: int) -> None:
+        """
+        :param now: int - Epoch timestamp of the full sweep
+        """
+        with self._lock:
+            self.swept_at = now
+
+
+def get_shard(account_id: str, shard_count: int) -> int:
+    """
+    Assign an ad account to a shard. The CRC32 of the account id is used instead of hash(), which
+    changes between processes, so that every run assigns the account to the same shard.
+
+    :param account_id: str - Id of the ad account
+    :param shard_count: int - Number of shards
+    :return: int - Index of the shard of the ad account
+    """
+    return zlib.crc32(account_id.encode('utf-8')) % shard_count
+
+
+def select_accounts(accounts: List[AdAccount], account_ids: List[str] = None,
+                    shard_index: int = None, shard_count: int = 1) -> List[AdAccount]:
+    """
+    Select the ad accounts of a run: the ones in the passed ids, if any, and assigned to the
+    passed shard, if any.
+
+    :param accounts: List - Ad accounts the system user has access to
+    :param account_ids: List - Ids of the ad accounts to select, None or empty for any
+    :param shard_index: int - Index of the shard of the run, None for an unsharded run
+    :param shard_count: int - Number of shards
+    :return: List - Selected ad accounts
+    """
+    if account_ids:
+        accounts = [account for account in accounts
+                    if account[AdAccount.Field.id] in account_ids]
+    if shard_index is not None:
+        accounts = [account for account in accounts
+                    if get_shard(account[AdAccount.Field.id], shard_count) == shard_index]
+    return accounts
+
+
+def get_shard_prefix(zone: str, tier: str, source: str, shard_run: str) -> str:
+    """
+    :param zone: str - Name of the zone of the data process
+    :param tier: str - Name of the tier of the data process
+    :param source: str - Name of the source involved in the data process
+    :param shard_run: str - Id of the sharded run
+    :return: str - Prefix of the plan, checkpoints and results of the shards of the run
+    """
+    return f"metadata/{zone}/{tier}/{source}/_shards/{shard_run}/"
+
+
+def get_cache_key(zone: str, tier: str, source: str, name: str, shard_index: int = None,
+                  shard_count: int = 1) -> str:
+    """
+    Every shard of a sharded run has its own cache objects, as the shards query different ad
+    accounts concurrently and would overwrite each other's entries.
+
+    :param zone: str - Name of the zone of the data process
+    :param tier: str - Name of the tier of the data process
+    :param source: str - Name of the source involved in the data process
+    :param name: str - Name of the cache
+    :param shard_index: int - Index of the shard of the run, None for an unsharded run
+    :param shard_count: int - Number of shards
+    :return: str - Key of the cache object
+    """
+    if shard_index is not None:
+        name = f"{name}-shard-{shard_index}-of-{shard_count}"
+    return f"metadata/{zone}/{tier}/{source}/_cache/{name}.json"
+
+
+def start_shards(glue_client: Glue, job_name: str, shard_run: str, shard_count: int,
+                 arguments: Dict[str, str]) -> List[str]:
+    """
+    Start one run of the Glue job per shard of a sharded run.
+
+    :param glue_client: Glue - Boto3 Glue client instance
+    :param job_name: str - Name of the Glue job
+    :param shard_run: str - Id of the sharded run
+    :param shard_count: int - Number of shards
+    :param arguments: Dict - Job arguments of the coordinator, passed on to every shard
+    :return: List - Ids of the Glue job runs of the shards
+    """
+    job_run_ids = []
+    for shard_index in range(shard_count):
+        shard_arguments = dict(arguments)
+        shard_arguments.update({'--shard_index': str(shard_index), '--shard_run': shard_run})
+
+        response = glue_client.start_job_run(JobName=job_name, Arguments=shard_arguments)
+        logger.info(f"Started shard {shard_index} of {shard_count} of run {shard_run}: "
+                    f"{response['JobRunId']}")
+        job_run_ids.append(response['JobRunId'])
+
+    return job_run_ids
+
+
+def complete_shard(s3_client: S3, bucket_name: str, zone: str, tier: str, source: str,
+                   extraction: str, shard_run: str, shard_index: int, shard_count: int,
+                   execution_time: int, process: str, fields: List[str],
+                   update_state: bool = True, manifest: Dict[str, Any] = None,
+                   **result) -> bool:
+    """
+    Store the result of a shard for an extraction, then, if the results of all the shards are
+    stored, merge them: generate the validation metadata.json of the extraction, with the rows of
+    all the shards and the result of each one, which advances the state of the extraction, and the
+    manifest of the pages captured by all the shards. The last shard to complete merges, so the
+    state is not advanced if any shard fails, and the next run requests the data again.
+
+    :param s3_client: S3 - Boto3 S3 client instance
+    :param bucket_name: str - Name of the bucket containing the metadata
+    :param zone: str - Zone of the present process
+    :param tier: str - Tier of the present process
+    :param source: str - Source of the present process
+    :param extraction: str -  Extraction of the present process
+    :param shard_run: str - Id of the sharded run
+    :param shard_index: int - Index of the shard
+    :param shard_count: int - Number of shards
+    :param execution_time: int - Execution time of the extraction, the same for all the shards
+    :param process: str - Name of the data workflow process at hand
+    :param fields: List - Fields requested for the extraction
+    :param update_state: bool - Whether the state of the extraction is advanced to execution_time
+    :param manifest: Dict - Manifest of the captured pages, see PageRecorder, None if pages are
+        not captured. The result of every shard holds its number of pages in n_pages
+    :return: bool - Whether the shards were merged
+    """
+    prefix = f"{get_shard_prefix(zone=zone, tier=tier, source=source, shard_run=shard_run)}" \
+             f"{extraction}/"
+    result['shard_index'] = shard_index
+    write_json(s3_client=s3_client, bucket_name=bucket_name,
+               key=f"{prefix}shard-{shard_index}.json", content=result)
+
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', [])
+                    if obj['Key'][len(prefix):].startswith('shard-'))
+
+    if len(keys) < shard_count:
+        logger.info(f"{len(keys)} of {shard_count} shards of {source}/{extraction} completed")
+        return False
+
+    shards = [read_json(s3_client=s3_client, bucket_name=bucket_name, key=key)
+              for key in sorted(keys)]
+    n_rows = sum(shard['n_rows'] for shard in shards)
+
+    logger.info(f"Merging {shard_count} shards of {source}/{extraction}: {n_rows} rows")
+    if n_rows > 0:
+        create_validation_metadata(s3_client=s3_client, execution_time=execution_time,
+                                   bucket_name=bucket_name, zone=zone, tier=tier,
+                                   source=source, extraction=extraction, n_rows=n_rows,
+                                   fields=fields, process=process,
+                                   n_fields=max(shard['n_fields'] for shard in shards),
+                                   update_state=update_state, shard_run=shard_run,
+                                   shards=shards)
     else:
-        params = get_params(object_type=object_type, latest_epoch=latest_epoch)
-        logger.info(f"These are the passed params: {params}")
+        logger.info(f"Got nothing to ingest for {source}/{extraction}")
 
-    # Loop through ad accounts
-    for account in accounts:
-        time.sleep(5)
-        tempaccount = AdAccount(account[AdAccount.Field.id])
-        logger.info(f"Querying {object_type} objects of {account['name']}, id: {account['id']}")
+    if manifest is not None:
+        write_manifest(s3_client=s3_client, bucket_name=bucket_name,
+                       prefix=get_pages_prefix(zone=zone, tier=tier, source=source,
+                                               extraction=extraction, dumpdate=execution_time),
+                       n_pages=sum(shard.get('n_pages', 0) for shard in shards), **manifest)
 
-        # Get data for object type of the ad account and append it to the df to be sinked
-        if object_type == 'ad_insights':
-            logger.info("Querying yesterday's data for ad_insights")
-            df = df.append(get_objects(object_type=object_type,
-                                       account_id=tempaccount,
-                                       fields=fields,
-                                       params=params_yesterday)).reset_index(drop=True)
-            logger.info("Querying today's data for ad_insights")
-            df = df.append(get_objects(object_type=object_type,
-                                       account_id=tempaccount,
-                                       fields=fields,
-                                       params=params_today)).reset_index(drop=True)
+    return True
+
+
+def main(argv: List[str], credentials: Dict[str, str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Run the job: query all the object types of the run for all the ad accounts, and sink their
+    data. In replay mode, rebuild the data of a dumpdate from the captured pages instead, and in a
+    sharded run, the coordinator only plans the extractions and starts the shards.
+
+    :param argv: List - Command line arguments, usually sys.argv
+    :param credentials: Dict - Facebook credentials, retrieved from Secrets Manager if not passed
+    :return: Dict - Performance report of every object type queried, keyed by object type
+    """
+    config = configure(argv)
+
+    # Report the performance of this run only
+    INSTRUMENTATION.reset()
+    performances = {}
+
+    # Load the cache of the ad preview URLs
+    preview_cache = PreviewCache(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                                 key=get_cache_key(zone=ZONE, tier=TIER, source=SOURCE,
+                                                   name='ad_preview',
+                                                   shard_index=config.shard_index,
+                                                   shard_count=config.shard_count))
+    preview_cache.load()
+
+    # In replay mode, rebuild the data of a dumpdate from the captured pages and stop there,
+    # without calling Facebook
+    if config.replay_dumpdate != '':
+        # The previews fetched by sharded runs are in the caches of the shards
+        for shard_index in range(config.shard_count if config.shard_count > 1 else 0):
+            preview_cache.merge(key=get_cache_key(zone=ZONE, tier=TIER, source=SOURCE,
+                                                  name='ad_preview', shard_index=shard_index,
+                                                  shard_count=config.shard_count))
+
+        for object_type in fields:
+            replay_extraction(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                              zone=ZONE, tier=TIER, source=SOURCE, extraction=object_type,
+                              dumpdate=config.replay_dumpdate, partition_columns=PARTITION,
+                              process=PROCESS, max_workers=config.max_workers,
+                              preview_cache=preview_cache,
+                              schema=schemas[object_type] if config.typed_output else None,
+                              update_catalog=config.update_catalog)
+
+        logger.info("I'm done")
+        return performances
+
+    # All object type list, unless the object types of the run are passed
+    object_type_list = ['ad', 'ad_set', 'campaign', 'ad_insights']
+
+    # If sunday, add ad_image to object_type list
+    if datetime.date.today().weekday() == 6:
+        object_type_list.append('ad_image')
+
+    if len(config.object_types) > 0:
+        object_type_list = config.object_types
+
+    # Select the fields of the object types of the run from the field profile, failing before any
+    # call to Facebook if they don't match the fields registry
+    run_fields = get_run_fields(object_types=object_type_list, profile=config.field_profile)
+    logger.info(f"Running {object_type_list} with field profile {config.field_profile}")
+
+    # A run restricted to a list of ad accounts doesn't advance the last execution time, since the
+    # other ad accounts miss its data
+    update_state = len(config.account_ids) == 0
+
+    # In a sharded run, the coordinator plans the extractions of all the object types, so that all
+    # the shards share the same execution times and time ranges, then starts the shards and stops
+    # there
+    if config.shard_count > 1 and config.shard_index is None:
+        if config.job_name == '':
+            raise ValueError("The job_name argument is required to start the shards")
+
+        shard_run = str(int(datetime.datetime.now(tz=TZ).timestamp()))
+        shard_plan = {'shard_count': config.shard_count, 'object_types': object_type_list,
+                      'extractions': {}}
+        for object_type in object_type_list:
+            shard_plan['extractions'][object_type] = plan_extraction(
+                s3_client=config.s3_client, bucket_name=config.data_bucket, zone=ZONE, tier=TIER,
+                source=SOURCE, extraction=object_type, execution_time=int(shard_run),
+                lookback_days=config.insights_lookback_days, max_days=config.insights_max_days,
+                backfill_since=config.insights_since, backfill_until=config.insights_until)
+
+        shard_prefix = get_shard_prefix(zone=ZONE, tier=TIER, source=SOURCE, shard_run=shard_run)
+        shard_plan_key = f"{shard_prefix}plan.json"
+        write_json(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                   key=shard_plan_key, content=shard_plan)
+        logger.info(f"Stored plan of sharded run s3://{config.data_bucket}/{shard_plan_key}: "
+                    f"{shard_plan}")
+
+        start_shards(glue_client=config.glue_client, job_name=config.job_name,
+                     shard_run=shard_run, shard_count=config.shard_count,
+                     arguments={f"--{name}": config.args[name]
+                                for name in REQUIRED_ARGUMENTS + list(OPTIONAL_ARGUMENTS)
+                                if config.args[name] != ''
+                                and name not in ['shard_index', 'shard_run']})
+
+        logger.info("I'm done")
+        return performances
+
+    # A shard runs the object types of the plan of its sharded run
+    shard_plan = None
+    if config.shard_index is not None:
+        if config.shard_run == '':
+            raise ValueError("A shard can only be started by the coordinator of a sharded run")
+
+        shard_prefix = get_shard_prefix(zone=ZONE, tier=TIER, source=SOURCE,
+                                        shard_run=config.shard_run)
+        shard_plan = read_json(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                               key=f"{shard_prefix}plan.json")
+        if shard_plan is None:
+            raise ValueError(f"No plan found for sharded run {config.shard_run}")
+        object_type_list = shard_plan['object_types']
+        run_fields = get_run_fields(object_types=object_type_list, profile=config.field_profile)
+        logger.info(f"Running shard {config.shard_index} of {config.shard_count} of sharded run "
+                    f"{config.shard_run}")
+
+    # Retrieve credentials, unless they are passed
+    if credentials is None:
+        logger.info(f"Retrieving credentials: {config.secret_name}")
+        credentials = get_credentials(secret_manager_client=config.secret_manager_client,
+                                      secret_name=config.secret_name)
+
+    app_id = credentials['FB_APP_ID']
+    app_secret = credentials['FB_APP_SECRET']
+    access_token = credentials['FB_ACCESS_TOKEN']
+
+    # Start the connection to the facebook API, throttled by a rate limiter shared by all threads
+    session = FacebookSession(app_id, app_secret, access_token, timeout=config.request_timeout)
+    session.GRAPH = config.graph_url
+    api = ThrottledFacebookAdsApi(session)
+    api.rate_limiter = RateLimiter(rate=config.requests_per_second)
+    FacebookAdsApi.set_default_api(api)
+
+    # Get all ad_accounts system user has access to, and keep the ones of the run. With the ad
+    # account registry, unless the ad accounts are passed, ad accounts are listed only when the
+    # registry expires, and inactive ones are skipped but by full sweeps
+    system_user = User(fbid='me')
+    registry = None
+    skipped_accounts = []
+    full_sweep = False
+    if config.account_registry and len(config.account_ids) == 0:
+        registry_key = get_cache_key(zone=ZONE, tier=TIER, source=SOURCE, name='ad_accounts',
+                                     shard_index=config.shard_index,
+                                     shard_count=config.shard_count)
+        registry = AccountRegistry(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                                   key=registry_key, ttl_hours=config.account_registry_ttl_hours,
+                                   inactive_days=config.account_inactive_days,
+                                   sweep_days=config.account_sweep_days)
+        registry.load()
+        registry.refresh(user=system_user, now=int(time.time()))
+        accounts, skipped_accounts, full_sweep = registry.select(now=int(time.time()))
+    else:
+        accounts = list(system_user.get_ad_accounts(fields=[AdAccount.Field.id,
+                                                            AdAccount.Field.name]))
+    accounts = select_accounts(accounts, account_ids=config.account_ids,
+                               shard_index=config.shard_index, shard_count=config.shard_count)
+    logger.info(f"Querying {len(accounts)} ad accounts")
+
+    # With adaptive requests, page sizes and report days are tuned by ad account, starting from
+    # the values tuned by the previous runs
+    tuner = None
+    if config.adaptive_requests:
+        tuner = RequestTuner(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                             key=get_cache_key(zone=ZONE, tier=TIER, source=SOURCE,
+                                               name='request_tuning',
+                                               shard_index=config.shard_index,
+                                               shard_count=config.shard_count))
+        tuner.load()
+
+    # Query one object_type at a time for all ad accounts, several ad accounts concurrently.
+    # If the query returns results, sink the data, else move to the next object_type
+    for object_type in object_type_list:
+
+        # Set list of per-account dataframes, concatenated once into the df to be sinked
+        dataframes = [pd.DataFrame(columns=run_fields[object_type])]
+
+        # Reset the throttling counters and set the instrumentation context of the main thread,
+        # reported in the metadata of the object type
+        api.rate_limiter.reset_stats()
+        INSTRUMENTATION.set_context(object_type=object_type)
+        object_type_start = time.monotonic()
+
+        # Plan the execution time, last execution time and stale days of insights of the object
+        # type, or take them from the plan of the sharded run
+        if shard_plan is not None:
+            plan = shard_plan['extractions'][object_type]
         else:
-            df = df.append(get_objects(object_type=object_type,
-                                       account_id=tempaccount,
-                                       fields=fields,
-                                       params=params)).reset_index(drop=True)
+            plan = plan_extraction(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                                   zone=ZONE, tier=TIER, source=SOURCE, extraction=object_type,
+                                   execution_time=int(datetime.datetime.now(tz=TZ).timestamp()),
+                                   lookback_days=config.insights_lookback_days,
+                                   max_days=config.insights_max_days,
+                                   backfill_since=config.insights_since,
+                                   backfill_until=config.insights_until)
+
+        # In resumable mode, go on with the interrupted run of the object type, if any, with the
+        # plan it started with, otherwise checkpoint the plan of this run. Shards are resumed only
+        # within their sharded run
+        checkpoint = None
+        resumed = False
+        if config.resumable:
+            checkpoint_key = get_checkpoint_key(zone=ZONE, tier=TIER, source=SOURCE,
+                                                extraction=object_type)
+            if shard_plan is not None:
+                checkpoint_key = f"{shard_prefix}{object_type}/" \
+                                 f"checkpoint-{config.shard_index}.json"
+            checkpoint = Checkpoint(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                                    key=checkpoint_key)
+            resumed = checkpoint.load()
+            if resumed:
+                plan = checkpoint.plan
+            else:
+                checkpoint.start(**plan)
 
-    # Sink df containing all data of all ad account of the one object type at hand
-    df.pipe(sink, execution_time=EXECUTION_TIME, bucket_name=DATA_BUCKET, zone=ZONE,
-            tier=TIER, source=SOURCE, extraction=object_type, partition_columns=PARTITION,
-            process=PROCESS, fields=fields[object_type])
+        # Set execution time of the process
+        execution_time = plan['execution_time']
+        latest_epoch = plan['latest_epoch']
+        time_range = plan['time_range']
+        logger.info(f"Querying {object_type}, execution_time: {execution_time}")
 
-logger.info("I'm done")
+        # Get parameters to be passed to the API
+        params = get_params(object_type=object_type, latest_epoch=latest_epoch,
+                            time_range=time_range)
+        logger.info(f"These are the passed params: {params}")
+
+        # Ad accounts skipped by previous runs catch up from the execution time they were last
+        # queried at, instead of the last execution time of the object type. ad_image is not
+        # filtered by the API, so it has no parameters to catch up with
+        account_params = {}
+        if registry is not None and object_type != 'ad_image':
+            for account in accounts:
+                last_queried = registry.last_queried(account[AdAccount.Field.id], object_type)
+                if last_queried is None or last_queried >= int(latest_epoch):
+                    continue
+
+                account_time_range = None
+                if object_type == 'ad_insights':
+                    account_time_range = get_insights_time_range(
+                        latest_epoch=str(last_queried),
+                        lookback_days=config.insights_lookback_days,
+                        max_days=config.insights_max_days, backfill_since=config.insights_since,
+                        backfill_until=config.insights_until)
+                account_params[account[AdAccount.Field.id]] = get_params(
+                    object_type=object_type, latest_epoch=str(last_queried),
+                    time_range=account_time_range)
+
+        # With typed output, the data is stored with the types of the schemas registry
+        schema = schemas[object_type] if config.typed_output else None
+
+        # In streaming mode, the data is sunk in chunks while it is fetched. So it is in resumable
+        # mode, going on from the chunks written by the interrupted run
+        writer = None
+        if config.streaming or config.resumable:
+            writer = ParquetChunkWriter(execution_time=execution_time,
+                                        bucket_name=config.data_bucket, zone=ZONE, tier=TIER,
+                                        source=SOURCE, extraction=object_type,
+                                        partition_columns=PARTITION, chunk_rows=config.chunk_rows,
+                                        chunk_mb=config.chunk_mb, schema=schema,
+                                        update_catalog=config.update_catalog)
+        if checkpoint is not None and checkpoint.writer:
+            writer.restore(checkpoint.writer)
+
+        # If pages are captured, the raw objects are stored as they are fetched. So they are in
+        # resumable mode, going on from the pages checkpointed by the interrupted run
+        recorder = None
+        if config.capture_pages:
+            recorder = PageRecorder(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                                    zone=ZONE, tier=TIER, source=SOURCE, extraction=object_type,
+                                    execution_time=execution_time)
+        if recorder is not None and checkpoint is not None:
+            recorder.restore({key: position['pages']
+                              for key, position in checkpoint.accounts.items()
+                              if position.get('pages') is not None})
+
+        # Get data for object type of all the ad accounts and collect it for the df to be sinked
+        dataframes.extend(extract_accounts(object_type=object_type, accounts=accounts,
+                                           fields=run_fields, params=params,
+                                           max_workers=config.max_workers,
+                                           preview_cache=preview_cache, writer=writer,
+                                           latest_epoch=latest_epoch, recorder=recorder,
+                                           checkpoint=checkpoint, account_params=account_params,
+                                           bulk_limit=config.insights_bulk_limit, tuner=tuner))
+
+        # The manifest of the pages of a shard is left to the merge of the shards
+        manifest = None
+        if config.capture_pages:
+            manifest = {'fields': run_fields[object_type], 'params': params,
+                        'latest_epoch': latest_epoch}
+        if config.capture_pages and shard_plan is None:
+            recorder.write_manifest(**manifest)
+
+        # Collect the stats of the object type for the validation metadata, and the dataset its
+        # data is stored in
+        metadata = {'dataset': get_dataset(object_type, schema),
+                    'throttling': api.rate_limiter.stats()}
+        if config.capture_pages:
+            metadata['n_pages'] = recorder.n_pages
+        if object_type == 'ad_insights':
+            metadata['time_range'] = time_range
+        if object_type == 'ad':
+            metadata['preview_cache'] = preview_cache.stats()
+        if config.resumable:
+            metadata['resumed'] = resumed
+        if len(config.account_ids) > 0:
+            metadata['account_ids'] = config.account_ids
+        if registry is not None:
+            metadata['accounts'] = {'queried': len(accounts), 'skipped': len(skipped_accounts),
+                                    'catching_up': len(account_params), 'full_sweep': full_sweep}
+        logger.info(f"Stats for {object_type}: {metadata}")
+
+        # Sink after collecting the performance report, so it is complete but for the sink itself
+        metadata['performance'] = get_performance(object_type, start=object_type_start)
+
+        # Sink df containing all data of all ad account of the one object type at hand,
+        # or complete the streaming sink of the object type
+        # A shard doesn't generate the validation metadata, which is left to the merge of the shards
+        if writer is not None:
+            result = sink_stream(writer, s3_client=config.s3_client, zone=ZONE, tier=TIER,
+                                 source=SOURCE, extraction=object_type, process=PROCESS,
+                                 fields=run_fields[object_type],
+                                 update_state=update_state, create_metadata=shard_plan is None,
+                                 **metadata)
+        else:
+            df = pd.concat(dataframes, ignore_index=True, sort=False)
+            result = df.pipe(sink, s3_client=config.s3_client, execution_time=execution_time,
+                             bucket_name=config.data_bucket, zone=ZONE, tier=TIER,
+                             source=SOURCE, extraction=object_type,
+                             partition_columns=PARTITION, process=PROCESS,
+                             fields=run_fields[object_type], schema=schema,
+                             update_state=update_state, create_metadata=shard_plan is None,
+                             update_catalog=config.update_catalog, **metadata)
+
+        # A shard stores its result, and the last shard to complete merges the results of all
+        # shards
+        merged = shard_plan is None
+        if shard_plan is not None:
+            merged = complete_shard(s3_client=config.s3_client, bucket_name=config.data_bucket,
+                                    zone=ZONE, tier=TIER, source=SOURCE, extraction=object_type,
+                                    shard_run=config.shard_run, shard_index=config.shard_index,
+                                    shard_count=config.shard_count, execution_time=execution_time,
+                                    process=PROCESS, fields=run_fields[object_type],
+                                    update_state=update_state, manifest=manifest, **result,
+                                    **metadata)
+
+        # With the current state output, merge the data of the object type, once all of it is sunk,
+        # into the latest version of every object
+        if config.current_state and merged and object_type in current_state_keys:
+            current_state = upsert_current_state(bucket_name=config.data_bucket, zone=ZONE,
+                                                 tier=TIER, source=SOURCE, extraction=object_type,
+                                                 execution_time=execution_time, schema=schema,
+                                                 update_catalog=config.update_catalog)
+            logger.info(f"Current state of {object_type}: {current_state}")
+
+        if checkpoint is not None:
+            checkpoint.clear()
+
+        # The tuned values are stored once the object type is done, so that a resumed run splits
+        # the report jobs as the interrupted one did
+        if tuner is not None:
+            tuner.save()
+
+        # Record the ad accounts queried, and the ones that returned data as active
+        if registry is not None:
+            active_account_ids = [account_id for account_id, sections
+                                  in metadata['performance']['accounts'].items()
+                                  if sections.get('finalize_records', {}).get('rows', 0) > 0]
+            registry.record_queried(account_ids=[account[AdAccount.Field.id]
+                                                 for account in accounts],
+                                    object_type=object_type, execution_time=execution_time,
+                                    active_account_ids=active_account_ids, now=int(time.time()))
+            registry.save()
+
+        if object_type == 'ad':
+            preview_cache.save()
+
+        performances[object_type] = get_performance(object_type, start=object_type_start)
+        if config.log_metrics:
+            logger.info(json.dumps({'event': 'performance', 'source': SOURCE,
+                                    'extraction': object_type, 'execution_time': execution_time,
+                                    'performance': performances[object_type]}, default=str))
+
+    if registry is not None and full_sweep:
+        registry.record_sweep(now=int(time.time()))
+        registry.save()
+
+    logger.info("I'm done")
+    return performances
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,133 @@
+# Tests of facebook_compact.py, run with pytest from facebook-ingest/src
+import datetime
+from typing import List, Dict
+
+import boto3
+import pandas as pd
+import pytest
+from moto import mock_s3
+
+import facebook_compact
+
+# Set test constants
+BUCKET = 'test-bucket'
+PATH = f"s3://{BUCKET}/intake/raw/facebook/ad_set/"
+DUMPDATES = [1650000000, 1650010000, 1650020000]
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    """
+    S3 client of a bucket mocked by moto.
+    """
+    for name in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN']:
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'eu-west-1')
+    with mock_s3():
+        s3_client = boto3.client('s3', region_name='eu-west-1')
+        s3_client.create_bucket(Bucket=BUCKET,
+                                CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+        yield s3_client
+
+
+def write_runs(s3_client) -> None:
+    """
+    Write two runs of ad_set data to every dumpdate partition, as facebook_ingest does, each with
+    the ad sets 0 to 2 in a version named after the dumpdate. Ad set 0 is updated by the last
+    dumpdate only.
+    """
+    for dumpdate in DUMPDATES:
+        for run in range(2):
+            dataframe = pd.DataFrame({
+                'id': ['0', '1', '2'],
+                'updated_time': ['t1' if dumpdate == DUMPDATES[-1] else 't0', 't0', 't0'],
+                'name': [f"{dumpdate}-{run}"] * 3
+            })
+            s3_client.put_object(Bucket=BUCKET,
+                                 Key=f"intake/raw/facebook/ad_set/dumpdate={dumpdate}/"
+                                     f"run{run}.snappy.parquet",
+                                 Body=dataframe.to_parquet(index=False, compression='snappy'))
+
+
+def list_files(s3_client) -> Dict[str, List[str]]:
+    """
+    :return: Dict - Names of the files of every dumpdate partition of the ad_set data
+    """
+    files = {}
+    for content in s3_client.list_objects_v2(Bucket=BUCKET).get('Contents', []):
+        partition, name = content['Key'].split('/')[-2:]
+        files.setdefault(partition, []).append(name)
+    return files
+
+
+def compact() -> Dict[str, int]:
+    return facebook_compact.compact_extraction(
+        bucket_name=BUCKET, zone='intake', tier='raw', source='facebook', extraction='ad_set',
+        start=DUMPDATES[0], end=DUMPDATES[-1] + 1, deduplicate=True,
+        target_file_bytes=128 * 1024 * 1024, update_catalog=False)
+
+
+def test_get_job_arguments_ignores_glue_arguments():
+    args = facebook_compact.get_job_arguments(['facebook_compact.py', '--JOB_ID', 'j_1',
+                                               '--data_bucket', 'bucket', '--since', '2022-01-01'])
+
+    assert args == dict(facebook_compact.OPTIONAL_ARGUMENTS, data_bucket='bucket',
+                        since='2022-01-01')
+
+
+def test_get_deduplication_keys_of_typed_extractions():
+    assert facebook_compact.get_deduplication_keys('ad_insights_typed') == \
+        facebook_compact.get_deduplication_keys('ad_insights') == ['date_start', 'ad_id']
+    assert facebook_compact.get_deduplication_keys('ad_creative') is None
+
+
+def test_main_rejects_unknown_extractions():
+    with pytest.raises(ValueError, match='ad_creative'):
+        facebook_compact.main(['facebook_compact.py', '--data_bucket', 'bucket',
+                               '--extractions', 'ad,ad_creative'])
+
+
+def test_get_dumpdate_range_defaults_to_yesterday():
+    start, end = facebook_compact.get_dumpdate_range(since='', until='',
+                                                     today=datetime.date(2022, 3, 2))
+
+    assert end - start == 24 * 60 * 60
+    assert datetime.datetime.fromtimestamp(start, facebook_compact.TZ).date() == \
+        datetime.date(2022, 3, 1)
+
+
+def test_compact_extraction_keeps_the_latest_dumpdate_of_every_row(s3_client):
+    import awswrangler as wr
+
+    write_runs(s3_client)
+
+    stats = compact()
+
+    files = list_files(s3_client)
+    assert all(name.startswith('compacted_') for names in files.values() for name in names)
+    assert stats == {'partitions': 3, 'files_before': 6, 'files_after': len(files),
+                     'rows_before': 18, 'rows_after': 4}
+
+    rows = wr.s3.read_parquet(path=PATH, dataset=True)
+    assert sorted(zip(rows['id'], rows['updated_time'], rows['name'],
+                      rows['dumpdate'].astype(int))) == [
+        ('0', 't0', f"{DUMPDATES[1]}-1", DUMPDATES[1]),
+        ('0', 't1', f"{DUMPDATES[2]}-1", DUMPDATES[2]),
+        ('1', 't0', f"{DUMPDATES[2]}-1", DUMPDATES[2]),
+        ('2', 't0', f"{DUMPDATES[2]}-1", DUMPDATES[2])]
+
+
+def test_compact_extraction_deletes_files_only_once_written(s3_client, monkeypatch):
+    import awswrangler as wr
+
+    def fail_to_write(**kwargs):
+        raise RuntimeError('write failed')
+
+    write_runs(s3_client)
+    files = list_files(s3_client)
+    monkeypatch.setattr(wr.s3, 'to_parquet', fail_to_write)
+
+    with pytest.raises(RuntimeError, match='write failed'):
+        compact()
+
+    assert list_files(s3_client) == files
@@ -0,0 +1,951 @@
+# Tests of facebook_ingest.py, run with pytest from facebook-ingest/src
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+from typing import List, Dict, Any
+
+import boto3
+import pytest
+from moto import mock_s3
+from facebook_business.adobjects.adaccount import AdAccount
+from facebook_business.adobjects.adsinsights import AdsInsights
+from facebook_business.adobjects.objectparser import ObjectParser
+from facebook_business.adobjects.targeting import Targeting
+from facebook_business.api import FacebookAdsApi, FacebookResponse
+from facebook_business.exceptions import FacebookRequestError
+from facebook_business.session import FacebookSession
+
+import facebook_ingest
+
+# Set test constants
+BUCKET = 'test-bucket'
+HOUR = 60 * 60
+DAY = 24 * HOUR
+NOW = 1650000000
+N_OBJECTS = 5000
+SEED = 20220101
+DEFERRED_MODULES = ['facebook_business.adobjects.adimage', 'facebook_business.adobjects.adpreview',
+                    'awswrangler']
+IMPORT_SECONDS = 5
+TARGETING_VALUES = {'publisher_platforms': [['facebook'], ['facebook', 'instagram']],
+                    'instagram_positions': [['stream'], ['stream', 'story']],
+                    'facebook_positions': [['feed'], ['feed', 'story']],
+                    'device_platforms': [['mobile'], ['mobile', 'desktop']],
+                    'age_min': [18, 25], 'age_max': [45, 65],
+                    'geo_locations': [{'countries': ['IT']}, {'countries': ['IT', 'FR']}],
+                    'flexible_spec': [[{'interests': [{'id': '1'}]}]]}
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    """
+    S3 client of a bucket mocked by moto.
+    """
+    for name in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN']:
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'eu-west-1')
+    with mock_s3():
+        s3_client = boto3.client('s3', region_name='eu-west-1')
+        s3_client.create_bucket(Bucket=BUCKET,
+                                CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+        yield s3_client
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """
+    ThrottledFacebookAdsApi set as default, with a RateLimiter that backs off for a few
+    milliseconds only. Tests set the responses of its HTTP calls with api.respond.
+    """
+    api = facebook_ingest.ThrottledFacebookAdsApi(FacebookSession('app', 'secret', 'token'))
+    api.rate_limiter = facebook_ingest.RateLimiter(rate=1000, initial_backoff=0.001,
+                                                   max_backoff=0.001)
+    api.calls = []
+
+    def call(self, method, path, params=None, headers=None, files=None, url_override=None,
+             api_version=None):
+        api.calls.append(params)
+        return self.respond(method, path, params)
+
+    monkeypatch.setattr(FacebookAdsApi, 'call', call)
+    monkeypatch.setattr(FacebookAdsApi, '_default_api', api)
+    return api
+
+
+class FakeClock:
+    """
+    Stand-in of the time module of facebook_ingest, whose sleeps only move its clock forward.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(facebook_ingest, 'time', clock)
+    return clock
+
+
+def batch_response(*bodies: Dict[str, Any]) -> FacebookResponse:
+    return FacebookResponse(body=json.dumps([{'code': 400 if 'error' in body else 200,
+                                              'headers': [], 'body': json.dumps(body)}
+                                             for body in bodies]), http_status=200, headers={})
+
+
+def baseline_parse(object: Dict[str, Any], object_fields: List[str]) -> Dict[str, Any]:
+    """
+    Parse an object as the if/elif chain of get_objects did before compile_extractor, kept as is
+    to pin the parsing semantics.
+    """
+    values_holder = {}
+    for field in object_fields:
+        key = field
+        if field == 'creative':
+            value = object[field]['id'] if field in object else ''
+        elif field == 'pacing_type':
+            value = object[field][0] if field in object else ''
+        elif field in ['cost_per_outbound_click', 'outbound_clicks']:
+            value = object[field][0]['value'] if field in object else ''
+        elif field == 'targeting':
+            value = object[field]
+            for internal_key in object[field].keys():
+                if 'publisher_platforms' in object[field].keys():
+                    internal_value = object[field][internal_key]
+                    values_holder[internal_key] = internal_value
+                else:
+                    values_holder['publisher_platforms'] = ''
+
+                if 'instagram_positions' in object[field].keys():
+                    internal_value = object[field][internal_key]
+                    values_holder[internal_key] = internal_value
+                else:
+                    values_holder['instagram_positions'] = ''
+
+                if 'facebook_positions' in object[field].keys():
+                    internal_value = object[field][internal_key]
+                    values_holder[internal_key] = internal_value
+                else:
+                    values_holder['facebook_positions'] = ''
+
+                if 'device_platforms' in object[field].keys():
+                    internal_value = object[field][internal_key]
+                    values_holder[internal_key] = internal_value
+                else:
+                    values_holder['device_platforms'] = ''
+        else:
+            value = object[field] if field in object else ''
+
+        values_holder[key] = value
+
+    return values_holder
+
+
+def random_targeting(rng: random.Random) -> Dict[str, Any]:
+    targeting = {key: rng.choice(TARGETING_VALUES[key])
+                 for key in rng.sample(sorted(TARGETING_VALUES),
+                                       rng.randint(0, len(TARGETING_VALUES)))}
+    if rng.random() < 0.5:
+        return targeting
+
+    # The Graph API returns targeting as an SDK object
+    sdk_targeting = Targeting()
+    for key, value in targeting.items():
+        sdk_targeting[key] = value
+    return sdk_targeting
+
+
+def random_value(field: str, rng: random.Random) -> Any:
+    if field == 'creative':
+        return {'id': str(rng.randint(1, 10 ** 9))}
+    if field == 'pacing_type':
+        return rng.sample(['standard', 'day_parting', 'no_pacing'], rng.randint(1, 3))
+    if field in ['cost_per_outbound_click', 'outbound_clicks']:
+        return [{'action_type': 'outbound_click', 'value': str(rng.random())}
+                for _ in range(rng.randint(1, 2))]
+    if field == 'targeting':
+        return random_targeting(rng)
+    return rng.choice([str(rng.randint(0, 10 ** 6)), '', 1.5, True, [], {'id': '1'}])
+
+
+def random_objects(object_fields: List[str], rng: random.Random) -> List[Dict[str, Any]]:
+    # Any field can be missing, except targeting which both parsings require
+    return [{field: random_value(field, rng) for field in object_fields
+             if field == 'targeting' or rng.random() < 0.8}
+            for _ in range(N_OBJECTS)]
+
+
+@pytest.mark.parametrize('object_type', sorted(facebook_ingest.fields))
+def test_compile_extractors_matches_baseline_parsing(object_type):
+    object_fields = facebook_ingest.fields[object_type]
+    extractors = facebook_ingest.compile_extractors(object_fields)
+
+    for object in random_objects(object_fields, random.Random(SEED)):
+        assert facebook_ingest.parse_object(object, extractors) == \
+            baseline_parse(object, object_fields)
+
+
+def test_compile_extractors_matches_baseline_targeting():
+    object_fields = ['id', 'targeting']
+    extractors = facebook_ingest.compile_extractors(object_fields)
+    rng = random.Random(SEED)
+
+    for _ in range(N_OBJECTS):
+        object = {'id': '1', 'targeting': random_targeting(rng)}
+        assert facebook_ingest.parse_object(object, extractors) == \
+            baseline_parse(object, object_fields)
+
+
+@pytest.mark.parametrize('targeting, expected', [
+    ({}, {}),
+    ({'age_min': 18}, {'publisher_platforms': '', 'instagram_positions': '',
+                       'facebook_positions': '', 'device_platforms': ''}),
+    ({'age_min': 18, 'device_platforms': ['mobile']},
+     {'age_min': 18, 'publisher_platforms': '', 'instagram_positions': '',
+      'facebook_positions': '', 'device_platforms': ['mobile']}),
+])
+def test_targeting_flattening(targeting, expected):
+    extractors = facebook_ingest.compile_extractors(['targeting'])
+    assert facebook_ingest.parse_object({'targeting': targeting}, extractors) == \
+        dict(expected, targeting=targeting)
+
+
+def accumulate_pages(pages: List[List[Dict[str, Any]]]) -> List['facebook_ingest.pd.DataFrame']:
+    """
+    Accumulate the same ad_insights pages as raw records, and as AdsInsights objects of a cursor.
+    """
+    object_fields = facebook_ingest.fields['ad_insights']
+    extractors = facebook_ingest.compile_extractors(object_fields)
+    raw = facebook_ingest.RawRecordAccumulator(columns=object_fields)
+    parsed = facebook_ingest.RecordAccumulator(columns=object_fields)
+    for page in pages:
+        raw.extend(page)
+        for object in ObjectParser(target_class=AdsInsights).parse_multiple({'data': page}):
+            parsed.append(facebook_ingest.parse_object(object, extractors))
+
+    return [raw.to_dataframe(), parsed.to_dataframe()]
+
+
+def test_raw_record_accumulator_matches_cursor_parsing():
+    object_fields = facebook_ingest.fields['ad_insights']
+    rng = random.Random(SEED)
+    # Any field can be missing, and any but the outbound clicks ones null
+    pages = [[{field: random_value(field, rng) if field in ['cost_per_outbound_click',
+                                                            'outbound_clicks']
+               else rng.choice([None, '', str(rng.randint(0, 10 ** 6))])
+               for field in object_fields if rng.random() < 0.8}
+              for _ in range(N_OBJECTS // 4)]
+             for _ in range(4)]
+
+    raw, parsed = accumulate_pages(pages)
+
+    assert list(raw.columns) == list(parsed.columns) == object_fields
+    assert raw.equals(parsed)
+
+
+def test_raw_record_accumulator_keeps_null_fields():
+    raw, parsed = accumulate_pages([[{'ad_id': '1', 'spend': None}, {'ad_id': '2', 'reach': '5'}]])
+
+    for dataframe in [raw, parsed]:
+        assert dataframe['spend'].tolist() == [None, '']
+        assert dataframe['reach'].tolist() == ['', '5']
+        assert dataframe['clicks'].tolist() == ['', '']
+
+
+@pytest.mark.parametrize('response, after', [
+    ({'data': []}, None),
+    ({'data': [], 'paging': {'cursors': {'before': 'MA', 'after': 'MQ'}}}, None),
+    ({'data': [], 'paging': {'cursors': {'before': 'MA', 'after': 'MQ'}, 'next': 'url'}}, 'MQ'),
+])
+def test_get_next_after(response, after):
+    assert facebook_ingest.get_next_after(response) == after
+
+
+def test_get_next_after_requires_a_cursor_with_a_next_page():
+    with pytest.raises(RuntimeError, match='no after cursor'):
+        facebook_ingest.get_next_after({'data': [], 'paging': {'next': 'url'}})
+
+
+def test_import_defers_optional_modules():
+    # A fresh interpreter, as the modules may already be imported by other tests
+    code = ("import sys, facebook_ingest; "
+            f"print([name for name in {DEFERRED_MODULES} if name in sys.modules])")
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(__file__),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+
+    assert result.stdout.strip() == '[]'
+
+
+def test_import_time(record_property):
+    # python -X importtime reports the microseconds spent importing every module on stderr, as
+    # "import time: <self> | <cumulative> | <indented module name>"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import facebook_ingest'],
+                            cwd=os.path.dirname(__file__), stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            _, microseconds, module = line.split('|')
+            cumulative[module.strip()] = int(microseconds)
+
+    import_seconds = cumulative['facebook_ingest'] / 1e6
+    record_property('import_seconds', import_seconds)
+
+    assert [module for module in DEFERRED_MODULES if module in cumulative] == []
+    assert import_seconds < IMPORT_SECONDS
+
+
+def test_report_job_manager_backs_off_on_throttled_polls(api):
+    throttled = {'error': {'code': 80004, 'message': 'There have been too many calls'}}
+    polls = iter([throttled] * 10 + [{'id': '42', 'async_status': 'Job Completed'}])
+
+    def respond(method, path, params):
+        if 'batch' in params:
+            return batch_response(next(polls))
+        return FacebookResponse(body=json.dumps({'report_run_id': '42'}), http_status=200)
+
+    api.respond = respond
+    manager = facebook_ingest.ReportJobManager(fields=['ad_id'], params={}, initial_delay=0,
+                                               max_poll_failures=2)
+    manager.submit(AdAccount('act_1'))
+
+    assert [key for _, _, key in manager.completed()] == ['act_1']
+    assert api.rate_limiter.n_throttling_errors == 10
+
+
+def test_report_job_manager_fails_on_poll_errors(api):
+    api.respond = lambda method, path, params: \
+        batch_response({'error': {'code': 100, 'message': 'Unsupported get request'}}) \
+        if 'batch' in params else \
+        FacebookResponse(body=json.dumps({'report_run_id': '42'}), http_status=200)
+    manager = facebook_ingest.ReportJobManager(fields=['ad_id'], params={}, initial_delay=0,
+                                               max_poll_failures=2)
+    manager.submit(AdAccount('act_1'))
+
+    with pytest.raises(RuntimeError, match='Unable to poll report job 42'):
+        list(manager.completed())
+    assert api.rate_limiter.n_throttling_errors == 0
+
+
+def preview_responses(errors: Dict[str, List[Dict[str, Any]]]):
+    """
+    Respond to batched preview requests with the next error of the ad id in errors, if any, else
+    with a preview of the ad.
+    """
+    def respond(method, path, params):
+        bodies = []
+        for request in params['batch']:
+            ad_id = request['relative_url'].split('/previews')[0].split('/')[-1]
+            if len(errors.get(ad_id, [])) > 0:
+                bodies.append(errors[ad_id].pop(0))
+            else:
+                bodies.append({'data': [{'body': f'<iframe src="https://fb.me/{ad_id}?a=1&amp;'
+                                                 f't=2" width="540"></iframe>'}]})
+        return batch_response(*bodies)
+    return respond
+
+
+def test_get_previews_retries_throttled_and_transient_errors(api):
+    throttled = {'error': {'code': 17, 'message': 'User request limit reached'}}
+    transient = {'error': {'code': 2, 'message': 'Service temporarily unavailable',
+                           'is_transient': True}}
+    no_preview = {'error': {'code': 100, 'message': 'Unsupported get request'}}
+    api.respond = preview_responses({'1': [throttled, throttled], '2': [transient],
+                                     '3': [no_preview]})
+
+    previews = facebook_ingest.get_previews({key: (key, 'MOBILE_FEED_STANDARD')
+                                             for key in ['1', '2', '3', '4']})
+
+    assert previews == {'1': 'https://fb.me/1?a=1&t=2', '2': 'https://fb.me/2?a=1&t=2',
+                        '4': 'https://fb.me/4?a=1&t=2'}
+    assert api.rate_limiter.n_throttling_errors == 2
+
+
+def test_get_previews_fails_when_throttled_too_long(api):
+    throttled = {'error': {'code': 17, 'message': 'User request limit reached'}}
+    api.respond = preview_responses({'1': [throttled] * 10})
+
+    with pytest.raises(RuntimeError, match='Unable to get 1 previews'):
+        facebook_ingest.get_previews({'1': ('1', 'MOBILE_FEED_STANDARD')})
+
+
+def test_get_cache_key_of_shards():
+    assert facebook_ingest.get_cache_key(zone='intake', tier='raw', source='facebook',
+                                         name='ad_preview') == \
+        'metadata/intake/raw/facebook/_cache/ad_preview.json'
+    assert facebook_ingest.get_cache_key(zone='intake', tier='raw', source='facebook',
+                                         name='ad_preview', shard_index=1, shard_count=4) == \
+        'metadata/intake/raw/facebook/_cache/ad_preview-shard-1-of-4.json'
+
+
+def test_complete_shard_merges_the_last_shard(s3_client):
+    shard = dict(s3_client=s3_client, bucket_name=BUCKET, zone='intake', tier='raw',
+                 source='facebook', extraction='ad', shard_run='1650000000', shard_count=2,
+                 execution_time=1650000000, process='facebook_ingest', fields=['id'],
+                 manifest={'fields': ['id'], 'params': {}, 'latest_epoch': '1649990000'})
+    prefix = 'metadata/intake/raw/facebook/'
+    pages_prefix = facebook_ingest.get_pages_prefix(zone='intake', tier='raw', source='facebook',
+                                                    extraction='ad', dumpdate=1650000000)
+
+    assert not facebook_ingest.complete_shard(shard_index=1, n_rows=3, n_fields=1, n_pages=2,
+                                              **shard)
+    assert 'Contents' not in s3_client.list_objects_v2(Bucket=BUCKET, Prefix=f"{prefix}ad/")
+    assert 'Contents' not in s3_client.list_objects_v2(Bucket=BUCKET, Prefix=pages_prefix)
+
+    assert facebook_ingest.complete_shard(shard_index=0, n_rows=4, n_fields=1, n_pages=1,
+                                          **shard)
+    metadata = facebook_ingest.read_json(s3_client, BUCKET,
+                                         f"{prefix}ad/dumpdate=1650000000/metadata.json")
+    assert metadata['Execution Overview']['n_rows'] == 7
+    assert [result['shard_index'] for result in metadata['Execution Overview']['shards']] == [0, 1]
+    manifest = facebook_ingest.read_json(s3_client, BUCKET, f"{pages_prefix}_manifest.json")
+    assert manifest == {'fields': ['id'], 'params': {}, 'latest_epoch': '1649990000',
+                        'n_pages': 3}
+    state = facebook_ingest.read_json(s3_client, BUCKET, f"{prefix}_state/ad.json")
+    assert state == {'execution_time': 1650000000,
+                     'metadata_key': f"{prefix}ad/dumpdate=1650000000/metadata.json"}
+
+
+@pytest.mark.parametrize('n_rows, update_state, metadata, state', [
+    (0, True, False, False),
+    (5, False, True, False),
+])
+def test_complete_shard_without_state_update(s3_client, n_rows, update_state, metadata, state):
+    prefix = 'metadata/intake/raw/facebook/'
+    for shard_index in range(2):
+        facebook_ingest.complete_shard(s3_client=s3_client, bucket_name=BUCKET, zone='intake',
+                                       tier='raw', source='facebook', extraction='ad',
+                                       shard_run='1650000000', shard_index=shard_index,
+                                       shard_count=2, execution_time=1650000000,
+                                       process='facebook_ingest', fields=['id'],
+                                       update_state=update_state, n_rows=n_rows, n_fields=1)
+
+    assert (facebook_ingest.read_json(s3_client, BUCKET,
+                                      f"{prefix}ad/dumpdate=1650000000/metadata.json")
+            is not None) == metadata
+    assert (facebook_ingest.read_json(s3_client, BUCKET, f"{prefix}_state/ad.json")
+            is not None) == state
+
+
+def test_select_accounts_partitions_accounts_between_shards():
+    accounts = [new_account(f"act_{i}") for i in range(100)]
+
+    shards = [facebook_ingest.select_accounts(accounts, shard_index=shard_index, shard_count=3)
+              for shard_index in range(3)]
+
+    assert sorted(account['id'] for shard in shards for account in shard) == \
+        sorted(account['id'] for account in accounts)
+    assert all(len(shard) > 0 for shard in shards)
+    assert [account['id'] for account in facebook_ingest.select_accounts(
+        accounts, account_ids=['act_1', 'act_2', 'act_3'], shard_index=0, shard_count=3)] == \
+        [account['id'] for account in shards[0] if account['id'] in ['act_1', 'act_2', 'act_3']]
+
+
+
+@pytest.mark.parametrize('headers, expected', [
+    ({}, (0.0, 0)),
+    ({'x-app-usage': '{"call_count": 80, "total_cputime": 10, "total_time": 5}'}, (80.0, 0)),
+    ({'x-business-use-case-usage': '{"123": [{"type": "ads_insights", "call_count": 20, '
+                                   '"total_cputime": 96, "total_time": 30, '
+                                   '"estimated_time_to_regain_access": 2}]}'}, (96.0, 120)),
+    ({'x-ad-account-usage': '{"acc_id_util_pct": 100, "reset_time_duration": 45}'},
+     (100.0, 45)),
+    ({'x-app-usage': '{"call_count": 40}', 'x-ad-account-usage': 'not json'}, (40.0, 0)),
+])
+def test_parse_usage_headers(headers, expected):
+    assert facebook_ingest.parse_usage_headers(headers) == expected
+
+
+def test_rate_limiter_spreads_requests_over_the_rate(clock):
+    rate_limiter = facebook_ingest.RateLimiter(rate=10, capacity=2)
+
+    waits = [rate_limiter.acquire() for _ in range(4)]
+
+    assert waits == [0, 0, pytest.approx(0.1), pytest.approx(0.1)]
+    assert rate_limiter.stats()['throttled_seconds'] == pytest.approx(0.2)
+
+
+def test_rate_limiter_weights_batch_requests(clock):
+    rate_limiter = facebook_ingest.RateLimiter(rate=10, capacity=10)
+
+    assert rate_limiter.acquire(50) == 0
+    # The 40 calls beyond the capacity are paid by the following request
+    assert rate_limiter.acquire() == pytest.approx(4.1)
+
+
+@pytest.mark.parametrize('usage, rate', [(50, 10), (75, 10), (90, 4), (99, 0.5)])
+def test_rate_limiter_paces_requests_above_the_usage_threshold(clock, usage, rate):
+    rate_limiter = facebook_ingest.RateLimiter(rate=10, min_rate=0.5, usage_threshold=75)
+
+    rate_limiter.update_from_headers({'x-app-usage': f'{{"call_count": {usage}}}'})
+
+    assert rate_limiter.rate == pytest.approx(rate)
+    assert rate_limiter.acquire() == 0
+
+
+@pytest.mark.parametrize('header, blocked', [
+    ('{"call_count": 100}', 60),
+    ('{"call_count": 100, "estimated_time_to_regain_access": 5}', 300),
+])
+def test_rate_limiter_holds_requests_at_full_usage(clock, header, blocked):
+    rate_limiter = facebook_ingest.RateLimiter(rate=10, cooldown=60)
+
+    rate_limiter.update_from_headers({'x-app-usage': header})
+
+    assert rate_limiter.acquire() == pytest.approx(blocked)
+
+
+def test_throttled_api_weights_batch_calls(api):
+    acquired = []
+    api.rate_limiter.acquire = lambda tokens=1: acquired.append(tokens) or 0
+    api.respond = preview_responses({})
+
+    facebook_ingest.get_previews({str(key): (str(key), 'MOBILE_FEED_STANDARD')
+                                  for key in range(70)})
+
+    assert acquired == [50, 20]
+
+
+def request_error(code: int) -> FacebookRequestError:
+    return FacebookRequestError('Call was not successful', {'method': 'GET', 'path': 'me'},
+                                400, {}, json.dumps({'error': {'code': code, 'message': 'error'}}))
+
+
+@pytest.mark.parametrize('code', [17, 80004])
+def test_throttled_api_retries_throttling_errors(api, code):
+    errors = [request_error(code), request_error(code)]
+
+    def respond(method, path, params):
+        if len(errors) > 0:
+            raise errors.pop(0)
+        return FacebookResponse(body=json.dumps({'id': 'me'}), http_status=200, headers={})
+
+    api.respond = respond
+
+    assert api.call('GET', ('me',)).json() == {'id': 'me'}
+    assert len(api.calls) == 3
+    assert api.rate_limiter.n_throttling_errors == 2
+
+
+def test_throttled_api_counts_response_bytes(api, monkeypatch):
+    instrumentation = facebook_ingest.Instrumentation()
+    monkeypatch.setattr(facebook_ingest, 'INSTRUMENTATION', instrumentation)
+    body = json.dumps({'name': 'Caffè'}, ensure_ascii=False)
+    api.respond = lambda method, path, params: FacebookResponse(body=body, http_status=200,
+                                                                headers={})
+
+    instrumentation.set_context(object_type='ad')
+    api.call('GET', ('me',))
+
+    assert instrumentation.report('ad')['sections']['http']['bytes'] == len(body) + 1
+
+
+def test_throttled_api_gives_up_after_max_retries(api):
+    def respond(method, path, params):
+        raise request_error(17)
+
+    api.respond = respond
+
+    with pytest.raises(FacebookRequestError):
+        api.call('GET', ('me',))
+    assert len(api.calls) == facebook_ingest.MAX_THROTTLING_RETRIES + 1
+
+
+def test_throttled_api_does_not_retry_other_errors(api):
+    def respond(method, path, params):
+        raise request_error(100)
+
+    api.respond = respond
+
+    with pytest.raises(FacebookRequestError) as error:
+        api.call('GET', ('me',))
+    assert error.value.api_error_code() == 100
+    assert len(api.calls) == 1
+    assert api.rate_limiter.n_throttling_errors == 0
+
+
+def edge_responses(api, n_rows: int, report_run_ids: Dict[str, str] = None):
+    """
+    Respond to the requests of the pages of the campaigns of any ad account, or of the results of
+    the report jobs in report_run_ids (ad account id by report job id), with n_rows objects each.
+    The cursor of a page is the offset of its first object. Report jobs are completed at once,
+    but the ones missing from report_run_ids can't be polled, and new ones are submitted as the
+    report job 'new' of their ad account. The node and cursor of every page are recorded in
+    api.pages.
+    """
+    report_run_ids = report_run_ids or {}
+    api.pages = []
+
+    def respond(method, path, params):
+        if 'batch' in params:
+            report_run_id = lambda request: request['relative_url'].split('/')[0]
+            return batch_response(*[{'id': report_run_id(request),
+                                     'async_status': 'Job Completed'}
+                                    if report_run_id(request) in report_run_ids else
+                                    {'error': {'code': 100, 'message': 'Unsupported get request'}}
+                                    for request in params['batch']])
+        if method == 'POST':
+            report_run_ids['new'] = path[0]
+            return FacebookResponse(body=json.dumps({'report_run_id': 'new'}), http_status=200)
+
+        node, limit, after = path[0], int(params.get('limit', 2)), int(params.get('after', 0))
+        api.pages.append((node, after))
+        account_id = report_run_ids.get(node, node)
+        rows = [{'id': f"{account_id}-{node}-{i}", 'account_id': account_id, 'ad_id': str(i),
+                 'date_start': '2022-01-01'} for i in range(after, min(after + limit, n_rows))]
+        page = {'data': rows, 'paging': {'cursors': {'after': str(after + limit)}}}
+        if after + limit < n_rows:
+            page['paging']['next'] = 'url'
+        return FacebookResponse(body=json.dumps(page), http_status=200, headers={})
+
+    api.respond = respond
+
+
+def new_writer(extraction: str) -> 'facebook_ingest.ParquetChunkWriter':
+    return facebook_ingest.ParquetChunkWriter(execution_time=1650000000, bucket_name=BUCKET,
+                                              zone='intake', tier='raw', source='facebook',
+                                              extraction=extraction,
+                                              partition_columns=facebook_ingest.PARTITION,
+                                              chunk_rows=2, chunk_mb=64, update_catalog=False)
+
+
+def new_checkpoint(s3_client, extraction: str) -> 'facebook_ingest.Checkpoint':
+    return facebook_ingest.Checkpoint(s3_client=s3_client, bucket_name=BUCKET,
+                                      key=facebook_ingest.get_checkpoint_key(
+                                          zone='intake', tier='raw', source='facebook',
+                                          extraction=extraction))
+
+
+def list_files(s3_client, extraction: str) -> List[str]:
+    response = s3_client.list_objects_v2(Bucket=BUCKET, Prefix=f"intake/raw/facebook/{extraction}/")
+    return sorted(obj['Key'].split('/')[-1] for obj in response.get('Contents', []))
+
+
+def new_account(account_id: str) -> AdAccount:
+    account = AdAccount(account_id)
+    account['name'] = account_id
+    return account
+
+
+def test_checkpoint_round_trip(s3_client):
+    writer = new_writer('campaign')
+    checkpoint = new_checkpoint(s3_client, 'campaign')
+    assert not checkpoint.load()
+
+    checkpoint.start(execution_time=1650000000, latest_epoch='1649990000')
+    checkpoint.advance('act_1', writer=writer, after='MQ', chunks=1, rows=2, done=False)
+
+    resumed = new_checkpoint(s3_client, 'campaign')
+    assert resumed.load()
+    assert resumed.plan == {'execution_time': 1650000000, 'latest_epoch': '1649990000'}
+    assert resumed.position('act_1') == {'after': 'MQ', 'chunks': 1, 'rows': 2, 'done': False}
+    assert resumed.position('act_2') == {}
+
+    resumed.clear()
+    assert not new_checkpoint(s3_client, 'campaign').load()
+
+
+def test_extract_accounts_resumes_from_the_checkpoint(s3_client, api):
+    edge_responses(api, n_rows=5)
+    checkpoint = new_checkpoint(s3_client, 'campaign')
+    checkpoint.start(execution_time=1650000000)
+    checkpoint.advance('act_1', writer=new_writer('campaign'), done=True)
+    checkpoint.advance('act_2', writer=new_writer('campaign'), after='2', chunks=1, rows=2,
+                       done=False)
+
+    resumed = new_checkpoint(s3_client, 'campaign')
+    resumed.load()
+    writer = new_writer('campaign')
+    writer.restore(resumed.writer)
+    facebook_ingest.extract_accounts(object_type='campaign',
+                                     accounts=[new_account('act_1'), new_account('act_2')],
+                                     fields={'campaign': ['id', 'account_id']},
+                                     params={'limit': 2}, max_workers=1, writer=writer,
+                                     checkpoint=resumed)
+
+    # act_1 is done, act_2 goes on from its cursor, after its checkpointed chunk
+    assert api.pages == [('act_2', 2), ('act_2', 4)]
+    assert list_files(s3_client, 'campaign') == ['act_2-00001.snappy.parquet',
+                                                 'act_2-00002.snappy.parquet']
+    assert new_checkpoint(s3_client, 'campaign').load()
+    assert resumed.position('act_2') == {'after': None, 'chunks': 3, 'rows': 5,
+                                         'report_run_id': None, 'done': True, 'pages': None}
+    assert writer.n_rows == 3
+
+
+def test_extract_accounts_restarts_expired_report_jobs(s3_client, api, clock):
+    edge_responses(api, n_rows=3)
+    fields = {'ad_insights': ['ad_id', 'date_start', 'account_id']}
+    params = {'limit': 2, 'time_range': {'since': '2022-01-01', 'until': '2022-01-07'}}
+
+    # An interrupted run wrote a chunk of the report job 'old', which expired since
+    interrupted = new_writer('ad_insights')
+    interrupted.write_file(facebook_ingest.pd.DataFrame({'ad_id': ['0', '1'],
+                                                         'account_id': ['act_1', 'act_1']}),
+                           name='act_1-00000')
+    checkpoint = new_checkpoint(s3_client, 'ad_insights')
+    checkpoint.start(execution_time=1650000000)
+    checkpoint.advance('act_1', writer=interrupted, after='2', chunks=1, rows=2,
+                       report_run_id='old', done=False)
+
+    resumed = new_checkpoint(s3_client, 'ad_insights')
+    resumed.load()
+    writer = new_writer('ad_insights')
+    writer.restore(resumed.writer)
+    facebook_ingest.extract_accounts(object_type='ad_insights', accounts=[new_account('act_1')],
+                                     fields=fields, params=params, max_workers=1, writer=writer,
+                                     checkpoint=resumed)
+
+    # The chunk of the old job is replaced by the results of the new one, from the first page
+    assert api.pages == [('new', 0), ('new', 2)]
+    assert resumed.position('act_1') == {'after': None, 'chunks': 2, 'rows': 3,
+                                         'report_run_id': 'new', 'done': True, 'pages': None}
+    assert list_files(s3_client, 'ad_insights') == ['act_1-00000.snappy.parquet',
+                                                    'act_1-00001.snappy.parquet']
+    assert writer.n_rows == 3
+
+
+def test_read_json_of_write_json(s3_client):
+    assert facebook_ingest.read_json(s3_client, BUCKET, 'state.json') is None
+
+    facebook_ingest.write_json(s3_client, BUCKET, 'state.json',
+                               {'execution_time': 1650000000, 'since': datetime.date(2022, 1, 1)})
+
+    assert facebook_ingest.read_json(s3_client, BUCKET, 'state.json') == \
+        {'execution_time': 1650000000, 'since': '2022-01-01'}
+
+
+def write_metadata(s3_client, execution_time: int, **metadata) -> None:
+    facebook_ingest.create_validation_metadata(s3_client=s3_client, execution_time=execution_time,
+                                               bucket_name=BUCKET, zone='intake', tier='raw',
+                                               source='facebook', extraction='ad',
+                                               update_state=False, **metadata)
+
+
+def test_rebuild_state_skips_replays_and_runs_of_some_accounts(s3_client):
+    write_metadata(s3_client, NOW - 3 * HOUR)
+    write_metadata(s3_client, NOW - 2 * HOUR, account_ids=['act_1'])
+    write_metadata(s3_client, NOW - HOUR, replayed=True)
+
+    state = facebook_ingest.rebuild_state(s3_client=s3_client, bucket_name=BUCKET, zone='intake',
+                                          tier='raw', source='facebook', extraction='ad')
+
+    assert state['execution_time'] == NOW - 3 * HOUR
+    assert facebook_ingest.get_latest_epoch(s3_client=s3_client, bucket_name=BUCKET,
+                                            zone='intake', tier='raw', source='facebook',
+                                            extraction='ad') == NOW - 3 * HOUR
+
+
+def test_rebuild_state_requires_a_run_advancing_the_state(s3_client):
+    write_metadata(s3_client, NOW - HOUR, account_ids=['act_1'])
+
+    with pytest.raises(KeyError, match='No metadata'):
+        facebook_ingest.rebuild_state(s3_client=s3_client, bucket_name=BUCKET, zone='intake',
+                                      tier='raw', source='facebook', extraction='ad')
+
+
+class FakeUser:
+    """
+    System user whose ad accounts are set by the tests.
+    """
+
+    def __init__(self):
+        self.accounts = []
+        self.n_listings = 0
+
+    def get_ad_accounts(self, fields: List[str]) -> List[Dict[str, Any]]:
+        self.n_listings += 1
+        return [dict(account) for account in self.accounts]
+
+
+def ad_account(account_id: str, amount_spent: str, account_status: int = 1) -> Dict[str, Any]:
+    return {'id': account_id, 'name': account_id, 'account_status': account_status,
+            'amount_spent': amount_spent}
+
+
+def new_registry(s3_client) -> 'facebook_ingest.AccountRegistry':
+    return facebook_ingest.AccountRegistry(s3_client=s3_client, bucket_name=BUCKET,
+                                           key='ad_accounts.json', ttl_hours=24,
+                                           inactive_days=30, sweep_days=7)
+
+
+def selected_ids(registry: 'facebook_ingest.AccountRegistry', now: int) -> List[str]:
+    selected, _, _ = registry.select(now=now)
+    return sorted(account['id'] for account in selected)
+
+
+def test_account_registry_lists_accounts_only_when_expired(s3_client):
+    user = FakeUser()
+    user.accounts = [ad_account('act_1', '10'), ad_account('act_2', '20', account_status=2)]
+    registry = new_registry(s3_client)
+    registry.load()
+
+    registry.refresh(user=user, now=NOW)
+    registry.save()
+    user.accounts.append(ad_account('act_3', '30'))
+    reloaded = new_registry(s3_client)
+    reloaded.load()
+    reloaded.refresh(user=user, now=NOW + 23 * HOUR)
+
+    assert user.n_listings == 1
+    assert sorted(reloaded.accounts) == ['act_1', 'act_2']
+
+    reloaded.refresh(user=user, now=NOW + 25 * HOUR)
+    assert user.n_listings == 2
+    assert sorted(reloaded.accounts) == ['act_1', 'act_2', 'act_3']
+
+
+def test_account_registry_skips_inactive_accounts_but_on_full_sweeps(s3_client):
+    user = FakeUser()
+    user.accounts = [ad_account('act_1', '10'), ad_account('act_2', '20'),
+                     ad_account('act_3', '30', account_status=2)]
+    registry = new_registry(s3_client)
+    registry.refresh(user=user, now=NOW)
+
+    # The first run is a full sweep
+    _, _, full_sweep = registry.select(now=NOW)
+    assert full_sweep
+    registry.record_sweep(now=NOW)
+
+    # act_1 returns data, act_2 spends, act_3 is not active
+    registry.record_queried(account_ids=['act_1', 'act_2', 'act_3'], object_type='ad',
+                            execution_time=NOW, active_account_ids=['act_1'], now=NOW + 30 * DAY)
+    user.accounts[1]['amount_spent'] = '25'
+    registry.refresh(user=user, now=NOW + 35 * DAY)
+    registry.record_sweep(now=NOW + 35 * DAY)
+    assert selected_ids(registry, now=NOW + 36 * DAY) == ['act_1', 'act_2']
+
+    # 30 days without activity make an ad account inactive, until the next full sweep
+    registry.record_sweep(now=NOW + 60 * DAY)
+    assert selected_ids(registry, now=NOW + 62 * DAY) == ['act_2']
+    assert selected_ids(registry, now=NOW + 67 * DAY) == ['act_1', 'act_2', 'act_3']
+    assert registry.last_queried('act_1', 'ad') == NOW
+    assert registry.last_queried('act_1', 'campaign') is None
+
+
+def test_preview_cache_drops_expired_entries_and_merges_shards(s3_client, clock):
+    cache = facebook_ingest.PreviewCache(s3_client=s3_client, bucket_name=BUCKET,
+                                         key='ad_preview.json', ttl_days=30)
+    cache.load()
+    cache.put('1|MOBILE_FEED_STANDARD|10', 'https://fb.me/1')
+    clock.now += 20 * DAY
+    cache.put('2|MOBILE_FEED_STANDARD|20', 'https://fb.me/2')
+    clock.now += 20 * DAY
+    cache.save()
+
+    shard = facebook_ingest.PreviewCache(s3_client=s3_client, bucket_name=BUCKET,
+                                         key='ad_preview-shard-0-of-2.json', ttl_days=30)
+    shard.put('3|MOBILE_FEED_STANDARD|30', 'https://fb.me/3')
+    shard.save()
+
+    reloaded = facebook_ingest.PreviewCache(s3_client=s3_client, bucket_name=BUCKET,
+                                            key='ad_preview.json', ttl_days=30)
+    reloaded.load()
+    reloaded.merge(key='ad_preview-shard-0-of-2.json')
+    reloaded.merge(key='ad_preview-shard-1-of-2.json')
+
+    assert [reloaded.get(f"{ad_id}|MOBILE_FEED_STANDARD|{ad_id}0") for ad_id in '123'] == \
+        [None, 'https://fb.me/2', 'https://fb.me/3']
+    assert reloaded.stats() == {'hits': 2, 'misses': 1}
+
+
+@pytest.mark.parametrize('time_range, max_days, split, expected', [
+    (('2022-01-01', '2022-01-07'), None, [], [('2022-01-01', '2022-01-07')]),
+    (('2022-01-01', '2022-01-07'), 7, [], [('2022-01-01', '2022-01-07')]),
+    (('2022-01-01', '2022-01-07'), 2, [],
+     [('2022-01-01', '2022-01-02'), ('2022-01-03', '2022-01-04'), ('2022-01-05', '2022-01-06'),
+      ('2022-01-07', '2022-01-07')]),
+    (('2022-01-01', '2022-01-07'), None, [('2022-01-01', '2022-01-07')],
+     [('2022-01-01', '2022-01-04'), ('2022-01-05', '2022-01-07')]),
+    (('2022-01-01', '2022-01-07'), None,
+     [('2022-01-01', '2022-01-07'), ('2022-01-05', '2022-01-07')],
+     [('2022-01-01', '2022-01-04'), ('2022-01-05', '2022-01-06'), ('2022-01-07', '2022-01-07')]),
+    (('2022-01-01', '2022-01-01'), 0, [('2022-01-01', '2022-01-01')],
+     [('2022-01-01', '2022-01-01')]),
+])
+def test_split_report_range(time_range, max_days, split, expected):
+    def to_dict(since_until):
+        return {'since': since_until[0], 'until': since_until[1]}
+
+    parts = facebook_ingest.split_report_range(
+        to_dict(time_range), max_days=max_days,
+        is_split=lambda part: (part['since'], part['until']) in split)
+
+    assert parts == [to_dict(part) for part in expected]
+
+
+def new_tuner(s3_client) -> 'facebook_ingest.RequestTuner':
+    return facebook_ingest.RequestTuner(s3_client=s3_client, bucket_name=BUCKET,
+                                        key='request_tuning.json', min_limit=25, max_limit=5000,
+                                        fast_seconds=5)
+
+
+def test_request_tuner_shrinks_and_grows_page_sizes(s3_client):
+    tuner = new_tuner(s3_client)
+    tuner.load()
+    assert tuner.limit('act_1', 'ad', default=1000) == 1000
+
+    assert tuner.shrink('act_1', 'ad', 1000) == 500
+    # Fast pages grow the page size up to three quarters of the one that failed
+    assert tuner.record_page('act_1', 'ad', 500, seconds=1) == 750
+    assert tuner.record_page('act_1', 'ad', 750, seconds=1) == 750
+    assert tuner.shrink('act_1', 'ad', 750) == 375
+    # Slow pages keep it
+    assert tuner.record_page('act_1', 'ad', 375, seconds=10) == 375
+    assert tuner.shrink('act_1', 'ad', 25) is None
+    tuner.save()
+
+    reloaded = new_tuner(s3_client)
+    reloaded.load()
+    assert reloaded.limit('act_1', 'ad', default=1000) == 375
+    assert reloaded.limit('act_1', 'campaign', default=1000) == 1000
+    assert reloaded.limit('act_2', 'ad', default=1000) == 1000
+
+
+def test_request_tuner_lowers_report_days(s3_client):
+    tuner = new_tuner(s3_client)
+    assert tuner.report_days('act_1') is None
+
+    tuner.record_split('act_1', days=14)
+    tuner.record_split('act_1', days=28)
+    tuner.record_split('act_2', days=7)
+
+    assert tuner.report_days('act_1') == 14
+    assert tuner.report_days('act_2') == 7
+
+
+def test_iter_pages_shrinks_oversized_pages(s3_client):
+    tuner = new_tuner(s3_client)
+    limits = []
+
+    def fetch_page(page_params):
+        limits.append(page_params['limit'])
+        if page_params['limit'] > 300:
+            raise request_error(1)
+        after = int(page_params.get('after', 0))
+        next_after = after + page_params['limit']
+        return list(range(after, min(next_after, 1000))), \
+            str(next_after) if next_after < 1000 else None
+
+    objects = [object for page, _ in facebook_ingest.iter_pages(fetch_page, limit=1000,
+                                                                 tuner=tuner, account_id='act_1',
+                                                                 object_type='ad')
+               for object in page]
+
+    assert objects == list(range(1000))
+    assert limits[:4] == [1000, 500, 250, 375]
+    assert tuner.limit('act_1', 'ad', default=1000) <= 300